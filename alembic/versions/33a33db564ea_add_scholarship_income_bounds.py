@@ -0,0 +1,105 @@
+"""Add scholarship income bounds
+
+Revision ID: 33a33db564ea
+Revises: c06bbd998752
+Create Date: 2026-10-17 10:03:55.918402
+
+"""
+import re
+import unicodedata
+from typing import Optional, Sequence, Tuple, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '33a33db564ea'
+down_revision: Union[str, Sequence[str], None] = 'c06bbd998752'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+# --------------------------------------------------------------------
+# このリビジョン作成時点の app.income.parse_income_requirement の写し
+# (アプリ側の解析ルールが変わっても、このマイグレーションの結果が変わらないよう固定する)
+# --------------------------------------------------------------------
+_UNRESTRICTED_WORDS = {"", "条件なし", "制限なし", "不問", "なし"}
+_MAN = 10_000
+_OKU = 100_000_000
+_NUMBER = r"(\d+(?:\.\d+)?)\s*(億|万)?\s*円?"
+_RANGE_RE = re.compile(_NUMBER + r"\s*[~〜～\-－]\s*" + _NUMBER)
+_OPEN_UPPER_RE = re.compile(r"^[~〜～]\s*" + _NUMBER + r"$")
+_OPEN_LOWER_RE = re.compile(r"^" + _NUMBER + r"\s*[~〜～]$")
+_BOUND_RE = re.compile(_NUMBER + r"\s*(未満|以下|以上|超|を超える|より上|まで)")
+
+
+def _to_yen(number: str, unit: Optional[str]) -> int:
+    value = float(number)
+    if unit == "億":
+        value *= _OKU
+    elif unit == "万":
+        value *= _MAN
+    return int(round(value))
+
+
+def _parse_income_requirement(text: Optional[str]) -> Optional[Tuple[int, Optional[int]]]:
+    """年収条件の文字列を (下限, 上限) の円に変換する。上限なしは None、解析できない場合は None を返す"""
+    normalized = unicodedata.normalize("NFKC", text or "").replace(",", "").strip()
+    if normalized in _UNRESTRICTED_WORDS:
+        return 0, None
+
+    match = _RANGE_RE.search(normalized)
+    if match:
+        low_num, low_unit, high_num, high_unit = match.groups()
+        return _to_yen(low_num, low_unit or high_unit), _to_yen(high_num, high_unit)
+
+    match = _OPEN_UPPER_RE.match(normalized)
+    if match:
+        return 0, _to_yen(*match.groups())
+
+    match = _OPEN_LOWER_RE.match(normalized)
+    if match:
+        return _to_yen(*match.groups()), None
+
+    match = _BOUND_RE.search(normalized)
+    if match:
+        number, unit, qualifier = match.groups()
+        yen = _to_yen(number, unit)
+        if qualifier == "未満":
+            return 0, yen
+        if qualifier in ("以下", "まで"):
+            return 0, yen + 1
+        if qualifier == "以上":
+            return yen, None
+        return yen + 1, None
+
+    return None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('scholarship', sa.Column('income_min', sa.Integer(), nullable=True))
+    op.add_column('scholarship', sa.Column('income_max', sa.Integer(), nullable=True))
+    op.create_index(op.f('ix_scholarship_income_min'), 'scholarship', ['income_min'], unique=False)
+    op.create_index(op.f('ix_scholarship_income_max'), 'scholarship', ['income_max'], unique=False)
+
+    # 既存データの年収条件を解析して埋める
+    bind = op.get_bind()
+    rows = bind.execute(sa.text("SELECT id, income_requirement FROM scholarship")).all()
+    for row_id, income_requirement in rows:
+        income_range = _parse_income_requirement(income_requirement)
+        if income_range is None:
+            continue
+        bind.execute(
+            sa.text("UPDATE scholarship SET income_min = :min, income_max = :max WHERE id = :id"),
+            {"min": income_range[0], "max": income_range[1], "id": row_id},
+        )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_scholarship_income_max'), table_name='scholarship')
+    op.drop_index(op.f('ix_scholarship_income_min'), table_name='scholarship')
+    op.drop_column('scholarship', 'income_max')
+    op.drop_column('scholarship', 'income_min')
@@ -0,0 +1,43 @@
+"""Add scholarship natural key
+
+Revision ID: 56561f847e1b
+Revises: 58c64e47466f
+Create Date: 2026-10-17 11:58:42.107735
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '56561f847e1b'
+down_revision: Union[str, Sequence[str], None] = '58c64e47466f'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 従来の seed.py の再実行で生じた重複を、最も古い行にまとめてから一意制約を付与する
+    op.execute("""
+        CREATE TEMPORARY TABLE scholarship_dedup ON COMMIT DROP AS
+        SELECT id, min(id) OVER (PARTITION BY name, provider) AS keep_id
+        FROM scholarship
+    """)
+    op.execute("""
+        UPDATE matchresult m SET scholarship_id = d.keep_id
+        FROM scholarship_dedup d
+        WHERE m.scholarship_id = d.id AND d.id <> d.keep_id
+    """)
+    op.execute("""
+        DELETE FROM scholarship s USING scholarship_dedup d
+        WHERE s.id = d.id AND d.id <> d.keep_id
+    """)
+    op.create_unique_constraint('uq_scholarship_name_provider', 'scholarship', ['name', 'provider'])
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_constraint('uq_scholarship_name_provider', 'scholarship', type_='unique')
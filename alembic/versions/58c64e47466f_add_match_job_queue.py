@@ -0,0 +1,47 @@
+"""Add match job queue
+
+Revision ID: 58c64e47466f
+Revises: 5e03cbd600f5
+Create Date: 2026-10-17 11:20:08.331870
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '58c64e47466f'
+down_revision: Union[str, Sequence[str], None] = '5e03cbd600f5'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('matchjob',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('profile_id', sa.Integer(), nullable=False),
+    sa.Column('status', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('last_error', sqlmodel.sql.sqltypes.AutoString(), nullable=True),
+    sa.Column('run_after', sa.DateTime(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('started_at', sa.DateTime(), nullable=True),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['profile_id'], ['profile.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_matchjob_profile_id'), 'matchjob', ['profile_id'], unique=False)
+    op.create_index(op.f('ix_matchjob_run_after'), 'matchjob', ['run_after'], unique=False)
+    op.create_index(op.f('ix_matchjob_status'), 'matchjob', ['status'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_matchjob_status'), table_name='matchjob')
+    op.drop_index(op.f('ix_matchjob_run_after'), table_name='matchjob')
+    op.drop_index(op.f('ix_matchjob_profile_id'), table_name='matchjob')
+    op.drop_table('matchjob')
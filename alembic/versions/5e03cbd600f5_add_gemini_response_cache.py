@@ -0,0 +1,39 @@
+"""Add gemini response cache
+
+Revision ID: 5e03cbd600f5
+Revises: 33a33db564ea
+Create Date: 2026-10-17 10:41:27.660193
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '5e03cbd600f5'
+down_revision: Union[str, Sequence[str], None] = '33a33db564ea'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('geminiresponsecache',
+    sa.Column('key', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('catalog_version', sa.Integer(), nullable=False),
+    sa.Column('response_json', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('key')
+    )
+    op.create_index(op.f('ix_geminiresponsecache_catalog_version'), 'geminiresponsecache', ['catalog_version'], unique=False)
+    op.create_index(op.f('ix_geminiresponsecache_created_at'), 'geminiresponsecache', ['created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_geminiresponsecache_created_at'), table_name='geminiresponsecache')
+    op.drop_index(op.f('ix_geminiresponsecache_catalog_version'), table_name='geminiresponsecache')
+    op.drop_table('geminiresponsecache')
@@ -0,0 +1,30 @@
+"""Add retention indexes
+
+Revision ID: 9d6ef2428f4a
+Revises: 56561f847e1b
+Create Date: 2026-10-17 12:31:16.540829
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '9d6ef2428f4a'
+down_revision: Union[str, Sequence[str], None] = '56561f847e1b'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index(op.f('ix_profile_created_at'), 'profile', ['created_at'], unique=False)
+    op.create_index(op.f('ix_matchresult_deadline'), 'matchresult', ['deadline'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_matchresult_deadline'), table_name='matchresult')
+    op.drop_index(op.f('ix_profile_created_at'), table_name='profile')
@@ -0,0 +1,45 @@
+"""Add matchjob active profile unique index
+
+Revision ID: a8d3f5c7e2b9
+Revises: f2b6d9c1a4e8
+Create Date: 2026-10-17 21:04:37.512946
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a8d3f5c7e2b9'
+down_revision: Union[str, Sequence[str], None] = 'f2b6d9c1a4e8'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 既に重複している未完了のジョブは、プロフィールごとに最新の1件を残して failed にする
+    op.execute(
+        """
+        UPDATE matchjob SET status = 'failed', finished_at = now() AT TIME ZONE 'utc',
+               last_error = '同じプロフィールの未完了ジョブが重複していたため停止しました'
+        WHERE status IN ('queued', 'running')
+          AND profile_id IS NOT NULL
+          AND id NOT IN (
+              SELECT max(id) FROM matchjob
+              WHERE status IN ('queued', 'running') AND profile_id IS NOT NULL
+              GROUP BY profile_id
+          )
+        """
+    )
+    op.create_index(
+        'uq_matchjob_profile_active', 'matchjob', ['profile_id'], unique=True,
+        postgresql_where=sa.text("status IN ('queued', 'running')"),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('uq_matchjob_profile_active', table_name='matchjob', postgresql_where=sa.text("status IN ('queued', 'running')"))
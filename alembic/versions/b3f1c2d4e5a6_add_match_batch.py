@@ -0,0 +1,61 @@
+"""Add match batch
+
+Revision ID: b3f1c2d4e5a6
+Revises: 9d6ef2428f4a
+Create Date: 2026-10-17 14:05:41.118204
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b3f1c2d4e5a6'
+down_revision: Union[str, Sequence[str], None] = '9d6ef2428f4a'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('matchbatch',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('status', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('total', sa.Integer(), nullable=False),
+    sa.Column('completed', sa.Integer(), nullable=False),
+    sa.Column('gemini_calls', sa.Integer(), nullable=False),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('finished_at', sa.DateTime(), nullable=True),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_matchbatch_status'), 'matchbatch', ['status'], unique=False)
+    op.create_index(op.f('ix_matchbatch_created_at'), 'matchbatch', ['created_at'], unique=False)
+
+    op.add_column('profile', sa.Column('batch_id', sa.Integer(), nullable=True))
+    op.create_index(op.f('ix_profile_batch_id'), 'profile', ['batch_id'], unique=False)
+    op.create_foreign_key('profile_batch_id_fkey', 'profile', 'matchbatch', ['batch_id'], ['id'])
+
+    op.add_column('matchjob', sa.Column('batch_id', sa.Integer(), nullable=True))
+    op.create_index(op.f('ix_matchjob_batch_id'), 'matchjob', ['batch_id'], unique=False)
+    op.create_foreign_key('matchjob_batch_id_fkey', 'matchjob', 'matchbatch', ['batch_id'], ['id'])
+    op.alter_column('matchjob', 'profile_id', existing_type=sa.Integer(), nullable=True)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.execute("DELETE FROM matchjob WHERE profile_id IS NULL")
+    op.alter_column('matchjob', 'profile_id', existing_type=sa.Integer(), nullable=False)
+    op.drop_constraint('matchjob_batch_id_fkey', 'matchjob', type_='foreignkey')
+    op.drop_index(op.f('ix_matchjob_batch_id'), table_name='matchjob')
+    op.drop_column('matchjob', 'batch_id')
+
+    op.drop_constraint('profile_batch_id_fkey', 'profile', type_='foreignkey')
+    op.drop_index(op.f('ix_profile_batch_id'), table_name='profile')
+    op.drop_column('profile', 'batch_id')
+
+    op.drop_index(op.f('ix_matchbatch_created_at'), table_name='matchbatch')
+    op.drop_index(op.f('ix_matchbatch_status'), table_name='matchbatch')
+    op.drop_table('matchbatch')
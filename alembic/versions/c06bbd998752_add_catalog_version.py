@@ -0,0 +1,34 @@
+"""Add catalog version
+
+Revision ID: c06bbd998752
+Revises: 69c9c017238c
+Create Date: 2026-10-17 09:12:41.204118
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c06bbd998752'
+down_revision: Union[str, Sequence[str], None] = '69c9c017238c'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('catalogversion',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.Column('updated_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.execute("INSERT INTO catalogversion (id, version, updated_at) VALUES (1, 0, now())")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('catalogversion')
@@ -0,0 +1,29 @@
+"""Add matchjob results_after_id
+
+Revision ID: c4e7a1f9b2d6
+Revises: a8d3f5c7e2b9
+Create Date: 2026-10-17 23:41:18.207365
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'c4e7a1f9b2d6'
+down_revision: Union[str, Sequence[str], None] = 'a8d3f5c7e2b9'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 既存のジョブは NULL のまま（全ての結果をそのジョブの結果として扱う）
+    op.add_column('matchjob', sa.Column('results_after_id', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('matchjob', 'results_after_id')
@@ -0,0 +1,28 @@
+"""Add matchresult provisional flag
+
+Revision ID: d7a9e3b1c4f2
+Revises: b3f1c2d4e5a6
+Create Date: 2026-10-17 15:22:09.604117
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd7a9e3b1c4f2'
+down_revision: Union[str, Sequence[str], None] = 'b3f1c2d4e5a6'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('matchresult', sa.Column('provisional', sa.Boolean(), nullable=False, server_default=sa.false()))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('matchresult', 'provisional')
@@ -0,0 +1,51 @@
+"""Add segment ranking
+
+Revision ID: e4c8b2a7f913
+Revises: d7a9e3b1c4f2
+Create Date: 2026-10-17 16:48:27.530911
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e4c8b2a7f913'
+down_revision: Union[str, Sequence[str], None] = 'd7a9e3b1c4f2'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_table('segmentranking',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('grade', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('prefecture', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('income_band', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('major', sqlmodel.sql.sqltypes.AutoString(), nullable=False),
+    sa.Column('has_social_care', sa.Boolean(), nullable=False),
+    sa.Column('scholarship_ids', postgresql.ARRAY(sa.Integer()), nullable=True),
+    sa.Column('scores', postgresql.ARRAY(sa.Float()), nullable=True),
+    sa.Column('eligible_count', sa.Integer(), nullable=False),
+    sa.Column('catalog_version', sa.Integer(), nullable=False),
+    sa.Column('as_of', sa.Date(), nullable=False),
+    sa.Column('valid_until', sa.Date(), nullable=True),
+    sa.Column('profile_count', sa.Integer(), nullable=False),
+    sa.Column('refreshed_at', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('grade', 'prefecture', 'income_band', 'major', 'has_social_care', name='uq_segmentranking_segment')
+    )
+    op.create_index(op.f('ix_segmentranking_catalog_version'), 'segmentranking', ['catalog_version'], unique=False)
+    op.create_index(op.f('ix_segmentranking_valid_until'), 'segmentranking', ['valid_until'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index(op.f('ix_segmentranking_valid_until'), table_name='segmentranking')
+    op.drop_index(op.f('ix_segmentranking_catalog_version'), table_name='segmentranking')
+    op.drop_table('segmentranking')
@@ -0,0 +1,32 @@
+"""Add scholarship array gin indexes
+
+Revision ID: f2b6d9c1a4e8
+Revises: e4c8b2a7f913
+Create Date: 2026-10-17 19:12:05.184233
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f2b6d9c1a4e8'
+down_revision: Union[str, Sequence[str], None] = 'e4c8b2a7f913'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_scholarship_eligible_grades', 'scholarship', ['eligible_grades'], unique=False, postgresql_using='gin')
+    op.create_index('ix_scholarship_eligible_prefs', 'scholarship', ['eligible_prefs'], unique=False, postgresql_using='gin')
+    op.create_index('ix_scholarship_fields', 'scholarship', ['fields'], unique=False, postgresql_using='gin')
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_scholarship_fields', table_name='scholarship', postgresql_using='gin')
+    op.drop_index('ix_scholarship_eligible_prefs', table_name='scholarship', postgresql_using='gin')
+    op.drop_index('ix_scholarship_eligible_grades', table_name='scholarship', postgresql_using='gin')
@@ -0,0 +1,213 @@
+import os
+import asyncio
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import insert
+from sqlmodel import Session, select
+
+from .models import Profile, ProfileBase, MatchBatch, MatchJob, MatchResult
+from .catalog import ScholarshipCatalog, get_catalog
+from .batch_scoring import rule_based_top_k
+from .matching_logic import rule_based_match_results
+from .prompt_builder import select_prompt_candidates
+from .gemini_client import GEMINI_TIMEOUT_SECONDS, GEMINI_MAX_CONCURRENCY
+from .gemini_cache import cached_generate_match_results, profile_fingerprint
+from .results_writer import get_name_resolver, match_results_from_gemini, write_match_results
+from .scoring_context import ScoringContext
+from .metrics import MatchTimings, match_timings, observe_stage, MATCH_FALLBACKS
+
+# 1回の一括マッチングで受け付けるプロフィールの上限
+MATCH_BATCH_MAX_PROFILES = int(os.getenv("MATCH_BATCH_MAX_PROFILES", "1000"))
+
+
+# ====================================================================
+# バッチの登録
+# ====================================================================
+def create_match_batch(session: Session, profiles: Sequence[ProfileBase]) -> Tuple[MatchBatch, MatchJob]:
+    """
+    プロフィールを複数行 INSERT でまとめて登録し、バッチとその処理ジョブを作成する
+    """
+    batch = MatchBatch(total=len(profiles))
+    session.add(batch)
+    session.flush() # batch.id を確定させる
+
+    created_at = datetime.utcnow()
+    rows = [
+        {**profile.model_dump(), "batch_id": batch.id, "created_at": created_at}
+        for profile in profiles
+    ]
+    session.execute(insert(Profile.__table__).values(rows))
+
+    job = MatchJob(batch_id=batch.id)
+    session.add(job)
+    session.commit()
+    session.refresh(batch)
+    session.refresh(job)
+    return batch, job
+
+
+# ====================================================================
+# バッチの処理（ワーカーから呼び出される）
+# ====================================================================
+def _group_identical(profiles: Sequence[Profile], catalog_version: int) -> Dict[str, List[Profile]]:
+    """Geminiへの入力が同じになるプロフィールをまとめる（キーは応答キャッシュと同じ指紋）"""
+    groups: Dict[str, List[Profile]] = {}
+    for profile in profiles:
+        groups.setdefault(profile_fingerprint(profile, catalog_version), []).append(profile)
+    return groups
+
+
+async def _match_group(
+    profile: Profile,
+    catalog: ScholarshipCatalog,
+    limiter: asyncio.Semaphore,
+    context: ScoringContext,
+):
+    """代表のプロフィールでGeminiを1回だけ呼び出す。失敗した場合は例外を送出する"""
+    with observe_stage("rule_scoring"):
+        positions = select_prompt_candidates(catalog, profile, context=context)
+    if not positions:
+        raise ValueError("必須条件を満たす奨学金がありません")
+    # 順番待ちの時間がタイムアウトに含まれないよう、枠を確保してから時間を計る
+    async with limiter:
+        return await asyncio.wait_for(
+            cached_generate_match_results(profile, catalog, positions),
+            timeout=GEMINI_TIMEOUT_SECONDS
+        )
+
+
+async def run_batch_matching(batch_id: int, session: Session):
+    """
+    バッチ内の全プロフィールをマッチングし、結果をまとめて保存する
+    同じ内容のプロフィールはGemini呼び出しを1回にまとめ、失敗したグループはルールベースの結果にする
+    DBの読み書きは別スレッドで行い、イベントループ上ではGeminiの応答だけを待つ
+    """
+    if not await asyncio.to_thread(_start_batch, session, batch_id):
+        print(f"[batch {batch_id}] エラー: バッチが見つかりません。")
+        return
+
+    with match_timings("batch", batch_id=batch_id) as timings:
+        await _run_batch(batch_id, session, timings)
+
+
+def _start_batch(session: Session, batch_id: int) -> bool:
+    batch = session.get(MatchBatch, batch_id)
+    if batch is None:
+        return False
+    batch.status = "running"
+    session.add(batch)
+    session.commit()
+    return True
+
+
+def _load_batch(session: Session, batch_id: int) -> Tuple[List[Profile], ScholarshipCatalog]:
+    profiles = session.exec(
+        select(Profile).where(Profile.batch_id == batch_id).order_by(Profile.id)
+    ).all()
+    # 別スレッドでコミットしても、読み込んだプロフィールが再読み込みされないよう切り離す
+    for profile in profiles:
+        session.expunge(profile)
+    with observe_stage("catalog_load"):
+        catalog = get_catalog(session)
+    return profiles, catalog
+
+
+def _finish_batch(session: Session, batch_id: int, match_results: List[MatchResult], completed: int, gemini_calls: int):
+    """全員分の結果を複数行 INSERT で保存し、バッチを完了にする"""
+    with observe_stage("db_write"):
+        write_match_results(session, match_results)
+        batch = session.get(MatchBatch, batch_id)
+        batch.status = "done"
+        batch.completed = completed
+        batch.gemini_calls = gemini_calls
+        batch.finished_at = datetime.utcnow()
+        session.add(batch)
+        session.commit()
+
+
+async def _run_batch(batch_id: int, session: Session, timings: MatchTimings):
+    """run_batch_matching の本体（所要時間の計測の内側で実行する）"""
+    profiles, catalog = await asyncio.to_thread(_load_batch, session, batch_id)
+    # 採点の基準日はバッチ全体で1つに固定する
+    context = ScoringContext.now()
+    groups = _group_identical(profiles, catalog.version)
+    print(f"[batch {batch_id}] {len(profiles)} 件 ({len(groups)} 種類のプロフィール) のマッチングを開始...")
+
+    # 1. 種類ごとに1回だけGeminiを呼び出す
+    representatives = [members[0] for members in groups.values()]
+    limiter = asyncio.Semaphore(GEMINI_MAX_CONCURRENCY)
+    responses = await asyncio.gather(
+        *(_match_group(profile, catalog, limiter, context) for profile in representatives),
+        return_exceptions=True
+    )
+
+    # 2. Geminiが失敗したグループのみ、ルールベースでまとめて採点する
+    failed = [
+        profile for members, response in zip(groups.values(), responses)
+        if isinstance(response, BaseException)
+        for profile in members
+    ]
+    with observe_stage("rule_scoring"):
+        fallback = dict(zip((p.id for p in failed), rule_based_top_k(catalog, failed, context)))
+    if failed:
+        MATCH_FALLBACKS.labels("batch").inc(len(failed))
+
+    resolver = get_name_resolver(catalog)
+    match_results: List[MatchResult] = []
+    for members, response in zip(groups.values(), responses):
+        for profile in members:
+            results: Optional[List[MatchResult]] = None
+            if not isinstance(response, BaseException):
+                results, unresolved = match_results_from_gemini(profile.id, response, resolver)
+                if unresolved:
+                    print(f"[batch {batch_id}] 警告: カタログに存在しない奨学金名を除外しました: {unresolved}")
+            if not results:
+                ranked = fallback.get(profile.id)
+                if ranked is None:
+                    # Geminiは成功したが、結果をカタログに対応付けられなかった
+                    MATCH_FALLBACKS.labels("batch").inc()
+                    ranked = next(rule_based_top_k(catalog, [profile], context))
+                results = rule_based_match_results(profile, ranked)
+            match_results.extend(results)
+
+    # 3. 全員分の結果を複数行 INSERT で保存し、バッチを完了にする
+    await asyncio.to_thread(_finish_batch, session, batch_id, match_results, len(profiles), len(groups))
+    timings.fields.update(profiles=len(profiles), groups=len(groups), fallback_profiles=len(failed))
+    print(
+        f"[batch {batch_id}] 完了: 結果 {len(match_results)} 件を保存 "
+        f"(Gemini {len(groups) - sum(isinstance(r, BaseException) for r in responses)}/{len(groups)} 成功)"
+    )
+
+
+# ====================================================================
+# 結果の読み出し（ページング・ストリーミング用）
+# ====================================================================
+def batch_results_page(
+    session: Session,
+    batch_id: int,
+    after_profile_id: int = 0,
+    limit: int = 100,
+) -> List[Dict]:
+    """
+    バッチの結果をプロフィール単位で返す（after_profile_id より後のプロフィールを limit 件）
+    キーセット方式のため、ページが深くなっても遅くならない
+    """
+    profile_ids = session.exec(
+        select(Profile.id)
+        .where(Profile.batch_id == batch_id)
+        .where(Profile.id > after_profile_id)
+        .order_by(Profile.id)
+        .limit(limit)
+    ).all()
+    if not profile_ids:
+        return []
+
+    results = session.exec(
+        select(MatchResult)
+        .where(MatchResult.profile_id.in_(profile_ids))
+        .order_by(MatchResult.profile_id, MatchResult.rank)
+    ).all()
+    by_profile: Dict[int, List[Dict]] = {profile_id: [] for profile_id in profile_ids}
+    for result in results:
+        by_profile[result.profile_id].append(result.model_dump(mode="json"))
+    return [{"profile_id": profile_id, "results": items} for profile_id, items in by_profile.items()]
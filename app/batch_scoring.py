@@ -0,0 +1,237 @@
+import os
+import threading
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .models import Profile, INCOME_BANDS
+from .catalog import CompiledScholarship, ScholarshipCatalog
+from .matching_logic import WEIGHTS, income_range_matches
+from .income import parse_income_requirement
+from .scoring_context import ScoringContext, to_utc
+
+# calculate_score と同じ定数
+BASE_SCORE = 0.1
+HIGH_AMOUNT_THRESHOLD = 500000
+DEADLINE_WINDOW_DAYS = 30
+
+# 一括採点で一度に作るスコア行列の要素数の上限 (プロフィール数 × 奨学金数)
+BATCH_SCORE_MAX_CELLS = int(os.getenv("BATCH_SCORE_MAX_CELLS", "5000000"))
+
+_WORD_BITS = 64
+_NO_UPPER_BOUND = np.iinfo(np.int64).max
+
+
+def _encode_bits(values_per_row: Sequence[Iterable[str]]) -> Tuple[Dict[str, int], np.ndarray]:
+    """
+    各行の文字列集合を uint64 のビットマスク行列 (行数 × ワード数) に変換する
+    """
+    vocab: Dict[str, int] = {}
+    for values in values_per_row:
+        for value in values:
+            vocab.setdefault(value, len(vocab))
+
+    n_words = max(1, (len(vocab) + _WORD_BITS - 1) // _WORD_BITS)
+    bits = np.zeros((len(values_per_row), n_words), dtype=np.uint64)
+    for row, values in enumerate(values_per_row):
+        for value in values:
+            code = vocab[value]
+            bits[row, code // _WORD_BITS] |= np.uint64(1) << np.uint64(code % _WORD_BITS)
+    return vocab, bits
+
+
+def _lookup_bits(bits: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    """
+    プロフィールごとの語彙コード (N,) に対して、各奨学金のビットが立っているかを (N, 行数) で返す
+    語彙に存在しない値 (コード -1) は常に False
+    """
+    known = codes >= 0
+    safe = np.where(known, codes, 0)
+    words = bits[:, safe // _WORD_BITS] # (行数, N)
+    shifts = (safe % _WORD_BITS).astype(np.uint64)
+    hit = ((words >> shifts) & np.uint64(1)).astype(bool).T
+    hit &= known[:, None]
+    return hit
+
+
+# ====================================================================
+# NumPy によるバッチスコアリング
+# ====================================================================
+class BatchScorer:
+    """
+    コンパイル済みカタログを NumPy 配列に変換し、calculate_score と同じルールで
+    1件または N件のプロフィールをカタログ全体に対して一括採点する
+    """
+
+    def __init__(self, scholarships: Sequence[CompiledScholarship]):
+        self.scholarships = tuple(scholarships)
+        n = len(self.scholarships)
+        self.size = n
+
+        # 必須条件: 空のリストは全対象とみなす
+        self.grade_any = np.array([not sch.eligible_grades for sch in self.scholarships], dtype=bool)
+        self.pref_any = np.array([not sch.eligible_prefs for sch in self.scholarships], dtype=bool)
+        self.grade_vocab, self.grade_bits = _encode_bits([sch.eligible_grades for sch in self.scholarships])
+        self.pref_vocab, self.pref_bits = _encode_bits([sch.eligible_prefs for sch in self.scholarships])
+        self.major_vocab, self.major_bits = _encode_bits([sch.fields for sch in self.scholarships])
+
+        # 年収条件: 解析済みの年収範囲を下限・上限ベクトルとして保持し、区間比較で判定する
+        self.income_unrestricted = np.array([sch.income_unrestricted for sch in self.scholarships], dtype=bool)
+        self.income_parsed = np.array([sch.income_range is not None for sch in self.scholarships], dtype=bool)
+        self.income_min = np.array(
+            [sch.income_range.min if sch.income_range else 0 for sch in self.scholarships], dtype=np.int64
+        )
+        self.income_max = np.array([
+            sch.income_range.max if sch.income_range and sch.income_range.max is not None else _NO_UPPER_BOUND
+            for sch in self.scholarships
+        ], dtype=np.int64)
+
+        # 既知の年収バンドごとの適合可否はビットマスク化しておく
+        income_by_band = [self._income_vector(band) for band in INCOME_BANDS]
+        self.income_vocab, self.income_bits = _encode_bits([
+            [band for band, ok in zip(INCOME_BANDS, row_ok) if ok]
+            for row_ok in zip(*income_by_band)
+        ] if n else [])
+        self._extra_income: Dict[str, np.ndarray] = {}
+        self._extra_income_lock = threading.Lock()
+
+        # ボーナス条件
+        self.social_care = np.array(["経験者" in sch.other_requirements for sch in self.scholarships], dtype=bool)
+        self.high_amount = np.array(
+            [sch.amount_per_year >= HIGH_AMOUNT_THRESHOLD for sch in self.scholarships], dtype=bool
+        )
+        self.amount = np.array([sch.amount_per_year for sch in self.scholarships], dtype=np.int64)
+        self.deadline_day = np.array([sch.deadline_date.toordinal() for sch in self.scholarships], dtype=np.int64)
+        self.deadline_ts = np.array([to_utc(sch.deadline).timestamp() for sch in self.scholarships], dtype=np.float64)
+        self.order = np.arange(n, dtype=np.int64)
+
+    def _income_vector(self, band: str) -> np.ndarray:
+        """年収バンド1つに対する各奨学金の適合可否 (get_income_score と同じ判定)"""
+        ok = self.income_unrestricted.copy()
+        band_range = parse_income_requirement(band)
+        if band_range is not None:
+            band_max = _NO_UPPER_BOUND if band_range.max is None else band_range.max
+            ok |= self.income_parsed & (band_range.min < self.income_max) & (self.income_min < band_max)
+            fallback_rows = np.flatnonzero(~self.income_parsed & ~ok)
+        else:
+            fallback_rows = np.flatnonzero(~ok)
+        # 解析できない表記のみ、従来の文字列判定にフォールバックする
+        for row in fallback_rows:
+            sch = self.scholarships[row]
+            ok[row] = income_range_matches(band, band_range, sch.income_requirement, sch.income_range)
+        return ok
+
+    def _income_matrix(self, bands: Sequence[str], sel) -> np.ndarray:
+        codes = np.array([self.income_vocab.get(band, -1) for band in bands], dtype=np.int64)
+        ok = _lookup_bits(self.income_bits[sel], codes)
+        for row, band in enumerate(bands):
+            if band in self.income_vocab:
+                continue
+            if band in INCOME_BANDS:
+                continue # どの奨学金にも適合しない既知バンド
+            # 選択肢に無い年収バンドは初回のみ判定してキャッシュ
+            extra = self._extra_income.get(band)
+            if extra is None:
+                extra = self._income_vector(band)
+                with self._extra_income_lock:
+                    self._extra_income[band] = extra
+            ok[row] = extra[sel]
+        return ok
+
+    def score_matrix(
+        self,
+        profiles: Sequence[Profile],
+        context: Optional[ScoringContext] = None,
+        indices: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """
+        N件のプロフィールを一括採点し、(N, 奨学金数) のスコア行列を返す
+        indices を指定した場合は、その奨学金（カタログ上の位置）のみを採点し (N, len(indices)) を返す
+        締切の判定は context の日付 (UTC) で行う（省略時は現在の日付）
+        """
+        today = (context or ScoringContext.now()).today
+        sel = slice(None) if indices is None else np.asarray(indices, dtype=np.int64)
+        size = self.size if indices is None else len(sel)
+        n_profiles = len(profiles)
+        if n_profiles == 0 or size == 0:
+            return np.zeros((n_profiles, size), dtype=np.float64)
+
+        grade_codes = np.array([self.grade_vocab.get(p.grade, -1) for p in profiles], dtype=np.int64)
+        pref_codes = np.array([self.pref_vocab.get(p.prefecture, -1) for p in profiles], dtype=np.int64)
+        major_codes = np.array([self.major_vocab.get(p.major, -1) for p in profiles], dtype=np.int64)
+        has_social_care = np.array([bool(p.has_social_care) for p in profiles], dtype=bool)
+
+        # 1. 必須条件
+        eligible = self.grade_any[sel][None, :] | _lookup_bits(self.grade_bits[sel], grade_codes)
+        eligible &= self.pref_any[sel][None, :] | _lookup_bits(self.pref_bits[sel], pref_codes)
+        eligible &= self._income_matrix([p.income_band for p in profiles], sel)
+
+        # 2. ボーナス条件 (calculate_score と同じ順序で加算し、浮動小数点の結果を一致させる)
+        days_to_deadline = self.deadline_day[sel] - today.toordinal()
+        deadline_soon = (days_to_deadline > 0) & (days_to_deadline <= DEADLINE_WINDOW_DAYS)
+
+        scores = np.full((n_profiles, size), BASE_SCORE, dtype=np.float64)
+        scores += np.where(has_social_care[:, None] & self.social_care[sel][None, :], WEIGHTS["SOCIAL_CARE"], 0.0)
+        scores += np.where(_lookup_bits(self.major_bits[sel], major_codes), WEIGHTS["MAJOR_MATCH"], 0.0)
+        scores += np.where(deadline_soon, WEIGHTS["DEADLINE_BONUS"], 0.0)[None, :]
+        scores += np.where(self.high_amount[sel], WEIGHTS["HIGH_AMOUNT"], 0.0)[None, :]
+
+        np.minimum(scores, 1.0, out=scores)
+        scores[~eligible] = 0.0
+        return scores
+
+    def score(
+        self,
+        profile: Profile,
+        context: Optional[ScoringContext] = None,
+        indices: Optional[np.ndarray] = None,
+    ) -> np.ndarray:
+        """1件のプロフィールをカタログ全体（または indices の奨学金）に対して採点する"""
+        return self.score_matrix([profile], context, indices)[0]
+
+    def top_k(self, scores: np.ndarray, k: int = 5, indices: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        スコア降順・締切昇順（同点はカタログ順）で上位k件のカタログ上の位置を返す
+        スコア0（必須条件不適合）は対象外。scores が indices に対応する場合は indices を渡す
+        """
+        positions = np.flatnonzero(scores > 0)
+        if positions.size > k:
+            candidate_scores = scores[positions]
+            # k番目のスコアと同点のものを取りこぼさないよう、閾値以上を全て残す
+            part = np.argpartition(-candidate_scores, k - 1)[:k]
+            threshold = candidate_scores[part].min()
+            positions = positions[candidate_scores >= threshold]
+        candidates = positions if indices is None else np.asarray(indices, dtype=np.int64)[positions]
+        order = np.lexsort((self.order[candidates], self.deadline_ts[candidates], -scores[positions]))
+        return candidates[order][:k]
+
+    def top_k_matrix(self, scores: np.ndarray, k: int = 5) -> List[np.ndarray]:
+        """スコア行列の各行について top_k を返す"""
+        return [self.top_k(row, k) for row in scores]
+
+
+# ====================================================================
+# カタログごとのスコアラーのキャッシュ
+# ====================================================================
+def get_batch_scorer(catalog: ScholarshipCatalog) -> BatchScorer:
+    """カタログが更新されるまで同じ BatchScorer を再利用する"""
+    return catalog.derived("batch_scorer", lambda c: BatchScorer(c.scholarships))
+
+
+def rule_based_top_k(
+    catalog: ScholarshipCatalog,
+    profiles: Sequence[Profile],
+    context: Optional[ScoringContext] = None,
+    k: int = 5,
+) -> Iterator[List[Tuple[CompiledScholarship, float]]]:
+    """
+    プロフィールをまとめてスコア行列で採点し、1件ずつ (奨学金, スコア) のTOPkを返す
+    (calculate_score と同じルール。行列が大きくなり過ぎないよう分割して計算する)
+    """
+    scorer = get_batch_scorer(catalog)
+    context = context or ScoringContext.now()
+    chunk_size = max(1, BATCH_SCORE_MAX_CELLS // max(1, len(catalog)))
+    for start in range(0, len(profiles), chunk_size):
+        chunk = profiles[start:start + chunk_size]
+        for row in scorer.score_matrix(chunk, context):
+            yield [(catalog.scholarships[idx], float(row[idx])) for idx in scorer.top_k(row, k).tolist()]
@@ -0,0 +1,207 @@
+import os
+import time
+import threading
+from dataclasses import dataclass, field
+from datetime import date, datetime
+from typing import Any, Callable, Dict, FrozenSet, Optional, Tuple, TypeVar
+from sqlmodel import Session, select
+
+from .database import get_engine
+from .models import Scholarship, CatalogVersion
+from .income import IncomeRange, stored_income_range
+from .scoring_context import to_utc
+
+# カタログの強制再読み込み間隔（秒）と、DB上のバージョン番号を確認する間隔（秒）
+CATALOG_TTL_SECONDS = float(os.getenv("CATALOG_TTL_SECONDS", "3600"))
+CATALOG_VERSION_CHECK_SECONDS = float(os.getenv("CATALOG_VERSION_CHECK_SECONDS", "30"))
+
+T = TypeVar("T")
+
+# ====================================================================
+# コンパイル済み奨学金データ
+# ====================================================================
+@dataclass(frozen=True)
+class CompiledScholarship:
+    """
+    スコアリング用に前処理した奨学金1件（読み取り専用）
+    ARRAY列は frozenset に変換し、締切・年収条件は読み込み時に解析済み
+    deadline はタイムゾーン付きのUTC、deadline_date はそのUTCでの日付
+    """
+    id: int
+    name: str
+    provider: str
+    category: str
+    type: str
+    amount_per_year: int
+    period: str
+    eligible_grades: FrozenSet[str]
+    eligible_prefs: FrozenSet[str]
+    fields: FrozenSet[str]
+    income_requirement: str
+    income_range: Optional[IncomeRange] # 解析できない年収条件は None
+    income_unrestricted: bool
+    other_requirements: str
+    deadline: datetime
+    deadline_date: date
+    required_docs: Tuple[str, ...]
+    difficulty_hint: str
+    url: str
+
+    @classmethod
+    def from_model(cls, sch: Scholarship) -> "CompiledScholarship":
+        # get_income_score と同じ判定になるよう、前後の空白も含めて保存された値のまま使う
+        income_requirement = sch.income_requirement or ""
+        income_range = stored_income_range(sch.income_min, sch.income_max, income_requirement)
+        deadline = to_utc(sch.deadline) # タイムゾーン無しで保存された締切はUTCとみなす
+        return cls(
+            id=sch.id,
+            name=sch.name,
+            provider=sch.provider,
+            category=sch.category,
+            type=sch.type,
+            amount_per_year=sch.amount_per_year,
+            period=sch.period,
+            eligible_grades=frozenset(sch.eligible_grades or []),
+            eligible_prefs=frozenset(sch.eligible_prefs or []),
+            fields=frozenset(sch.fields or []),
+            income_requirement=income_requirement,
+            income_range=income_range,
+            # 上限なしの区間 (「不問」など) は年収バンドを解析できる場合のみ適合するため、区間比較に任せる
+            income_unrestricted=(income_requirement == "条件なし"),
+            other_requirements=sch.other_requirements or "",
+            deadline=deadline,
+            deadline_date=deadline.date(),
+            required_docs=tuple(sch.required_docs or []),
+            difficulty_hint=sch.difficulty_hint,
+            url=sch.url,
+        )
+
+
+@dataclass(frozen=True)
+class ScholarshipCatalog:
+    """公開中の奨学金をまとめたプロセス内カタログ"""
+    version: int
+    loaded_at: float
+    scholarships: Tuple[CompiledScholarship, ...]
+    by_id: Dict[int, CompiledScholarship]
+    # スコアラーや索引など、カタログから派生する構造のキャッシュ（カタログ再読み込みで破棄される）
+    _derived: Dict[str, Any] = field(default_factory=dict, repr=False, compare=False)
+    _derived_lock: Any = field(default_factory=threading.Lock, repr=False, compare=False)
+
+    def __len__(self) -> int:
+        return len(self.scholarships)
+
+    def derived(self, name: str, builder: Callable[["ScholarshipCatalog"], T]) -> T:
+        """このカタログから派生する構造を初回のみ構築し、以降は使い回す"""
+        value = self._derived.get(name)
+        if value is None:
+            with self._derived_lock:
+                value = self._derived.get(name)
+                if value is None:
+                    value = builder(self)
+                    self._derived[name] = value
+        return value
+
+
+# ====================================================================
+# プロセス全体で共有するカタログの読み込み・更新
+# ====================================================================
+_catalog: Optional[ScholarshipCatalog] = None
+_last_version_check = 0.0
+_lock = threading.Lock()
+
+
+def read_catalog_version(session: Session) -> int:
+    """CatalogVersion の行だけを読む（カタログは読み込まない）"""
+    version = session.exec(
+        select(CatalogVersion.version).where(CatalogVersion.id == 1)
+    ).first()
+    return version or 0
+
+
+def load_catalog(session: Session) -> ScholarshipCatalog:
+    """DBから公開中の奨学金を読み込み、コンパイル済みカタログを構築する"""
+    version = read_catalog_version(session)
+    rows = session.exec(
+        select(Scholarship)
+        .where(Scholarship.is_published == True)
+        .order_by(Scholarship.id)
+    ).all()
+    compiled = tuple(CompiledScholarship.from_model(sch) for sch in rows)
+    return ScholarshipCatalog(
+        version=version,
+        loaded_at=time.monotonic(),
+        scholarships=compiled,
+        by_id={sch.id: sch for sch in compiled},
+    )
+
+
+def get_catalog(session: Optional[Session] = None) -> ScholarshipCatalog:
+    """
+    コンパイル済みカタログを返す。
+    通常はメモリ上のカタログをそのまま返し、TTL切れまたはバージョン更新時のみDBを参照する。
+    """
+    global _catalog, _last_version_check
+
+    now = time.monotonic()
+    catalog = _catalog
+    if (
+        catalog is not None
+        and now - catalog.loaded_at < CATALOG_TTL_SECONDS
+        and now - _last_version_check < CATALOG_VERSION_CHECK_SECONDS
+    ):
+        return catalog
+
+    with _lock:
+        # 他スレッドが先に更新していれば、それを使う
+        catalog = _catalog
+        now = time.monotonic()
+        if (
+            catalog is not None
+            and now - catalog.loaded_at < CATALOG_TTL_SECONDS
+            and now - _last_version_check < CATALOG_VERSION_CHECK_SECONDS
+        ):
+            return catalog
+
+        if session is None:
+            with Session(get_engine()) as own_session:
+                catalog = _refresh(own_session, catalog, now)
+        else:
+            catalog = _refresh(session, catalog, now)
+
+        _catalog = catalog
+        _last_version_check = now
+        return catalog
+
+
+def _refresh(session: Session, catalog: Optional[ScholarshipCatalog], now: float) -> ScholarshipCatalog:
+    # TTL内でバージョンが変わっていなければ再構築しない
+    if catalog is not None and now - catalog.loaded_at < CATALOG_TTL_SECONDS:
+        if read_catalog_version(session) == catalog.version:
+            return catalog
+    catalog = load_catalog(session)
+    print(f"--- 奨学金カタログを読み込みました (version={catalog.version}, {len(catalog)} 件) ---")
+    return catalog
+
+
+def invalidate_catalog():
+    """プロセス内のカタログを破棄し、次回アクセス時に再読み込みさせる"""
+    global _catalog
+    with _lock:
+        _catalog = None
+
+
+def bump_catalog_version(session: Session) -> int:
+    """
+    カタログのバージョン番号を1つ進める（奨学金マスタ更新後に呼び出す）。
+    他プロセスは CATALOG_VERSION_CHECK_SECONDS 以内に変更を検知して再読み込みする。
+    """
+    row = session.get(CatalogVersion, 1)
+    if row is None:
+        row = CatalogVersion(id=1, version=0)
+    row.version += 1
+    row.updated_at = datetime.utcnow()
+    session.add(row)
+    session.commit()
+    invalidate_catalog()
+    return row.version
@@ -1,5 +1,10 @@
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.engine import Engine
 from sqlmodel import create_engine, Session
+from sqlmodel.ext.asyncio.session import AsyncSession
 import os
+import threading
+from typing import Callable, Dict, List, Optional
 from dotenv import load_dotenv
 
 load_dotenv() # .env ファイルから環境変数を読み込む
@@ -11,12 +16,194 @@ DB_HOST = os.getenv("POSTGRES_HOST", "localhost")
 DB_PORT = os.getenv("POSTGRES_PORT", "5432")
 DB_NAME = os.getenv("POSTGRES_DB", "hopedb")
 
-# DB接続文字列を定義
+# DB接続文字列を定義（libpq 形式。psycopg で直接 LISTEN する場合などにも使う）
 DATABASE_URL = f"postgresql://{DB_USER}:{DB_PASSWORD}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+# SQLAlchemy 用（同期・非同期とも psycopg 3 ドライバを使う）
+SQLALCHEMY_DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+psycopg://", 1)
 
-engine = create_engine(DATABASE_URL, echo=False) # echo=Trueにすると実行されるSQLが表示されます
+# ====================================================================
+# 接続プールの設定
+# ====================================================================
+# 同期エンジン（同期のエンドポイント・ワーカー・スケジューラーで共有）と
+# 非同期エンジン（async のエンドポイント）はそれぞれプールを持つ（1つのプールを共有することはできない）。
+# DB_POOL_SIZE / DB_MAX_OVERFLOW は1プロセスの合計で、その一部 (DB_ASYNC_POOL_SIZE / DB_ASYNC_MAX_OVERFLOW) を
+# 非同期エンジンに、残りを同期エンジンに割り当てる。1プロセスの最大接続数は DB_POOL_SIZE + DB_MAX_OVERFLOW
+# (デプロイ全体の合計は下の「接続数の予算」を参照)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_ASYNC_POOL_SIZE = int(os.getenv("DB_ASYNC_POOL_SIZE", str(DB_POOL_SIZE // 2)))
+DB_ASYNC_MAX_OVERFLOW = int(os.getenv("DB_ASYNC_MAX_OVERFLOW", str(DB_MAX_OVERFLOW // 2)))
+DB_SYNC_POOL_SIZE = max(1, DB_POOL_SIZE - DB_ASYNC_POOL_SIZE)
+DB_SYNC_MAX_OVERFLOW = max(0, DB_MAX_OVERFLOW - DB_ASYNC_MAX_OVERFLOW)
+# プールが空いていない場合に待つ秒数（超えるとエラーにして、無制限に待たせない）
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+# この秒数より古い接続は作り直す（DBやプロキシ側のアイドル切断対策）
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+# 接続を貸し出す前に生存確認する
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") == "1"
+# 1つのSQLの実行時間の上限（ミリ秒。0 で無制限）
+DB_STATEMENT_TIMEOUT_MS = int(os.getenv("DB_STATEMENT_TIMEOUT_MS", "30000"))
+DB_ECHO = os.getenv("DB_ECHO", "0") == "1" # 1にすると実行されるSQLが表示されます
+
+
+# ====================================================================
+# 接続数の予算
+# ====================================================================
+# デプロイ全体の最大接続数は、プロセスの種類ごとの次の合計になる
+#   APIサーバー: DB_API_PROCESSES × (同期 + 非同期 + 完了通知の LISTEN 用の1本)
+#                (MATCH_WORKER_MODE=inprocess のワーカーは同期のプールを共有する)
+#   ワーカー:    DB_WORKER_PROCESSES × 同期 (python -m app.worker は非同期エンジンを作らない)
+#   (同期 = DB_SYNC_POOL_SIZE + DB_SYNC_MAX_OVERFLOW、非同期 = DB_ASYNC_POOL_SIZE + DB_ASYNC_MAX_OVERFLOW)
+#   再採点:      (RERANK_WORKERS + 1) × 1 (python -m app.rerank。各プロセスは接続を1本ずつしか使わない)
+# DB_MAX_CONNECTIONS に、DBの max_connections から管理用の予約分を引いた値を設定すると、
+# 合計が上限を超える設定ではエンジンの生成時（再採点は開始時）にエラーにする（0 の場合は確認しない）
+DB_MAX_CONNECTIONS = int(os.getenv("DB_MAX_CONNECTIONS", "0"))
+# 同時に動くAPIサーバーのプロセス数（サーバーレス環境では同時に起動するインスタンス数の上限）
+DB_API_PROCESSES = int(os.getenv("DB_API_PROCESSES", os.getenv("WEB_CONCURRENCY", "1")))
+# 同時に動く python -m app.worker のプロセス数（MATCH_WORKER_MODE=inprocess のみの構成では 0）
+DB_WORKER_PROCESSES = int(os.getenv("DB_WORKER_PROCESSES", "1"))
+
+
+def pool_capacity(name: str) -> int:
+    """エンジン ("sync" / "async") のプールが使う最大接続数"""
+    if name == "async":
+        return DB_ASYNC_POOL_SIZE + DB_ASYNC_MAX_OVERFLOW
+    return DB_SYNC_POOL_SIZE + DB_SYNC_MAX_OVERFLOW
+
+
+def connection_budget(rerank_processes: int = 0) -> Dict[str, int]:
+    """設定から見積もった、プロセスの種類ごとの最大接続数"""
+    sync_connections = pool_capacity("sync")
+    async_connections = pool_capacity("async")
+    budget = {
+        "api": DB_API_PROCESSES * (sync_connections + async_connections + 1),
+        "worker": DB_WORKER_PROCESSES * sync_connections,
+    }
+    if rerank_processes > 0:
+        budget["rerank"] = rerank_processes + 1
+    return budget
+
+
+def check_connection_budget(rerank_processes: int = 0):
+    """接続数の合計が DB_MAX_CONNECTIONS を超える設定であれば RuntimeError を送出する"""
+    if DB_MAX_CONNECTIONS <= 0:
+        return
+    budget = connection_budget(rerank_processes)
+    total = sum(budget.values())
+    if total > DB_MAX_CONNECTIONS:
+        detail = ", ".join(f"{role} {count}" for role, count in budget.items())
+        raise RuntimeError(
+            f"DBの最大接続数の見積もり {total} ({detail}) が DB_MAX_CONNECTIONS={DB_MAX_CONNECTIONS} を超えています。"
+            "DB_POOL_SIZE / DB_MAX_OVERFLOW またはプロセス数を減らしてください"
+        )
+
+
+def _engine_options(pool_size: int, max_overflow: int, statement_timeout_ms: int) -> dict:
+    return dict(
+        echo=DB_ECHO,
+        pool_size=pool_size,
+        max_overflow=max_overflow,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+        # 接続ごとにサーバー側の statement_timeout を設定する
+        connect_args={"options": f"-c statement_timeout={statement_timeout_ms}"},
+    )
+
+
+def make_engine(
+    url: str = SQLALCHEMY_DATABASE_URL,
+    pool_size: int = DB_SYNC_POOL_SIZE,
+    statement_timeout_ms: int = DB_STATEMENT_TIMEOUT_MS,
+    max_overflow: int = DB_SYNC_MAX_OVERFLOW,
+) -> Engine:
+    """設定済みの接続プールを持つ同期エンジンを作る"""
+    return create_engine(url, **_engine_options(pool_size, max_overflow, statement_timeout_ms))
+
+
+def make_async_engine(
+    url: str = SQLALCHEMY_DATABASE_URL,
+    pool_size: int = DB_ASYNC_POOL_SIZE,
+    statement_timeout_ms: int = DB_STATEMENT_TIMEOUT_MS,
+    max_overflow: int = DB_ASYNC_MAX_OVERFLOW,
+) -> AsyncEngine:
+    """設定済みの接続プールを持つ非同期エンジンを作る（psycopg 3 の非同期接続を使う）"""
+    return create_async_engine(url, **_engine_options(pool_size, max_overflow, statement_timeout_ms))
+
+
+# ====================================================================
+# プロセス内で共有するエンジン（接続はプールから使い回す）
+# ====================================================================
+# エンジンの生成（DBドライバの読み込みを含む）は最初に使うときまで遅らせる
+# (サーバーレス環境のコールドスタートで、DBを使わないリクエストに時間をかけない)
+_engine: Optional[Engine] = None
+_async_engine: Optional[AsyncEngine] = None
+_engine_lock = threading.Lock()
+_engine_hooks: List[Callable[[str, Engine], None]] = []
+
+
+def on_engine_created(hook: Callable[[str, Engine], None]):
+    """
+    エンジンの生成時に hook(名前, 同期エンジン) を呼び出す（名前は "sync" / "async"。非同期エンジンは sync_engine を渡す）
+    登録時点で生成済みのエンジンには、その場で呼び出す
+    """
+    with _engine_lock:
+        _engine_hooks.append(hook)
+        created = [(name, e) for name, e in (("sync", _engine), ("async", _async_engine and _async_engine.sync_engine)) if e is not None]
+    for name, e in created:
+        hook(name, e)
+
+
+def get_engine() -> Engine:
+    """同期エンジンを返す（初回のみ生成）"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                check_connection_budget()
+                _engine = make_engine()
+                for hook in _engine_hooks:
+                    hook("sync", _engine)
+    return _engine
+
+
+def get_async_engine() -> AsyncEngine:
+    """非同期エンジンを返す（初回のみ生成）"""
+    global _async_engine
+    if _async_engine is None:
+        with _engine_lock:
+            if _async_engine is None:
+                check_connection_budget()
+                _async_engine = make_async_engine()
+                for hook in _engine_hooks:
+                    hook("async", _async_engine.sync_engine)
+    return _async_engine
+
+
+def __getattr__(name: str):
+    # 従来どおり `from app.database import engine` でも使えるようにする（その時点で生成される）
+    if name == "engine":
+        return get_engine()
+    if name == "async_engine":
+        return get_async_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def get_session():
     """DBセッションを取得するジェネレータ"""
-    with Session(engine) as session:
-        yield session
\ No newline at end of file
+    with Session(get_engine()) as session:
+        yield session
+
+async def get_async_session():
+    """
+    非同期DBセッションを取得するジェネレータ（async のエンドポイント用。イベントループをブロックしない）
+    既存の同期の処理は session.run_sync(関数, ...) で呼び出せる
+    """
+    async with AsyncSession(get_async_engine(), expire_on_commit=False) as session:
+        yield session
+
+async def dispose_engines():
+    """プールの接続を全て閉じる（シャットダウン時。生成していないエンジンは何もしない）"""
+    if _async_engine is not None:
+        await _async_engine.dispose()
+    if _engine is not None:
+        _engine.dispose()
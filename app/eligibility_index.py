@@ -0,0 +1,87 @@
+import threading
+from typing import Dict, FrozenSet, List, Sequence, Tuple
+
+from .models import Profile, INCOME_BANDS
+from .catalog import CompiledScholarship, ScholarshipCatalog
+from .income import parse_income_requirement
+from .matching_logic import income_range_matches
+
+
+def _build_postings(
+    scholarships: Sequence[CompiledScholarship], attr: str
+) -> Tuple[Dict[str, FrozenSet[int]], FrozenSet[int]]:
+    """
+    値 -> その値を許可する奨学金（カタログ上の位置）の集合 を構築する
+    空のリストは全対象とみなし、全ての値の集合に含める（未登録の値には全対象の集合を使う）
+    """
+    open_rows = set()
+    postings: Dict[str, set] = {}
+    for row, sch in enumerate(scholarships):
+        values = getattr(sch, attr)
+        if not values:
+            open_rows.add(row)
+            continue
+        for value in values:
+            postings.setdefault(value, set()).add(row)
+
+    # 検索時に毎回和集合を作らないよう、全対象の行をあらかじめ合わせておく
+    result = {value: frozenset(rows | open_rows) for value, rows in postings.items()}
+    return result, frozenset(open_rows)
+
+
+# ====================================================================
+# 必須条件（学年・地域・年収）の転置インデックス
+# ====================================================================
+class EligibilityIndex:
+    """
+    calculate_score の必須条件を満たす奨学金の候補集合を、全件走査せずに集合積で求める
+    """
+
+    def __init__(self, scholarships: Sequence[CompiledScholarship]):
+        self.scholarships = tuple(scholarships)
+        self.by_grade, self.grade_open = _build_postings(self.scholarships, "eligible_grades")
+        self.by_pref, self.pref_open = _build_postings(self.scholarships, "eligible_prefs")
+        self.by_income: Dict[str, FrozenSet[int]] = {
+            band: self._income_rows(band) for band in INCOME_BANDS
+        }
+        self._lock = threading.Lock()
+
+    def _income_rows(self, income_band: str) -> FrozenSet[int]:
+        # 年収条件は読み込み時に解析済みの範囲を使い、ここでは年収バンドのみ解析する
+        band = parse_income_requirement(income_band)
+        return frozenset(
+            row for row, sch in enumerate(self.scholarships)
+            if sch.income_unrestricted
+            or income_range_matches(income_band, band, sch.income_requirement, sch.income_range)
+        )
+
+    def _income_postings(self, income_band: str) -> FrozenSet[int]:
+        rows = self.by_income.get(income_band)
+        if rows is None:
+            # 選択肢に無い年収バンドは初回のみ全件判定してキャッシュ
+            rows = self._income_rows(income_band)
+            with self._lock:
+                self.by_income[income_band] = rows
+        return rows
+
+    def candidates(self, profile: Profile) -> List[int]:
+        """必須条件を満たす奨学金のカタログ上の位置を昇順で返す"""
+        sets = [
+            self.by_grade.get(profile.grade, self.grade_open),
+            self.by_pref.get(profile.prefecture, self.pref_open),
+            self._income_postings(profile.income_band),
+        ]
+        sets.sort(key=len)
+        rows = sets[0].intersection(*sets[1:])
+        return sorted(rows)
+
+
+def get_eligibility_index(catalog: ScholarshipCatalog) -> EligibilityIndex:
+    """カタログが更新されるまで同じ EligibilityIndex を再利用する"""
+    return catalog.derived("eligibility_index", lambda c: EligibilityIndex(c.scholarships))
+
+
+def eligible_scholarships(catalog: ScholarshipCatalog, profile: Profile) -> List[CompiledScholarship]:
+    """必須条件を満たす奨学金のみをカタログ順で返す（Geminiプロンプト用）"""
+    index = get_eligibility_index(catalog)
+    return [catalog.scholarships[row] for row in index.candidates(profile)]
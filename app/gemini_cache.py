@@ -0,0 +1,186 @@
+import os
+import asyncio
+import json
+import hashlib
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Optional, Sequence
+from cachetools import TTLCache
+from sqlmodel import Session
+
+from .database import get_engine
+from .models import Profile, GeminiResponseCache
+from .catalog import ScholarshipCatalog
+from .schemas import MatchResponseSchema
+from .prompt_builder import PROFILE_PROMPT_EXCLUDE, PROMPT_FORMAT_VERSION, PROMPT_CANDIDATE_MODE
+from .gemini_client import generate_match_results_gemini
+from .metrics import CACHE_EVENTS
+
+GEMINI_CACHE_MAXSIZE = int(os.getenv("GEMINI_CACHE_MAXSIZE", "10000"))
+GEMINI_CACHE_TTL_SECONDS = float(os.getenv("GEMINI_CACHE_TTL_SECONDS", "86400"))
+# "1" の場合、Postgres の geminiresponsecache テーブルにも保存し、プロセス再起動後・他ワーカーと共有する
+GEMINI_CACHE_PERSIST = os.getenv("GEMINI_CACHE_PERSIST", "0") == "1"
+
+
+def profile_fingerprint(profile: Profile, catalog_version: int) -> str:
+    """Geminiに渡るプロフィールの項目・カタログバージョン・プロンプト形式から、キャッシュキーを生成する"""
+    # SQLModelのインスタンスは生成方法によって項目の順序が変わるため、キーを整列してから直列化する
+    profile_data = json.dumps(
+        profile.model_dump(mode="json", exclude=PROFILE_PROMPT_EXCLUDE),
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    version = f"{PROMPT_FORMAT_VERSION}{PROMPT_CANDIDATE_MODE}" # 絞り込みを使わない場合は従来と同じキー
+    return hashlib.sha256(f"{catalog_version}:{version}:{profile_data}".encode("utf-8")).hexdigest()
+
+
+def response_cache_key(profile: Profile, catalog: ScholarshipCatalog, positions: Sequence[int]) -> str:
+    """
+    Gemini応答キャッシュのキー
+    プロンプトに含める候補は採点の基準日（締切ボーナス）や検索索引によって変わるため、
+    プロフィールのキーに候補の奨学金IDを順に加える（プロンプトはプロフィールと候補だけから作られる）
+    """
+    candidate_ids = ",".join(str(catalog.scholarships[position].id) for position in positions)
+    fingerprint = profile_fingerprint(profile, catalog.version)
+    return hashlib.sha256(f"{fingerprint}:{candidate_ids}".encode("utf-8")).hexdigest()
+
+
+# ====================================================================
+# Gemini応答キャッシュ（メモリ上のLRU/TTL + 任意でPostgresに永続化）
+# ====================================================================
+class GeminiResponseCacheStore:
+    def __init__(self, maxsize: int, ttl: float, persist: bool):
+        self.ttl = ttl
+        self.persist = persist
+        self._memory: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "memory_hits": 0, "db_hits": 0, "stores": 0, "coalesced": 0}
+
+    def record(self, *names: str):
+        """監視用のカウンタを進める"""
+        with self._lock:
+            for name in names:
+                self.stats[name] += 1
+        for name in names:
+            CACHE_EVENTS.labels("gemini", name).inc()
+
+    def get(self, key: str) -> Optional[MatchResponseSchema]:
+        """
+        メモリ → (persist の場合) DB の順に探す
+        DBは自前の短いセッションで読む（ジョブのセッションを共有すると、並行して動く他の処理と衝突するため）
+        """
+        with self._lock:
+            response = self._memory.get(key)
+        if response is not None:
+            self.record("hits", "memory_hits")
+            return response
+
+        if self.persist:
+            try:
+                with Session(get_engine()) as session:
+                    row = session.get(GeminiResponseCache, key)
+            except Exception as e:
+                print(f"Gemini応答キャッシュの読み込みに失敗しました: {e}")
+                row = None
+            if row is not None and row.created_at >= datetime.utcnow() - timedelta(seconds=self.ttl):
+                response = MatchResponseSchema.model_validate_json(row.response_json)
+                with self._lock:
+                    self._memory[key] = response
+                self.record("hits", "db_hits")
+                return response
+
+        self.record("misses")
+        return None
+
+    def put(self, key: str, response: MatchResponseSchema, catalog_version: int):
+        """
+        メモリに保存し、persist の場合は自前の短いセッションでDBにも保存する
+        DBへの保存に失敗しても、Geminiの応答は使えるためログを出して続行する
+        """
+        with self._lock:
+            self._memory[key] = response
+        self.record("stores")
+
+        if self.persist:
+            try:
+                with Session(get_engine()) as session:
+                    session.merge(GeminiResponseCache(
+                        key=key,
+                        catalog_version=catalog_version,
+                        response_json=response.model_dump_json(),
+                        created_at=datetime.utcnow(),
+                    ))
+                    session.commit()
+            except Exception as e:
+                print(f"Gemini応答キャッシュの保存に失敗しました: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+
+    def snapshot(self) -> Dict[str, float]:
+        """監視用のカウンタを返す"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["size"] = len(self._memory)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+response_cache = GeminiResponseCacheStore(
+    maxsize=GEMINI_CACHE_MAXSIZE,
+    ttl=GEMINI_CACHE_TTL_SECONDS,
+    persist=GEMINI_CACHE_PERSIST,
+)
+
+# 同じキーのGemini呼び出しが同時に走った場合、最初の1件の結果を共有する
+_inflight: Dict[str, "asyncio.Future[MatchResponseSchema]"] = {}
+
+
+async def cached_generate_match_results(
+    profile: Profile,
+    catalog: ScholarshipCatalog,
+    positions: Sequence[int],
+) -> MatchResponseSchema:
+    """
+    generate_match_results_gemini の前段のキャッシュ。
+    同じ内容のプロフィール・同じ候補は、カタログが更新されるまでGeminiを呼び出さずに結果を返す。
+    DBに永続化する場合、読み書きはイベントループを止めないよう別スレッドで行う。
+    """
+    catalog_version = catalog.version
+    key = response_cache_key(profile, catalog, positions)
+    if response_cache.persist:
+        cached = await asyncio.to_thread(response_cache.get, key)
+    else:
+        cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+
+    pending = _inflight.get(key)
+    if pending is not None:
+        response_cache.record("coalesced")
+        return await asyncio.shield(pending)
+
+    future = asyncio.get_running_loop().create_future()
+    _inflight[key] = future
+    try:
+        response = await generate_match_results_gemini(profile, catalog, positions)
+    except asyncio.CancelledError:
+        # 先行呼び出しがタイムアウト等でキャンセルされた場合、待機側は通常の失敗として扱う
+        future.set_exception(RuntimeError("先行するGemini呼び出しがキャンセルされました"))
+        future.exception() # 待機者がいない場合の警告を抑止
+        raise
+    except Exception as e:
+        future.set_exception(e)
+        future.exception()
+        raise
+    else:
+        future.set_result(response)
+        if response_cache.persist:
+            await asyncio.to_thread(response_cache.put, key, response, catalog_version)
+        else:
+            response_cache.put(key, response, catalog_version)
+        return response
+    finally:
+        _inflight.pop(key, None)
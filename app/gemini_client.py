@@ -1,10 +1,18 @@
 import os
-import json
-import google.generativeai as genai
-from google.generativeai import types
-from .models import Profile, Scholarship
-from .schemas import MatchResponseSchema # 作成したスキーマをインポート
-from typing import List
+import time
+import asyncio
+import threading
+from .models import Profile
+from .catalog import ScholarshipCatalog
+from .schemas import MatchResponseSchema, GeminiMatchResponseSchema # 作成したスキーマをインポート
+from .prompt_builder import build_prompt, expand_response
+from .resilience import CIRCUIT_STATES, AdaptiveLimiter, CircuitBreaker, CircuitOpenError
+from .metrics import observe_stage, GEMINI_CALLS, GEMINI_CIRCUIT_STATE, GEMINI_CONCURRENCY_LIMIT, GEMINI_IN_FLIGHT
+from typing import TYPE_CHECKING, Optional, Sequence
+
+if TYPE_CHECKING:
+    from google import genai
+    from google.genai import types
 
 # .envファイルからAPIキーを読み込む設定
 # (app/database.py で load_dotenv() が呼ばれている前提)
@@ -12,60 +20,183 @@ API_KEY = os.getenv("GEMINI_API_KEY")
 if not API_KEY:
     raise ValueError("GEMINI_API_KEY が .env ファイルに設定されていません。")
 
-genai.configure(api_key=API_KEY)
+MODEL_NAME = os.getenv("GEMINI_MODEL", "gemini-1.5-flash") # 高速・安価なモデル推奨
+GEMINI_TIMEOUT_SECONDS = float(os.getenv("GEMINI_TIMEOUT_SECONDS", "10"))
+GEMINI_MAX_CONCURRENCY = int(os.getenv("GEMINI_MAX_CONCURRENCY", "8")) # 同時に実行するGemini呼び出しの上限
+# 同時実行数は 429・遅い応答・タイムアウトで縮小し、正常な応答が続くと GEMINI_MAX_CONCURRENCY まで戻す
+GEMINI_MIN_CONCURRENCY = int(os.getenv("GEMINI_MIN_CONCURRENCY", "1"))
+GEMINI_SLOW_SECONDS = float(os.getenv("GEMINI_SLOW_SECONDS", str(GEMINI_TIMEOUT_SECONDS / 2))) # これ以上かかった応答は「遅い」とみなす
+# 直近 GEMINI_BREAKER_WINDOW_SECONDS 秒に GEMINI_BREAKER_MIN_CALLS 件以上呼び出し、失敗率（タイムアウト・エラー）が
+# GEMINI_BREAKER_FAILURE_RATE 以上になったら、GEMINI_BREAKER_OPEN_SECONDS 秒間はGeminiを呼び出さずにフェイルセーフへ進む
+GEMINI_BREAKER_ENABLED = os.getenv("GEMINI_BREAKER_ENABLED", "1") == "1"
+GEMINI_BREAKER_WINDOW_SECONDS = float(os.getenv("GEMINI_BREAKER_WINDOW_SECONDS", "60"))
+GEMINI_BREAKER_MIN_CALLS = int(os.getenv("GEMINI_BREAKER_MIN_CALLS", "10"))
+GEMINI_BREAKER_FAILURE_RATE = float(os.getenv("GEMINI_BREAKER_FAILURE_RATE", "0.5"))
+GEMINI_BREAKER_OPEN_SECONDS = float(os.getenv("GEMINI_BREAKER_OPEN_SECONDS", "30"))
+GEMINI_BREAKER_HALF_OPEN_CALLS = int(os.getenv("GEMINI_BREAKER_HALF_OPEN_CALLS", "3")) # 再開を判断するための試行件数
+
+# プロンプトの組み立て
+SYSTEM_INSTRUCTION = (
+    "あなたは奨学金マッチングAI「HOPE」です。ユーザーのプロフィールと提供された奨学金データベースのみに基づき、"
+    "最も適合性の高いTOP5を、指定されたJSONスキーマで返してください。"
+    "データベース外の情報は絶対に生成せず、優しく前向きなトーンで説明を加えてください。"
+)
+
+# google-genai の読み込みには時間がかかる（起動時間の大半を占める）ため、最初にクライアントを使うときまで遅らせる
+# (サーバーレス環境のコールドスタートで、Geminiを呼び出さないリクエストに読み込み時間をかけない)
+# プロセス内で1つだけ生成し、HTTPコネクションプールを使い回す
+_client: Optional["genai.Client"] = None
+_generation_config: Optional["types.GenerateContentConfig"] = None
+_client_lock = threading.Lock()
+
+# ====================================================================
+# サーキットブレーカーと同時実行数の自動調整（プロセスごと）
+# ====================================================================
+gemini_breaker = CircuitBreaker(
+    "gemini",
+    window_seconds=GEMINI_BREAKER_WINDOW_SECONDS,
+    # 無効の場合は開かないようにする（状態の監視はそのまま使える）
+    min_calls=GEMINI_BREAKER_MIN_CALLS if GEMINI_BREAKER_ENABLED else 2 ** 31,
+    failure_rate=GEMINI_BREAKER_FAILURE_RATE,
+    open_seconds=GEMINI_BREAKER_OPEN_SECONDS,
+    half_open_calls=GEMINI_BREAKER_HALF_OPEN_CALLS,
+    on_state_change=lambda state: GEMINI_CIRCUIT_STATE.set(CIRCUIT_STATES.index(state)),
+)
+gemini_limiter = AdaptiveLimiter(
+    "gemini",
+    min_limit=GEMINI_MIN_CONCURRENCY,
+    max_limit=GEMINI_MAX_CONCURRENCY,
+    slow_seconds=GEMINI_SLOW_SECONDS,
+    on_change=lambda limit, in_flight: (GEMINI_CONCURRENCY_LIMIT.set(int(limit)), GEMINI_IN_FLIGHT.set(in_flight)),
+)
+GEMINI_CIRCUIT_STATE.set(0)
+GEMINI_CONCURRENCY_LIMIT.set(gemini_limiter.limit)
+
+
+def resilience_snapshot() -> dict:
+    """監視用: サーキットブレーカーと同時実行数の上限の状態"""
+    return {"circuit_breaker": gemini_breaker.snapshot(), "concurrency": gemini_limiter.snapshot()}
+
+
+def get_client() -> "genai.Client":
+    """設定済みのGeminiクライアントを返す（初回のみSDKを読み込んで生成）"""
+    global _client, _generation_config
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from google import genai
+                from google.genai import types
+
+                # 構造化出力（JSON）の設定
+                _generation_config = types.GenerateContentConfig(
+                    system_instruction=SYSTEM_INSTRUCTION,
+                    response_mime_type="application/json",
+                    response_schema=GeminiMatchResponseSchema, # 奨学金はIDのみで返させ、詳細はカタログから補完する
+                    temperature=0.2 # 創造性よりも一貫性を優先
+                )
+                _client = genai.Client(
+                    api_key=API_KEY,
+                    # HTTPレベルでもタイムアウトを設定し、キャンセル漏れで接続が残らないようにする (ミリ秒)
+                    http_options=types.HttpOptions(timeout=int(GEMINI_TIMEOUT_SECONDS * 1000)),
+                )
+    return _client
+
+
+async def close_client():
+    """アプリケーション終了時にコネクションプールを閉じる"""
+    global _client
+    if _client is not None:
+        await _client.aio.aclose()
+        _client = None
 
-def generate_match_results_gemini(
-    profile: Profile, 
-    scholarships: List[Scholarship]
+
+def _is_overload(e: Exception) -> bool:
+    """429 (Too Many Requests) や 503 (過負荷) など、呼び出しを減らすべき応答か"""
+    from google.genai import errors as genai_errors # get_client() で読み込み済み
+    return isinstance(e, genai_errors.APIError) and e.code in (429, 503)
+
+
+def _is_client_error(e: Exception) -> bool:
+    """リクエスト側の誤り (429 以外の 4xx) はGemini側の不調とはみなさない"""
+    from google.genai import errors as genai_errors
+    return isinstance(e, genai_errors.ClientError) and e.code != 429
+
+
+async def _call_gemini(prompt: str):
+    """
+    サーキットブレーカーと同時実行数の上限を通して generate_content を呼び出し、結果を両者に記録する
+    ブレーカーが開いている場合は待たずに CircuitOpenError を送出する
+    """
+    gemini_breaker.before_call()
+    attempted = False
+    try:
+        # 同時実行数の上限を超える場合は空きが出るまで待機する
+        async with gemini_limiter.slot():
+            attempted = True
+            started = time.perf_counter()
+            try:
+                # API呼び出し（待機時間は含めずに計測する）
+                client = get_client() # 生成設定 (_generation_config) もここで用意される
+                with observe_stage("gemini_call"):
+                    response = await client.aio.models.generate_content(
+                        model=MODEL_NAME,
+                        contents=prompt,
+                        config=_generation_config
+                    )
+            except asyncio.CancelledError:
+                gemini_breaker.record_failure("timeout")
+                gemini_limiter.record_timeout()
+                raise
+            except Exception as e:
+                if _is_client_error(e):
+                    gemini_breaker.record_abandoned()
+                else:
+                    gemini_breaker.record_failure("error")
+                if _is_overload(e):
+                    gemini_limiter.record_overload()
+                raise
+            gemini_breaker.record_success()
+            gemini_limiter.record_success(time.perf_counter() - started)
+            return response
+    finally:
+        if not attempted:
+            # 順番待ちの間にキャンセルされた（ブレーカーの試行枠を返す）
+            gemini_breaker.record_abandoned()
+
+
+async def generate_match_results_gemini(
+    profile: Profile,
+    catalog: ScholarshipCatalog,
+    positions: Sequence[int]
 ) -> MatchResponseSchema:
     """
-    Gemini APIを呼び出し、構造化されたマッチング結果を取得する
+    Gemini APIを非同期で呼び出し、構造化されたマッチング結果を取得する
+    positions はプロンプトに含める奨学金のカタログ上の位置 (prompt_builder.select_prompt_candidates の結果)
+    (呼び出し側の asyncio.wait_for でタイムアウトした場合は、通信ごとキャンセルされる)
     """
-    
-    model = genai.GenerativeModel(
-        model_name="gemini-1.5-flash", # 高速・安価なモデル推奨
-        # 構造化出力（JSON）の設定
-        generation_config=types.GenerationConfig(
-            response_mime_type="application/json",
-            response_schema=MatchResponseSchema,
-            temperature=0.2 # 創造性よりも一貫性を優先
-        )
-    )
-    
-    # プロンプトの組み立て
-    system_instruction = (
-        "あなたは奨学金マッチングAI「HOPE」です。ユーザーのプロフィールと提供された奨学金データベースのみに基づき、"
-        "最も適合性の高いTOP5を、指定されたJSONスキーマで返してください。"
-        "データベース外の情報は絶対に生成せず、優しく前向きなトーンで説明を加えてください。"
-    )
-    
-    # データをJSON文字列に変換してプロンプトに埋め込む
-    # Profileを辞書に変換
-    profile_data = profile.model_dump_json(exclude={'id', 'created_at', 'match_results'})
-    
-    # Scholarshipのリストを辞書リストに変換
-    scholarships_data = [
-        sch.model_dump_json(exclude={'id', 'match_results', 'last_checked'}) 
-        for sch in scholarships
-    ]
-
-    prompt = (
-        f"--- ユーザープロフィール ---\n{profile_data}\n\n"
-        f"--- 奨学金データベース (検索対象) ---\n{json.dumps(scholarships_data, ensure_ascii=False)}\n\n"
-        "このデータベース内から、ユーザーに最適な奨学金TOP5を選び出し、指定されたJSONスキーマに従ってJSONを生成してください。"
-    )
+    with observe_stage("prompt_build"):
+        prompt = build_prompt(profile, catalog, positions)
 
     try:
-        # API呼び出し
-        response = model.generate_content(
-            prompt,
-            system_instruction=system_instruction
-        )
-        
-        # 応答のテキスト（JSON文字列）をPydanticモデルにパース
-        return MatchResponseSchema.model_validate_json(response.text)
+        response = await _call_gemini(prompt)
+
+        # 応答のテキスト（JSON文字列）をPydanticモデルにパースし、IDをカタログの奨学金に戻す
+        with observe_stage("response_parse"):
+            compact = GeminiMatchResponseSchema.model_validate_json(response.text)
+            result = expand_response(compact, catalog, positions)
+        GEMINI_CALLS.labels("success").inc()
+        return result
 
+    except CircuitOpenError:
+        # Geminiの不調が続いているため呼び出さなかった
+        GEMINI_CALLS.labels("rejected").inc()
+        raise
+    except asyncio.CancelledError:
+        # 呼び出し側の asyncio.wait_for がタイムアウトしてキャンセルされた
+        GEMINI_CALLS.labels("timeout").inc()
+        raise
     except Exception as e:
         # 失敗ログを記録（ステップ7のフェイルセーフに繋げる）
-        print(f"Gemini API Error: {e}")
-        raise # エラーを呼び出し元に伝播させる
\ No newline at end of file
+        GEMINI_CALLS.labels("error").inc()
+        print(f"Gemini API Error: {e!r}")
+        raise # エラーを呼び出し元に伝播させる
@@ -0,0 +1,154 @@
+import os
+import json
+import hashlib
+import threading
+from datetime import date, datetime
+from typing import Any, Callable, Dict, Hashable, NamedTuple, Optional
+from cachetools import TTLCache
+from fastapi import Request, Response
+
+from .metrics import CACHE_EVENTS
+from .notifications import MATCH_NOTIFY_MODE
+
+HTTP_CACHE_MAXSIZE = int(os.getenv("HTTP_CACHE_MAXSIZE", "5000"))
+# 無効化の通知を取りこぼした場合の安全弁として、一定時間で必ず破棄する
+HTTP_CACHE_TTL_SECONDS = float(os.getenv("HTTP_CACHE_TTL_SECONDS", "300"))
+# マッチング結果は、保存・削除の通知が全プロセスに届く (pg_notify) 場合のみキャッシュする
+# inprocess では別プロセスのワーカー・データ保持ジョブによる書き込みを検知できないため、毎回DBから読む（ETag による 304 は有効）
+MATCH_RESULTS_CACHE_ENABLED = MATCH_NOTIFY_MODE == "postgres"
+
+
+class CachedBody(NamedTuple):
+    body: bytes # シリアライズ済みのJSON
+    etag: str
+    headers: Dict[str, str] # Cache-Control / Link など、本文から決まるヘッダー
+
+
+def _json_default(value: Any):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} はJSONに変換できません")
+
+
+def dump_json(data: Any) -> bytes:
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":"), default=_json_default).encode("utf-8")
+
+
+def serialize_body(data: Any, headers: Optional[Callable[[Any], Dict[str, str]]] = None) -> CachedBody:
+    """JSONにシリアライズし、本文から ETag を計算する"""
+    body = dump_json(data)
+    return CachedBody(
+        body=body,
+        etag=f'"{hashlib.blake2b(body, digest_size=16).hexdigest()}"',
+        headers=headers(data) if headers else {},
+    )
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    # 弱い比較（W/ の有無は区別しない）
+    candidates = {tag.strip().removeprefix("W/") for tag in if_none_match.split(",")}
+    return etag in candidates
+
+
+# ====================================================================
+# レスポンスキャッシュ（シリアライズ済みのJSONとETagを保持する）
+# ====================================================================
+class HttpResponseCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self._memory: TTLCache = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._lock = threading.Lock()
+        self._epoch = 0 # invalidate のたびに増える
+        self.stats = {"hits": 0, "misses": 0, "not_modified": 0, "invalidations": 0}
+
+    def _count(self, name: str):
+        with self._lock:
+            self.stats[name] += 1
+        CACHE_EVENTS.labels("http", name).inc()
+
+    def get_or_build(
+        self,
+        key: Hashable,
+        build: Callable[[], Any],
+        headers: Optional[Callable[[Any], Dict[str, str]]] = None,
+    ) -> Optional[CachedBody]:
+        """
+        キャッシュにあればそれを返し、無ければ build() の結果をシリアライズして保存する
+        build() が None を返した場合（結果がまだ無いなど）は保存せずに None を返す
+        """
+        with self._lock:
+            cached = self._memory.get(key)
+        if cached is not None:
+            self._count("hits")
+            return cached
+
+        self._count("misses")
+        with self._lock:
+            epoch = self._epoch
+        data = build()
+        if data is None:
+            return None
+        cached = serialize_body(data, headers)
+        with self._lock:
+            # 読み込み中に無効化の通知が届いた場合は、古い可能性があるため保存しない
+            if self._epoch == epoch:
+                self._memory[key] = cached
+        return cached
+
+    def invalidate(self, key: Hashable):
+        with self._lock:
+            self._epoch += 1
+            if self._memory.pop(key, None) is not None:
+                self.stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+
+    def snapshot(self) -> Dict[str, float]:
+        """監視用のカウンタを返す"""
+        with self._lock:
+            stats = dict(self.stats)
+            stats["size"] = len(self._memory)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+http_cache = HttpResponseCache(maxsize=HTTP_CACHE_MAXSIZE, ttl=HTTP_CACHE_TTL_SECONDS)
+
+
+def cached_json_response(request: Request, cached: CachedBody) -> Response:
+    """
+    キャッシュ済みのJSONをそのまま返す（pydantic による検証・シリアライズを行わない）
+    If-None-Match が ETag と一致する場合は本文なしの 304 を返す
+    """
+    response_headers = {"ETag": cached.etag, **cached.headers}
+    if _etag_matches(request.headers.get("if-none-match"), cached.etag):
+        http_cache._count("not_modified")
+        return Response(status_code=304, headers=response_headers)
+    return Response(content=cached.body, media_type="application/json", headers=response_headers)
+
+
+def match_results_key(profile_id: int) -> Hashable:
+    return ("match_results", profile_id)
+
+
+def match_results_body(
+    profile_id: int,
+    build: Callable[[], Any],
+    headers: Optional[Callable[[Any], Dict[str, str]]] = None,
+) -> Optional[CachedBody]:
+    """マッチング結果の本文（キャッシュが無効な構成では毎回 build() から作る）"""
+    if MATCH_RESULTS_CACHE_ENABLED:
+        return http_cache.get_or_build(match_results_key(profile_id), build, headers)
+    data = build()
+    return None if data is None else serialize_body(data, headers)
+
+
+def invalidate_match_results(event: Dict[str, Any]):
+    """結果の保存通知を受けて、そのプロフィールのキャッシュを破棄する（notifications.broker から呼ばれる）"""
+    http_cache.invalidate(match_results_key(event["profile_id"]))
@@ -0,0 +1,89 @@
+import re
+import unicodedata
+from functools import lru_cache
+from typing import NamedTuple, Optional
+
+# 「条件なし」とみなす表記
+UNRESTRICTED_WORDS = {"", "条件なし", "制限なし", "不問", "なし"}
+
+_MAN = 10_000
+_OKU = 100_000_000
+
+_NUMBER = r"(\d+(?:\.\d+)?)\s*(億|万)?\s*円?"
+_RANGE_RE = re.compile(_NUMBER + r"\s*[~〜～\-－]\s*" + _NUMBER)
+_OPEN_UPPER_RE = re.compile(r"^[~〜～]\s*" + _NUMBER + r"$") # 例: ~300万
+_OPEN_LOWER_RE = re.compile(r"^" + _NUMBER + r"\s*[~〜～]$") # 例: 1000万~
+_BOUND_RE = re.compile(_NUMBER + r"\s*(未満|以下|以上|超|を超える|より上|まで)")
+
+
+class IncomeRange(NamedTuple):
+    """年収の範囲（円）。下限を含み上限を含まない [min, max)。max が None の場合は上限なし"""
+    min: int
+    max: Optional[int]
+
+
+def _to_yen(number: str, unit: Optional[str]) -> int:
+    value = float(number)
+    if unit == "億":
+        value *= _OKU
+    elif unit == "万":
+        value *= _MAN
+    return int(round(value))
+
+
+@lru_cache(maxsize=4096)
+def parse_income_requirement(text: Optional[str]) -> Optional[IncomeRange]:
+    """
+    年収条件の文字列を数値の範囲に変換する（解析結果はキャッシュされる）
+    例: "世帯年収400万円未満" -> IncomeRange(0, 4000000)
+        "300~500万" -> IncomeRange(3000000, 5000000)
+        "条件なし" -> IncomeRange(0, None)
+    解析できない場合は None を返す
+    """
+    normalized = unicodedata.normalize("NFKC", text or "").replace(",", "").strip()
+    if normalized in UNRESTRICTED_WORDS:
+        return IncomeRange(0, None)
+
+    # 範囲指定 (例: 300~500万) は右側の単位を左側にも適用する
+    match = _RANGE_RE.search(normalized)
+    if match:
+        low_num, low_unit, high_num, high_unit = match.groups()
+        return IncomeRange(_to_yen(low_num, low_unit or high_unit), _to_yen(high_num, high_unit))
+
+    match = _OPEN_UPPER_RE.match(normalized)
+    if match:
+        return IncomeRange(0, _to_yen(*match.groups()))
+
+    match = _OPEN_LOWER_RE.match(normalized)
+    if match:
+        return IncomeRange(_to_yen(*match.groups()), None)
+
+    match = _BOUND_RE.search(normalized)
+    if match:
+        number, unit, qualifier = match.groups()
+        yen = _to_yen(number, unit)
+        if qualifier == "未満":
+            return IncomeRange(0, yen)
+        if qualifier in ("以下", "まで"):
+            return IncomeRange(0, yen + 1)
+        if qualifier == "以上":
+            return IncomeRange(yen, None)
+        return IncomeRange(yen + 1, None) # 超 / を超える / より上
+
+    return None
+
+
+def stored_income_range(income_min: Optional[int], income_max: Optional[int], text: Optional[str]) -> Optional[IncomeRange]:
+    """取り込み時に解析済みの列 (income_min / income_max) があればそれを使い、無ければ年収条件の文字列を解析する"""
+    if income_min is not None:
+        return IncomeRange(income_min, income_max)
+    return parse_income_requirement(text)
+
+
+def ranges_overlap(band: IncomeRange, requirement: IncomeRange) -> bool:
+    """プロフィールの年収バンドと奨学金の年収条件の範囲が重なるか（区間比較）"""
+    if requirement.max is not None and band.min >= requirement.max:
+        return False
+    if band.max is not None and requirement.min >= band.max:
+        return False
+    return True
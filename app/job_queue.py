@@ -0,0 +1,352 @@
+import os
+import time
+import asyncio
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import List, NamedTuple, Optional
+from sqlalchemy.exc import IntegrityError
+from sqlmodel import Session, select, func, or_, and_
+
+from .database import get_engine
+from .models import MatchJob, MatchBatch, MatchResult, Profile
+from .matching_service import run_matching_strategy
+from .batch_matching import run_batch_matching
+from .gemini_client import get_client, GEMINI_TIMEOUT_SECONDS
+from .notifications import notify_results_ready
+
+# サーバーレス環境（Vercel など）で動かす場合は "1"。常駐のスケジューラー・ワーカーを起動しない
+# (定期ジョブは /api/cron/{job}、マッチングジョブは /api/cron/match-jobs を外部の cron から呼び出すか、python -m app.worker で処理する)
+SERVERLESS_MODE = os.getenv("HOPE_SERVERLESS", "1" if os.getenv("VERCEL") else "0") == "1"
+# "inprocess": APIサーバー内でワーカーを起動 / "external": python -m app.worker で別プロセス起動
+MATCH_WORKER_MODE = os.getenv("MATCH_WORKER_MODE", "external" if SERVERLESS_MODE else "inprocess")
+MATCH_WORKER_CONCURRENCY = int(os.getenv("MATCH_WORKER_CONCURRENCY", "4"))
+MATCH_WORKER_POLL_SECONDS = float(os.getenv("MATCH_WORKER_POLL_SECONDS", "1.0"))
+MATCH_JOB_MAX_ATTEMPTS = int(os.getenv("MATCH_JOB_MAX_ATTEMPTS", "3"))
+MATCH_JOB_RETRY_BASE_SECONDS = float(os.getenv("MATCH_JOB_RETRY_BASE_SECONDS", "5"))
+# running のまま更新されないジョブは、ワーカーが落ちたとみなして再取得する
+MATCH_JOB_STALE_SECONDS = float(os.getenv("MATCH_JOB_STALE_SECONDS", "300"))
+# queued のジョブがこの件数を超えたら新規受付を拒否する（バックプレッシャー）
+MATCH_QUEUE_MAX_DEPTH = int(os.getenv("MATCH_QUEUE_MAX_DEPTH", "10000"))
+# /api/cron/match-jobs の1回の呼び出しでジョブを処理する時間（関数の実行時間の上限より短くする）
+MATCH_CRON_BUDGET_SECONDS = float(os.getenv("MATCH_CRON_BUDGET_SECONDS", "50"))
+# 残り時間がこれより短い場合は新しいジョブを取り出さない（Geminiのタイムアウト + フェイルセーフ・保存の時間）
+MATCH_CRON_JOB_RESERVE_SECONDS = float(os.getenv("MATCH_CRON_JOB_RESERVE_SECONDS", str(GEMINI_TIMEOUT_SECONDS + 5)))
+
+
+class ClaimedJob(NamedTuple):
+    id: int
+    profile_id: Optional[int]
+    attempts: int
+    batch_id: Optional[int] = None
+
+
+@dataclass
+class DrainReport:
+    """/api/cron/match-jobs の1回分の処理結果"""
+    completed: int = 0
+    failed: int = 0
+    budget_seconds: float = 0.0
+    elapsed_seconds: float = 0.0
+    queue_empty: bool = False # 時間内にキューが空になった
+
+
+# ====================================================================
+# ジョブの登録・取得・完了
+# ====================================================================
+def enqueue_match_job(session: Session, profile_id: int) -> MatchJob:
+    """
+    マッチングジョブを登録する。同じプロフィールの未完了ジョブがあればそれを返す
+    同時に登録された場合も、部分ユニークインデックス (uq_matchjob_profile_active) により1件だけが登録される
+    """
+    existing = _active_job(session, profile_id)
+    if existing:
+        return existing
+
+    # 以前の実行で保存された結果と区別するため、登録時点の結果IDの最大値を記録する
+    last_result_id = session.exec(
+        select(func.max(MatchResult.id)).where(MatchResult.profile_id == profile_id)
+    ).one()
+    job = MatchJob(profile_id=profile_id, results_after_id=last_result_id or 0)
+    session.add(job)
+    try:
+        session.commit()
+    except IntegrityError:
+        # 確認から登録までの間に、他のリクエストが同じプロフィールのジョブを登録した
+        session.rollback()
+        existing = _active_job(session, profile_id)
+        if existing is None:
+            raise
+        return existing
+    session.refresh(job)
+    return job
+
+
+def _active_job(session: Session, profile_id: int) -> Optional[MatchJob]:
+    return session.exec(
+        select(MatchJob)
+        .where(MatchJob.profile_id == profile_id)
+        .where(MatchJob.status.in_(["queued", "running"]))
+        .order_by(MatchJob.id.desc())
+    ).first()
+
+
+def claim_next_job(session: Session) -> Optional[ClaimedJob]:
+    """
+    実行可能なジョブを1件取り出して running にする。
+    FOR UPDATE SKIP LOCKED により、複数のワーカー・プロセスが同じジョブを取り合わない
+    """
+    now = datetime.utcnow()
+    stale_before = now - timedelta(seconds=MATCH_JOB_STALE_SECONDS)
+    _fail_exhausted_stale_jobs(session, stale_before)
+    job = session.exec(
+        select(MatchJob)
+        .where(or_(
+            and_(MatchJob.status == "queued", MatchJob.run_after <= now),
+            and_(
+                MatchJob.status == "running",
+                MatchJob.started_at < stale_before,
+                MatchJob.attempts < MATCH_JOB_MAX_ATTEMPTS,
+            ),
+        ))
+        .order_by(MatchJob.run_after, MatchJob.id)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+    ).first()
+    if job is None:
+        session.rollback()
+        return None
+
+    job.status = "running"
+    job.attempts += 1
+    job.started_at = now
+    session.add(job)
+    session.commit()
+    return ClaimedJob(id=job.id, profile_id=job.profile_id, attempts=job.attempts, batch_id=job.batch_id)
+
+
+def _fail_exhausted_stale_jobs(session: Session, stale_before: datetime):
+    """
+    running のまま止まり、試行回数の上限に達したジョブを failed にする
+    （ワーカーが落ち続けるジョブを無限に再取得しないようにする）
+    """
+    jobs = session.exec(
+        select(MatchJob)
+        .where(MatchJob.status == "running")
+        .where(MatchJob.started_at < stale_before)
+        .where(MatchJob.attempts >= MATCH_JOB_MAX_ATTEMPTS)
+        .with_for_update(skip_locked=True)
+    ).all()
+    if not jobs:
+        return
+    for job in jobs:
+        print(f"--- ジョブ {job.id} は応答のないまま試行回数の上限 ({job.attempts} 回) に達したため failed にします ---")
+        job.last_error = "ワーカーが応答しないまま試行回数の上限に達しました"
+        job.status = "failed"
+        job.finished_at = datetime.utcnow()
+        session.add(job)
+        _sync_batch_and_notify(session, job)
+    session.commit()
+
+
+def complete_job(session: Session, job_id: int):
+    job = session.get(MatchJob, job_id)
+    if job is None:
+        return
+    job.status = "done"
+    job.last_error = None
+    job.finished_at = datetime.utcnow()
+    session.add(job)
+    # SSE はジョブが完了するまで以前の結果を返さないため、完了したことも通知する
+    if job.profile_id is not None:
+        notify_results_ready(session, [job.profile_id])
+    session.commit()
+
+
+def fail_job(session: Session, job_id: int, error: str):
+    """
+    失敗したジョブを、上限回数までは指数バックオフで再実行待ちに戻し、超えたら failed にする
+    """
+    job = session.get(MatchJob, job_id)
+    if job is None:
+        return
+    job.last_error = error[:1000]
+    if job.attempts < MATCH_JOB_MAX_ATTEMPTS:
+        job.status = "queued"
+        job.run_after = datetime.utcnow() + timedelta(
+            seconds=MATCH_JOB_RETRY_BASE_SECONDS * (2 ** (job.attempts - 1))
+        )
+    else:
+        job.status = "failed"
+        job.finished_at = datetime.utcnow()
+    session.add(job)
+    _sync_batch_and_notify(session, job)
+    session.commit()
+
+
+def _sync_batch_and_notify(session: Session, job: MatchJob):
+    """ジョブの状態をバッチに反映し、failed になった場合は結果を待っているクライアントに通知する"""
+    # 一括マッチングのジョブは、バッチの状態もジョブに合わせる
+    if job.batch_id is not None:
+        batch = session.get(MatchBatch, job.batch_id)
+        if batch is not None:
+            batch.status = job.status
+            batch.finished_at = job.finished_at
+            session.add(batch)
+
+    # 再試行しない場合は、結果を待っているクライアントに失敗を通知する
+    if job.status == "failed":
+        if job.batch_id is not None:
+            profile_ids = session.exec(select(Profile.id).where(Profile.batch_id == job.batch_id)).all()
+        else:
+            profile_ids = [job.profile_id]
+        notify_results_ready(session, profile_ids, status="failed")
+
+
+def latest_job_for_profile(session: Session, profile_id: int) -> Optional[MatchJob]:
+    return session.exec(
+        select(MatchJob)
+        .where(MatchJob.profile_id == profile_id)
+        .order_by(MatchJob.id.desc())
+    ).first()
+
+
+def queue_depth(session: Session) -> int:
+    """実行待ち (queued) のジョブ件数"""
+    return session.exec(
+        select(func.count()).select_from(MatchJob).where(MatchJob.status == "queued")
+    ).one()
+
+
+# ====================================================================
+# ワーカープール
+# ====================================================================
+def _claim() -> Optional[ClaimedJob]:
+    with Session(get_engine()) as session:
+        return claim_next_job(session)
+
+
+def _complete(job_id: int):
+    with Session(get_engine()) as session:
+        complete_job(session, job_id)
+
+
+def _fail(job_id: int, error: str):
+    with Session(get_engine()) as session:
+        fail_job(session, job_id, error)
+
+
+class MatchWorkerPool:
+    """
+    マッチングジョブを並行して処理するワーカー群。
+    APIサーバー内でも、別プロセス (python -m app.worker) でも動作し、プロセスを増やせば水平に拡張できる
+    """
+
+    def __init__(
+        self,
+        concurrency: int = MATCH_WORKER_CONCURRENCY,
+        poll_seconds: float = MATCH_WORKER_POLL_SECONDS,
+    ):
+        self.concurrency = concurrency
+        self.poll_seconds = poll_seconds
+        self._tasks: List[asyncio.Task] = []
+        self._stopping = False
+        self._wakeup: Optional[asyncio.Event] = None
+
+    async def start(self):
+        # Gemini SDK の読み込みを最初のジョブの制限時間内で行わないよう、起動時にクライアントを生成しておく
+        await asyncio.to_thread(get_client)
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+        self._tasks = [
+            asyncio.create_task(self._worker_loop(n), name=f"match-worker-{n}")
+            for n in range(self.concurrency)
+        ]
+        print(f"--- マッチングワーカーを {self.concurrency} 並列で開始しました ---")
+
+    async def stop(self, timeout: float = 30.0):
+        """実行中のジョブの完了を待ってから停止する"""
+        self._stopping = True
+        self.wake()
+        if self._tasks:
+            _, pending = await asyncio.wait(self._tasks, timeout=timeout)
+            for task in pending:
+                task.cancel()
+        self._tasks = []
+        print("--- マッチングワーカーを停止しました ---")
+
+    def wake(self):
+        """新しいジョブが登録されたことをワーカーに知らせ、ポーリング待ちを打ち切る"""
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _idle(self):
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_seconds)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _worker_loop(self, worker_no: int):
+        while not self._stopping:
+            try:
+                job = await asyncio.to_thread(_claim)
+            except Exception as e:
+                print(f"--- [ワーカー{worker_no}] ジョブ取得エラー: {e} ---")
+                await self._idle()
+                continue
+
+            if job is None:
+                await self._idle()
+                continue
+
+            await self.run_job(job)
+
+    async def drain(self, budget_seconds: float = MATCH_CRON_BUDGET_SECONDS) -> DrainReport:
+        """
+        常駐のワーカーを使わない環境（サーバーレス）で、cron の1回の呼び出しの中でジョブを処理する
+        concurrency 並列で、残り時間が MATCH_CRON_JOB_RESERVE_SECONDS を下回るかキューが空になるまで取り出す
+        """
+        started = time.monotonic()
+        deadline = started + budget_seconds
+        report = DrainReport(budget_seconds=budget_seconds)
+        await asyncio.to_thread(get_client)
+
+        async def drain_loop():
+            while deadline - time.monotonic() >= MATCH_CRON_JOB_RESERVE_SECONDS:
+                job = await asyncio.to_thread(_claim)
+                if job is None:
+                    report.queue_empty = True
+                    return
+                if await self.run_job(job):
+                    report.completed += 1
+                else:
+                    report.failed += 1
+
+        await asyncio.gather(*(drain_loop() for _ in range(self.concurrency)))
+        report.elapsed_seconds = round(time.monotonic() - started, 3)
+        print(
+            f"--- マッチングジョブを処理しました: 完了 {report.completed} 件, 失敗 {report.failed} 件 "
+            f"({report.elapsed_seconds:.1f} 秒{', キューは空' if report.queue_empty else ''}) ---"
+        )
+        return report
+
+    async def run_job(self, job: ClaimedJob) -> bool:
+        """ジョブを1件実行し、成功したかを返す（失敗した場合は再試行待ち・failed にする）"""
+        # ワーカーは自前のセッションを開く（リクエスト単位のセッションは使わない）
+        # DBの読み書きはマッチング処理の中で別スレッドから行い、接続の返却もループの外で行う
+        session = Session(get_engine())
+        try:
+            if job.batch_id is not None:
+                await run_batch_matching(job.batch_id, session)
+            else:
+                await run_matching_strategy(job.profile_id, session)
+        except Exception as e:
+            target = f"batch {job.batch_id}" if job.batch_id is not None else job.profile_id
+            print(f"[{target}] ジョブ {job.id} 失敗 (試行 {job.attempts} 回目): {e}")
+            await asyncio.to_thread(_fail, job.id, repr(e))
+            return False
+        else:
+            await asyncio.to_thread(_complete, job.id)
+            return True
+        finally:
+            await asyncio.to_thread(session.close)
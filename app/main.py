@@ -1,54 +1,83 @@
 import os
-from fastapi import FastAPI, Depends, HTTPException, BackgroundTasks
+import hmac
+from dataclasses import asdict
+from fastapi import FastAPI, Depends, Header, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlmodel import Session, select
-from typing import List, Dict
+from sqlmodel.ext.asyncio.session import AsyncSession
+from typing import List, Dict, Optional
 from datetime import datetime
 import asyncio
+import json
 
-#APSscheduler関連のインポート
-from apscheduler.schedulers.background import BackgroundScheduler
 from contextlib import asynccontextmanager
 
 
 
 # 作成した各モジュールをインポート
-from .database import get_session, engine
-from .models import Profile, Scholarship, MatchResult
-from .schemas import MatchResponseSchema
-from .matching_logic import generate_rule_based_results # フェイルセーフ用
-from .gemini_client import generate_match_results_gemini # Geminiクライアント
+from .database import get_session, get_async_session, get_engine, get_async_engine, dispose_engines
+from .models import Profile, Scholarship, MatchResult, MatchBatch
+from .schemas import MatchResponseSchema, MatchBatchRequest
+from .job_queue import MatchWorkerPool, enqueue_match_job, latest_job_for_profile, queue_depth, MATCH_QUEUE_MAX_DEPTH, MATCH_WORKER_MODE, SERVERLESS_MODE, MATCH_CRON_BUDGET_SECONDS
+from .gemini_client import close_client, resilience_snapshot # Geminiクライアント
+from .gemini_cache import response_cache # Gemini応答キャッシュ
+from .batch_matching import create_match_batch, batch_results_page, MATCH_BATCH_MAX_PROFILES
+from .notifications import broker, result_listener, MATCH_NOTIFY_MODE, MATCH_SSE_MAX_WAIT_SECONDS, MATCH_SSE_HEARTBEAT_SECONDS
+from .catalog import read_catalog_version
+from .http_cache import http_cache, cached_json_response, match_results_body, invalidate_match_results
+from .metrics import refresh_queue_depth, render_metrics, METRICS_CONTENT_TYPE
 
 #スケジューラーのジョブのインポート
-from .scheduler import delete_old_data_job
+from .scheduler import SCHEDULED_JOBS, run_scheduled_job, start_background_scheduler
+
+# 結果が保存されたら、そのプロフィールのレスポンスキャッシュを破棄する
+broker.add_listener(invalidate_match_results)
+
+# /api/scholarships のブラウザ・CDN でのキャッシュ時間（秒）
+SCHOLARSHIPS_MAX_AGE = int(os.getenv("HTTP_CACHE_SCHOLARSHIPS_MAX_AGE", "60"))
+SCHOLARSHIP_COLUMNS = {column.name: column for column in Scholarship.__table__.columns}
+# /api/cron/{job} の呼び出しに必要なトークン (Authorization: Bearer <CRON_SECRET>)。未設定の場合は受け付けない
+CRON_SECRET = os.getenv("CRON_SECRET")
+
+#ライフスパンイベントの定義
+# マッチングジョブのワーカー (MATCH_WORKER_MODE=inprocess の場合のみ起動)
+worker_pool = MatchWorkerPool()
 
-#スケジューラーとライフスパンイベントの定義
-scheduler = BackgroundScheduler()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # アプリケーション起動時に実行
-    print("--- サーバー起動: スケジューラを開始します ---")
-    
-    # DBセッションをスケジューラージョブに渡すための設定
-    # (APSchedulerは別スレッドで動くため、新しいエンジン/セッションが必要)
-    job_engine = create_engine(DATABASE_URL)
-    
-    def job_wrapper():
-        with Session(job_engine) as session:
-            delete_old_data_job(session)
+    scheduler = None
+    if SERVERLESS_MODE:
+        # 呼び出しの間はプロセスが止まるため常駐のスケジューラーは使わず、cron から /api/cron/{job} を呼び出す
+        print("--- サーバー起動 (サーバーレス): 定期ジョブは /api/cron から実行します ---")
+        if MATCH_WORKER_MODE == "external" and not CRON_SECRET:
+            # マッチングジョブも /api/cron/match-jobs で処理するため、CRON_SECRET が無いとジョブが実行されない
+            print("--- 警告: CRON_SECRET が未設定のため /api/cron/match-jobs を呼び出せません（別プロセスのワーカーが無い場合、ジョブは実行されません） ---")
+    else:
+        print("--- サーバー起動: スケジューラを開始します ---")
+        scheduler = start_background_scheduler()
 
-    # ジョブを登録（例: 毎日午前3時に実行）
-    scheduler.add_job(job_wrapper, 'cron', hour=3, minute=0)
-    scheduler.start()
+    if MATCH_WORKER_MODE == "inprocess":
+        await worker_pool.start()
+    # 結果の完了通知を受け取り、SSE で待っているクライアントに届ける
+    if MATCH_NOTIFY_MODE == "postgres":
+        await result_listener.start()
     
     yield
     
     # アプリケーション終了時に実行
     print("--- サーバーシャットダウン: スケジューラを停止します ---")
-    scheduler.shutdown()
+    if MATCH_WORKER_MODE == "inprocess":
+        await worker_pool.stop()
+    await result_listener.stop()
+    if scheduler is not None:
+        scheduler.shutdown()
+    await close_client()
+    await dispose_engines()
 # -------------------------------------------------------------
 # FastAPIアプリケーションの初期化
-app = FastAPI(title="HOPE マッチングAI")
+app = FastAPI(title="HOPE マッチングAI", lifespan=lifespan)
 # -------------------------------------------------------------
 # 【追記】CORS設定
 # -------------------------------------------------------------
@@ -87,115 +116,398 @@ def create_profile(profile: Profile, session: Session = Depends(get_session)):
 # ----------------------------------------------------
 # 奨学金マスタ取得用 (テスト用)
 # ----------------------------------------------------
-@app.get("/api/scholarships", response_model=List[Scholarship], tags=["Scholarships"])
-def get_scholarships(session: Session = Depends(get_session)):
+@app.get("/api/scholarships", tags=["Scholarships"])
+def get_scholarships(
+    request: Request,
+    after: int = 0,
+    limit: int = Query(100, ge=1, le=1000),
+    fields: Optional[str] = None,
+    session: Session = Depends(get_session)
+):
     """
-    （テスト用）DBに登録されている奨学金マスタを全件取得します。
+    （テスト用）DBに登録されている奨学金マスタを id 順に取得します。
+    - after / limit: 続きは Link ヘッダー (rel="next") の URL で取得する
+    - fields: 返す項目をカンマ区切りで指定する（例: fields=name,provider,deadline。id は常に含まれる）
+    カタログのバージョンごとにシリアライズ済みのJSONをキャッシュし、ETag による 304 応答に対応する。
     """
-    return session.exec(select(Scholarship)).all()
+    names = ["id"]
+    if fields:
+        requested = [name.strip() for name in fields.split(",") if name.strip()]
+        unknown = [name for name in requested if name not in SCHOLARSHIP_COLUMNS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"不明な項目です: {', '.join(unknown)}")
+        names += [name for name in requested if name != "id"]
+    else:
+        names = list(SCHOLARSHIP_COLUMNS)
+
+    def build():
+        columns = [SCHOLARSHIP_COLUMNS[name] for name in names]
+        rows = session.exec(
+            select(*columns)
+            .where(Scholarship.id > after)
+            .order_by(Scholarship.id)
+            .limit(limit)
+        ).all()
+        return [dict(zip(names, row)) for row in rows]
+
+    def headers(page):
+        page_headers = {"Cache-Control": f"public, max-age={SCHOLARSHIPS_MAX_AGE}"}
+        if len(page) == limit:
+            query = f"after={page[-1]['id']}&limit={limit}" + (f"&fields={','.join(names)}" if fields else "")
+            page_headers["Link"] = f'</api/scholarships?{query}>; rel="next"'
+        return page_headers
+
+    # カタログが更新されるとバージョンが変わり、古いキャッシュは使われなくなる
+    # (キーを作るだけなので、カタログを読み込まずにバージョンの行だけを読む)
+    key = ("scholarships", read_catalog_version(session), after, limit, tuple(names))
+    return cached_json_response(request, http_cache.get_or_build(key, build, headers))
 
 # ----------------------------------------------------
 # マッチングAPI (ハイブリッド戦略)
 # ----------------------------------------------------
-async def run_matching_strategy(profile_id: int, session: Session):
+@app.post("/api/request_match", tags=["Matching"])
+async def request_match(
+    profile_id: int,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    マッチングリクエストをジョブキューに登録し、ワーカーでハイブリッド処理を実行する。
+    （ユーザーを待たせないため、即時レスポンスを返す）
+    """
+    if not await session.get(Profile, profile_id):
+        raise HTTPException(status_code=404, detail="プロファイルが見つかりません。")
+
+    if await session.run_sync(queue_depth) >= MATCH_QUEUE_MAX_DEPTH:
+        raise HTTPException(status_code=503, detail="混雑しています。しばらくしてから再度お試しください。")
+
+    job = await session.run_sync(enqueue_match_job, profile_id)
+    worker_pool.wake()
+    
+    return {
+        "status": "success", 
+        "message": "マッチング処理を受け付けました。結果は stream_url から受け取れます。",
+        "profile_id": profile_id,
+        "job_id": job.id,
+        "stream_url": f"/api/match_results/stream?profile_id={profile_id}"
+    }
+
+@app.get("/api/match_status", tags=["Matching"])
+def get_match_status(
+    profile_id: int,
+    session: Session = Depends(get_session)
+):
     """
-    バックグラウンドでハイブリッド・マッチングを実行する関数
+    指定されたプロファイルIDの最新のマッチングジョブの状態を返す。
     """
-    print(f"[{profile_id}] マッチング処理を開始...")
-    profile = session.get(Profile, profile_id)
-    if not profile:
-        print(f"[{profile_id}] エラー: プロファイルが見つかりません。")
-        return
+    job = latest_job_for_profile(session, profile_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="マッチングジョブが見つかりません。")
+    return {
+        "profile_id": profile_id,
+        "job_id": job.id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at
+    }
 
-    # DBから全奨学金を取得
-    # (注：本番では全件取得は非効率なため、ルールベースで事前フィルタリング推奨)
-    scholarships = session.exec(
-        select(Scholarship).where(Scholarship.is_published == True)
-    ).all()
+# ----------------------------------------------------
+# 一括マッチングAPI (学校単位などで複数のプロフィールをまとめて処理)
+# ----------------------------------------------------
+def _batch_or_404(session: Session, batch_id: int) -> MatchBatch:
+    batch = session.get(MatchBatch, batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="バッチが見つかりません。")
+    return batch
 
-    try:
-        # 1. Gemini API (メイン戦略) を呼び出す (タイムアウト設定)
-        print(f"[{profile_id}] メイン戦略 (Gemini) を試行...")
-        gemini_response = await asyncio.wait_for(
-            generate_match_results_gemini(profile, scholarships),
-            timeout=10.0 # 10秒でタイムアウト
+def _batch_pending_response(batch: MatchBatch):
+    """バッチが未完了の場合のレスポンス（完了していれば None）"""
+    if batch.status in ("queued", "running"):
+        return JSONResponse(
+            status_code=202,
+            content={"status": batch.status, "detail": "マッチング処理中です。数秒後に再度確認してください。"}
         )
-        
-        print(f"[{profile_id}] Gemini 成功。結果をDBに保存します。")
-        # MatchResult オブジェクトに変換してDBに保存
-        for res_item in gemini_response.results:
-            # 奨学金IDを見つける (本番では辞書検索などで効率化)
-            sch_id = next(
-                (sch.id for sch in scholarships if sch.name == res_item.name), 
-                None
-            )
-            
-            match_result = MatchResult(
-                rank=res_item.rank,
-                score=res_item.score,
-                why_match=res_item.why_match,
-                difficulty=res_item.difficulty,
-                deadline=datetime.fromisoformat(res_item.deadline),
-                amount_per_year=res_item.amount_per_year,
-                url=res_item.url,
-                todo=res_item.todo,
-                digest=gemini_response.digest,
-                profile_id=profile_id,
-                scholarship_id=sch_id,
-                raw_json=res_item.model_dump_json()
-            )
-            session.add(match_result)
-
-    except Exception as e:
-        # 2. フェイルセーフ戦略 (ルールベース) を実行
-        print(f"[{profile_id}] Gemini 失敗 ({e})。フェイルセーフ (ルールベース) を実行します。")
-        rule_based_results = generate_rule_based_results(session, profile_id)
-        
-        for res_item in rule_based_results:
-            session.add(res_item)
-
-    finally:
-        # 3. 実行結果をコミット
-        session.commit()
-        print(f"[{profile_id}] マッチング処理完了。")
+    if batch.status == "failed":
+        raise HTTPException(status_code=500, detail="マッチング処理に失敗しました。再度リクエストしてください。")
+    return None
 
+@app.post("/api/match_batches", tags=["Matching"])
+async def request_match_batch(
+    request: MatchBatchRequest,
+    session: AsyncSession = Depends(get_async_session)
+):
+    """
+    複数のプロフィールを一括で登録し、まとめてマッチングするジョブを登録する。
+    同じ内容のプロフィールはGemini呼び出しを共有する。結果は batch_id でページング・ストリーミング取得する。
+    """
+    if len(request.profiles) > MATCH_BATCH_MAX_PROFILES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"1回に登録できるプロフィールは {MATCH_BATCH_MAX_PROFILES} 件までです。"
+        )
 
-@app.post("/api/request_match", tags=["Matching"])
-async def request_match(
-    profile_id: int,
-    background_tasks: BackgroundTasks,
+    if await session.run_sync(queue_depth) >= MATCH_QUEUE_MAX_DEPTH:
+        raise HTTPException(status_code=503, detail="混雑しています。しばらくしてから再度お試しください。")
+
+    batch, job = await session.run_sync(create_match_batch, request.profiles)
+    worker_pool.wake()
+
+    return {
+        "status": "success",
+        "message": "一括マッチング処理を受け付けました。結果は batch_id で確認してください。",
+        "batch_id": batch.id,
+        "total": batch.total,
+        "job_id": job.id
+    }
+
+@app.get("/api/match_batches/{batch_id}", tags=["Matching"])
+def get_match_batch(
+    batch_id: int,
     session: Session = Depends(get_session)
 ):
     """
-    マッチングリクエストを受け付け、バックグラウンドでハイブリッド処理を実行する。
-    （ユーザーを待たせないため、即時レスポンスを返す）
+    一括マッチングの進捗を返す。
     """
-    background_tasks.add_task(run_matching_strategy, profile_id, session)
-    
+    batch = _batch_or_404(session, batch_id)
     return {
-        "status": "success", 
-        "message": "マッチング処理を受け付けました。数秒後に結果を確認してください。",
-        "profile_id": profile_id
+        "batch_id": batch.id,
+        "status": batch.status,
+        "total": batch.total,
+        "completed": batch.completed,
+        "gemini_calls": batch.gemini_calls,
+        "created_at": batch.created_at,
+        "finished_at": batch.finished_at
+    }
+
+@app.get("/api/match_batches/{batch_id}/results", tags=["Matching"])
+def get_match_batch_results(
+    batch_id: int,
+    after: int = 0,
+    limit: int = 100,
+    session: Session = Depends(get_session)
+):
+    """
+    一括マッチングの結果をプロフィール単位でページングして返す。
+    次のページは、レスポンスの next_after を after に指定して取得する。
+    """
+    batch = _batch_or_404(session, batch_id)
+    pending = _batch_pending_response(batch)
+    if pending is not None:
+        return pending
+
+    limit = max(1, min(limit, 500))
+    items = batch_results_page(session, batch_id, after, limit)
+    return {
+        "batch_id": batch_id,
+        "total": batch.total,
+        "items": items,
+        "next_after": items[-1]["profile_id"] if len(items) == limit else None
     }
 
+@app.get("/api/match_batches/{batch_id}/results.ndjson", tags=["Matching"])
+def stream_match_batch_results(
+    batch_id: int,
+    session: Session = Depends(get_session)
+):
+    """
+    一括マッチングの全結果を、1行に1プロフィールの NDJSON でストリーミングする。
+    """
+    batch = _batch_or_404(session, batch_id)
+    pending = _batch_pending_response(batch)
+    if pending is not None:
+        return pending
+
+    def generate():
+        # レスポンス送信中はリクエストのセッションが閉じられるため、自前のセッションで読み出す
+        with Session(get_engine()) as stream_session:
+            after = 0
+            while True:
+                items = batch_results_page(stream_session, batch_id, after, 200)
+                if not items:
+                    return
+                for item in items:
+                    yield json.dumps(item, ensure_ascii=False) + "\n"
+                after = items[-1]["profile_id"]
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
+# ----------------------------------------------------
+# 運用監視用
+# ----------------------------------------------------
+@app.get("/api/ops/gemini_cache", tags=["Ops"])
+def get_gemini_cache_stats():
+    """
+    Gemini応答キャッシュのヒット・ミス件数などを返す。
+    """
+    return response_cache.snapshot()
+
+@app.get("/api/ops/gemini_resilience", tags=["Ops"])
+def get_gemini_resilience():
+    """
+    Gemini呼び出しのサーキットブレーカーの状態 (closed / half_open / open) と、自動調整中の同時実行数の上限を返す。
+    """
+    return resilience_snapshot()
+
+def _require_cron_secret(authorization: Optional[str]):
+    if not CRON_SECRET or not hmac.compare_digest((authorization or "").encode(), f"Bearer {CRON_SECRET}".encode()):
+        raise HTTPException(status_code=401, detail="認証に失敗しました。")
+
+# /api/cron/{job} より先に登録する
+@app.get("/api/cron/match-jobs", tags=["Ops"])
+async def run_match_jobs_cron(authorization: Optional[str] = Header(None)):
+    """
+    実行待ちのマッチングジョブを、MATCH_CRON_BUDGET_SECONDS 秒の範囲で処理する。
+    サーバーレス環境では常駐のワーカーが無いため、Vercel Cron などから毎分 Authorization: Bearer <CRON_SECRET> を付けて呼び出す。
+    """
+    _require_cron_secret(authorization)
+    report = await MatchWorkerPool().drain(MATCH_CRON_BUDGET_SECONDS)
+    return {"job": "match-jobs", "report": asdict(report)}
+
+@app.get("/api/cron/{job}", tags=["Ops"])
+def run_cron_job(job: str, authorization: Optional[str] = Header(None)):
+    """
+    定期ジョブ (retention / segments / segments-full / vector-index) を1回実行する。
+    サーバーレス環境で常駐のスケジューラーの代わりに、Vercel Cron などから Authorization: Bearer <CRON_SECRET> を付けて呼び出す。
+    """
+    _require_cron_secret(authorization)
+    if job not in SCHEDULED_JOBS:
+        raise HTTPException(status_code=404, detail=f"不明なジョブです: {job}")
+    report = run_scheduled_job(job)
+    if report is None:
+        raise HTTPException(status_code=500, detail=f"ジョブの実行に失敗しました: {job}")
+    return {"job": job, "report": asdict(report)}
+
+@app.get("/metrics", include_in_schema=False)
+def get_metrics(session: Session = Depends(get_session)):
+    """
+    Prometheus 形式のメトリクス（段階別の所要時間・Gemini呼び出しの結果・キャッシュ・キューの長さ・接続プール）
+    """
+    refresh_queue_depth(session)
+    return Response(content=render_metrics(), media_type=METRICS_CONTENT_TYPE)
+
+@app.get("/api/ops/http_cache", tags=["Ops"])
+def get_http_cache_stats():
+    """
+    レスポンスキャッシュ (/api/scholarships, /api/match_results) のヒット件数などを返す。
+    """
+    return http_cache.snapshot()
+
 # ----------------------------------------------------
 # マッチング結果取得用
 # ----------------------------------------------------
 @app.get("/api/match_results", response_model=List[MatchResult], tags=["Matching"])
 def get_match_results(
+    request: Request,
     profile_id: int,
     session: Session = Depends(get_session)
 ):
     """
     指定されたプロファイルIDに紐づくマッチング結果（TOP5）を取得する。
+    保存済みの結果はシリアライズ済みのJSONをキャッシュし（結果の保存・削除の通知で破棄）、ETag による 304 応答に対応する。
+    通知が他のプロセスに届かない構成 (MATCH_NOTIFY_MODE=inprocess) ではキャッシュせず、毎回DBから読む。
     """
-    results = session.exec(
-        select(MatchResult)
-        .where(MatchResult.profile_id == profile_id)
-        .order_by(MatchResult.rank)
-    ).all()
-    
-    if not results:
-        raise HTTPException(status_code=404, detail="マッチング結果が見つからないか、処理中です。")
-        
-    return results
\ No newline at end of file
+    def build():
+        results = session.exec(
+            select(MatchResult)
+            .where(MatchResult.profile_id == profile_id)
+            .order_by(MatchResult.rank)
+        ).all()
+        return [result.model_dump(mode="json") for result in results] or None
+
+    def headers(results):
+        # 暫定結果はまもなく置き換わるため保存させない。確定した結果も再実行で増えるため、毎回 ETag で確認させる
+        if any(result["provisional"] for result in results):
+            return {"Cache-Control": "no-store"}
+        return {"Cache-Control": "private, no-cache"}
+
+    cached = match_results_body(profile_id, build, headers)
+    if cached is not None:
+        return cached_json_response(request, cached)
+
+    # 結果が無い場合は、ジョブの状態で「処理中」と「見つからない」を区別する
+    job = latest_job_for_profile(session, profile_id)
+    if job and job.status in ("queued", "running"):
+        return JSONResponse(
+            status_code=202,
+            content={"status": job.status, "detail": "マッチング処理中です。数秒後に再度確認してください。"}
+        )
+    if job and job.status == "failed":
+        raise HTTPException(status_code=500, detail="マッチング処理に失敗しました。再度リクエストしてください。")
+    raise HTTPException(status_code=404, detail="マッチング結果が見つかりません。")
+
+# ----------------------------------------------------
+# マッチング結果のプッシュ配信 (Server-Sent Events)
+# ----------------------------------------------------
+def _match_state(session: Session, profile_id: int):
+    job = latest_job_for_profile(session, profile_id)
+    if job is not None and job.status == "failed":
+        return "failed", []
+    query = select(MatchResult).where(MatchResult.profile_id == profile_id)
+    if job is not None and job.results_after_id is not None:
+        # 完了後も以前の実行の結果を混ぜず、最新のジョブの登録以降に保存された結果だけを返す
+        query = query.where(MatchResult.id > job.results_after_id)
+    results = session.exec(query.order_by(MatchResult.rank)).all()
+    if job is not None and job.status in ("queued", "running"):
+        # 再実行中は以前の実行で保存された結果を返さず、この実行の暫定結果だけを返す
+        return job.status, [result.model_dump(mode="json") for result in results if result.provisional]
+    if results:
+        return "done", [result.model_dump(mode="json") for result in results]
+    return (job.status if job else None), []
+
+async def _load_match_state(profile_id: int):
+    """
+    (最新のジョブの状態, 結果のリスト) を返す。ジョブが完了していて結果があれば状態は done、プロフィールもジョブも無ければ None
+    ジョブが queued / running の間は暫定結果のみ、failed の場合は結果を返さない
+    結果は最新のジョブの登録以降に保存されたものに限る（以前の実行の結果・保存済みの結果は含めない）
+    """
+    async with AsyncSession(get_async_engine()) as session:
+        return await session.run_sync(_match_state, profile_id)
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.get("/api/match_results/stream", tags=["Matching"])
+async def stream_match_results(profile_id: int):
+    """
+    マッチング結果を Server-Sent Events で受け取る（ポーリング不要）。
+    結果が保存され次第 results イベントを1回送って終了する。
+    先行回答モードでは、先にルールベースの暫定結果を provisional イベントで送る。
+    失敗した場合は failed、待ち時間の上限を超えた場合は timeout イベントを送る。
+    """
+    status, _ = await _load_match_state(profile_id)
+    if status is None:
+        raise HTTPException(status_code=404, detail="マッチングジョブが見つかりません。")
+
+    async def events():
+        loop = asyncio.get_running_loop()
+        sent_provisional = False
+        with broker.subscribe(profile_id) as queue:
+            # 購読してからDBを確認し、購読前に完了していた結果を取りこぼさないようにする
+            status, results = await _load_match_state(profile_id)
+            deadline = loop.time() + MATCH_SSE_MAX_WAIT_SECONDS
+            while status != "failed" and (not results or all(r["provisional"] for r in results)):
+                # 先行回答モードの暫定結果は先に送り、最終結果を待ち続ける
+                if results and not sent_provisional:
+                    yield _sse("provisional", results)
+                    sent_provisional = True
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    yield _sse("timeout", {"profile_id": profile_id, "status": status})
+                    return
+                try:
+                    await asyncio.wait_for(queue.get(), timeout=min(MATCH_SSE_HEARTBEAT_SECONDS, remaining))
+                except asyncio.TimeoutError:
+                    # 接続維持のコメントを送り、通知の取りこぼし（LISTEN の再接続中など）に備えてDBも確認する
+                    yield ": keep-alive\n\n"
+                status, results = await _load_match_state(profile_id)
+
+            if results:
+                yield _sse("results", results)
+            else:
+                yield _sse("failed", {"profile_id": profile_id, "detail": "マッチング処理に失敗しました。再度リクエストしてください。"})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
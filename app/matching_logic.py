@@ -1,7 +1,14 @@
-from typing import List, Tuple
-from datetime import datetime, timedelta
+import os
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Union
 from sqlmodel import Session, select, func
 from .models import Profile, Scholarship, MatchResult # .modelsはappフォルダ内のmodels.pyを指します
+from .catalog import CompiledScholarship, ScholarshipCatalog, get_catalog
+from .income import IncomeRange, parse_income_requirement, ranges_overlap, stored_income_range
+from .scoring_context import ScoringContext, to_utc, to_db_utc
+
+# フェイルセーフのルールベース採点の実行場所
+# "python": プロセス内のコンパイル済みカタログで採点する / "sql": DBで採点し、上位5件のみを受け取る (sql_scoring)
+RULE_SCORING_BACKEND = os.getenv("RULE_SCORING_BACKEND", "python")
 
 # 適合条件に応じた重み付け（W）を定義
 WEIGHTS = {
@@ -13,24 +20,50 @@ WEIGHTS = {
 }
 
 def get_income_score(profile_income: str, sch_income_req: str) -> float:
-    """年収条件が profile に適合するかを判断する簡易ロジック"""
-    # 実際には正規表現や複雑な比較が必要だが、ここでは簡略化
-    
+    """年収条件が profile に適合するかを判断する（年収範囲の区間比較）"""
+    band = parse_income_requirement(profile_income)
+    requirement = parse_income_requirement(sch_income_req)
+    return 1.0 if income_range_matches(profile_income, band, sch_income_req, requirement) else 0.0
+
+
+def income_range_matches(
+    profile_income: str,
+    band: Optional[IncomeRange],
+    sch_income_req: str,
+    requirement: Optional[IncomeRange],
+) -> bool:
+    """
+    get_income_score と同じ判定を、解析済みの年収範囲で行う
+    band / requirement は年収バンド・年収条件の解析結果（解析できない場合は None）。
+    カタログの年収条件は読み込み時に解析済みのため、採点のたびに文字列を解析し直さない
+    """
     # 奨学金が「条件なし」なら常に適合
     if sch_income_req == "条件なし":
-        return 1.0
-    
-    # ここでは Profile の年収バンドが奨学金要件と一致する場合のみ適合（超簡易版）
-    # 例: Profileが'~300万'で、Scholarshipが'世帯年収300万円未満'なら適合
-    if profile_income in sch_income_req:
-        return 1.0
-        
-    return 0.0
+        return True
+
+    # 年収バンドと年収条件の範囲が重なれば適合
+    # 例: Profileが'300~500万'で、Scholarshipが'世帯年収400万円未満'なら適合
+    if band is not None and requirement is not None:
+        return ranges_overlap(band, requirement)
 
+    # 解析できない表記の場合のみ、従来の部分一致で判定する
+    return profile_income in sch_income_req
 
-def calculate_score(profile: Profile, scholarship: Scholarship) -> float:
+
+def _income_range_of(scholarship: Union[Scholarship, CompiledScholarship]) -> Optional[IncomeRange]:
+    if isinstance(scholarship, CompiledScholarship):
+        return scholarship.income_range
+    return stored_income_range(scholarship.income_min, scholarship.income_max, scholarship.income_requirement)
+
+
+def calculate_score(
+    profile: Profile,
+    scholarship: Union[Scholarship, CompiledScholarship],
+    context: Optional[ScoringContext] = None,
+) -> float:
     """
-    ProfileとScholarshipを比較し、適合度スコア（0.0〜1.0）を算出する
+    ProfileとScholarship（またはコンパイル済みカタログの1件）を比較し、適合度スコア（0.0〜1.0）を算出する
+    締切の判定は context の日付 (UTC) で行う。複数件を採点する場合は同じ context を渡すこと
     """
     score = 0.0
 
@@ -45,7 +78,14 @@ def calculate_score(profile: Profile, scholarship: Scholarship) -> float:
         return 0.0
     
     # 1-3. 年収条件チェック
-    if get_income_score(profile.income_band, scholarship.income_requirement) == 0.0:
+    if getattr(scholarship, "income_unrestricted", False):
+        pass # 「条件なし」はカタログ読み込み時に判定済み
+    elif not income_range_matches(
+        profile.income_band,
+        parse_income_requirement(profile.income_band),
+        scholarship.income_requirement,
+        _income_range_of(scholarship),
+    ):
         return 0.0
 
     # 必須条件クリアで基本スコアを加算 
@@ -54,7 +94,7 @@ def calculate_score(profile: Profile, scholarship: Scholarship) -> float:
     # 2. ボーナス条件加算
     
     # 2-1. 社会的養護経験者向けボーナス
-    if profile.has_social_care and "経験者" in scholarship.other_requirements:
+    if profile.has_social_care and "経験者" in (scholarship.other_requirements or ""):
         score += WEIGHTS["SOCIAL_CARE"]
     
     # 2-2. 専攻分野一致ボーナス
@@ -62,7 +102,10 @@ def calculate_score(profile: Profile, scholarship: Scholarship) -> float:
         score += WEIGHTS["MAJOR_MATCH"]
         
     # 2-3. 締切が近いボーナス (30日以内)
-    days_to_deadline = (scholarship.deadline.date() - datetime.utcnow().date()).days
+    if context is None:
+        context = ScoringContext.now()
+    deadline_date = getattr(scholarship, "deadline_date", None) or to_utc(scholarship.deadline).date()
+    days_to_deadline = context.days_until(deadline_date)
     if 0 < days_to_deadline <= 30:
         score += WEIGHTS["DEADLINE_BONUS"]
         
@@ -73,59 +116,93 @@ def calculate_score(profile: Profile, scholarship: Scholarship) -> float:
     # スコアを0.0から1.0の範囲に正規化（ここでは単純に合計で返す）
     return min(score, 1.0)
 
-def generate_rule_based_results(session: Session, profile_id: int) -> List[MatchResult]:
+def rank_scholarships(
+    catalog: ScholarshipCatalog,
+    profile: Profile,
+    k: int = 5,
+    context: Optional[ScoringContext] = None,
+) -> List[Tuple[CompiledScholarship, float]]:
     """
-    DB内のデータとルールベーススコアリングでTOP5を生成する（フェイルセーフ用）
+    ルールベーススコアリングで上位k件の (奨学金, スコア) を返す（DBには問い合わせない）
     """
-    profile = session.get(Profile, profile_id)
-    if not profile:
-        return []
+    # batch_scoring / eligibility_index は本モジュールを参照するため、ここで遅延インポートする
+    from .batch_scoring import get_batch_scorer
+    from .eligibility_index import get_eligibility_index
+    scorer = get_batch_scorer(catalog)
 
-    # 公開されている全奨学金を取得
-    scholarships = session.exec(
-        select(Scholarship).where(Scholarship.is_published == True)
-    ).all()
-
-    scored_results = []
-    for sch in scholarships:
-        score = calculate_score(profile, sch)
-        if score > 0: # 必須条件をクリアしたものだけを対象
-            scored_results.append({
-                "scholarship": sch,
-                "score": score,
-                "deadline_sort_key": (sch.deadline - datetime.utcnow()).total_seconds()
-            })
-
-    # スコア降順、締切昇順でソート (scoreが高い順、スコアが同じなら締切が近い順)
-    # deadline_sort_keyのマイナスは、降順ソートで「値が小さい＝締切が近い」を優先するため
-    scored_results.sort(
-        key=lambda x: (x["score"], -x["deadline_sort_key"]), 
-        reverse=True
-    )
-    
-    top_5 = scored_results[:5]
-    
-    # MatchResultオブジェクトへの変換とテンプレート生成
-    match_results = []
-    for rank, result in enumerate(top_5, 1):
-        sch = result["scholarship"]
-        
+    # 転置インデックスで必須条件を満たす候補のみに絞り込む
+    candidates = get_eligibility_index(catalog).candidates(profile)
+
+    # 候補を一括採点し、スコア降順・締切昇順でTOPkを選ぶ (calculate_score と同じルール)
+    scores = scorer.score(profile, context, indices=candidates)
+    score_by_row = dict(zip(candidates, scores.tolist()))
+    return [
+        (catalog.scholarships[idx], score_by_row[idx])
+        for idx in scorer.top_k(scores, k, indices=candidates).tolist()
+    ]
+
+def rule_based_match_rows(
+    profile: Profile,
+    ranked: Sequence[Tuple[CompiledScholarship, float]]
+) -> List[Dict[str, Any]]:
+    """
+    ルールベースで選んだ (奨学金, スコア) のリストを、テンプレート文付きの MatchResult の列の値に変換する
+    (大量に保存する場合は、モデルのオブジェクトを作らずにこの値をそのまま INSERT する)
+    """
+    rows = []
+    for rank, (sch, score) in enumerate(ranked, 1):
         # テンプレート生成
-        why_match = f"（ルールベース）あなたの{profile.grade}と{profile.prefecture}に合致し、スコアは{result['score']:.2f}です。まずは必要書類の準備を進めましょう。"
-        todo = sch.required_docs + ["学校の奨学金窓口に相談する"]
-        
-        match_results.append(MatchResult(
+        why_match = f"（ルールベース）あなたの{profile.grade}と{profile.prefecture}に合致し、スコアは{score:.2f}です。まずは必要書類の準備を進めましょう。"
+        todo = list(sch.required_docs) + ["学校の奨学金窓口に相談する"]
+
+        rows.append(dict(
             rank=rank,
-            score=result["score"],
+            score=score,
             why_match=why_match,
             difficulty=sch.difficulty_hint,
-            deadline=sch.deadline,
+            deadline=to_db_utc(sch.deadline),
             amount_per_year=sch.amount_per_year,
             url=sch.url,
             todo=todo,
             digest="AI失敗時の代替結果です。期限の近いものから検討してください。",
+            raw_json=None,
+            saved=False,
+            provisional=False,
             profile_id=profile.id,
             scholarship_id=sch.id
         ))
 
-    return match_results
\ No newline at end of file
+    return rows
+
+def rule_based_match_results(
+    profile: Profile,
+    ranked: Sequence[Tuple[CompiledScholarship, float]]
+) -> List[MatchResult]:
+    """ルールベースで選んだ (奨学金, スコア) のリストを、テンプレート文付きの MatchResult に変換する"""
+    return [MatchResult(**row) for row in rule_based_match_rows(profile, ranked)]
+
+def generate_rule_based_results(
+    session: Session,
+    profile_id: int,
+    context: Optional[ScoringContext] = None,
+) -> List[MatchResult]:
+    """
+    DB内のデータとルールベーススコアリングでTOP5を生成する（フェイルセーフ用）
+    """
+    profile = session.get(Profile, profile_id)
+    if not profile:
+        return []
+
+    if RULE_SCORING_BACKEND == "sql":
+        # カタログを読み込まず、必須条件の絞り込み・採点・並べ替えを1回のクエリで行う
+        from .sql_scoring import rank_scholarships_sql # sql_scoring は本モジュールを参照するため遅延インポート
+        return rule_based_match_results(profile, rank_scholarships_sql(session, profile, 5, context))
+
+    # 公開されている全奨学金から選ぶ（プロセス内のコンパイル済みカタログを使用）
+    # よく現れる区分は事前計算済みの順位を1回の検索で取得し、無い場合のみその場で採点する
+    from .segments import ranked_scholarships_for # segments は本モジュールを間接的に参照するため遅延インポート
+    catalog = get_catalog(session)
+    ranked = ranked_scholarships_for(session, catalog, profile, 5, context)
+    if ranked is None:
+        ranked = rank_scholarships(catalog, profile, 5, context)
+    return rule_based_match_results(profile, ranked)
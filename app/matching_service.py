@@ -0,0 +1,203 @@
+import os
+import asyncio
+from typing import List, Sequence
+from sqlmodel import Session
+
+from .models import Profile, MatchResult
+from .catalog import ScholarshipCatalog, get_catalog
+from .prompt_builder import select_prompt_candidates, GEMINI_PROMPT_MAX_CANDIDATES
+from .segments import lookup_segment_ranking
+from .scoring_context import ScoringContext
+from .matching_logic import generate_rule_based_results # フェイルセーフ用
+from .gemini_client import GEMINI_TIMEOUT_SECONDS # Geminiクライアント
+from .resilience import CircuitOpenError
+from .gemini_cache import cached_generate_match_results # Gemini応答キャッシュ
+from .results_writer import (
+    get_name_resolver, match_results_from_gemini, write_match_results,
+    replace_provisional_results, finalize_provisional_results,
+)
+from .metrics import MatchTimings, match_timings, observe_stage, MATCH_FALLBACKS
+
+# "1" の場合、ルールベースの結果を暫定結果として先に保存し、Geminiの結果が届いたら置き換える
+MATCH_SPECULATIVE_RESULTS = os.getenv("MATCH_SPECULATIVE_RESULTS", "0") == "1"
+
+
+async def _gemini_match_results(
+    profile: Profile,
+    catalog: ScholarshipCatalog,
+    positions: Sequence[int],
+) -> List[MatchResult]:
+    """Geminiでマッチングし、保存用の MatchResult を返す。失敗した場合は例外を送出する"""
+    if not positions:
+        raise ValueError("必須条件を満たす奨学金がありません")
+
+    print(f"[{profile.id}] メイン戦略 (Gemini) を試行...")
+    # 同じ内容のプロフィールはキャッシュから即座に返す
+    gemini_response = await asyncio.wait_for(
+        cached_generate_match_results(profile, catalog, positions),
+        timeout=GEMINI_TIMEOUT_SECONDS # 既定10秒でタイムアウト（通信ごとキャンセルされる）
+    )
+
+    # 応答の奨学金IDをカタログと照合する（IDが無い場合は名称で照合し、表記ゆれは正規化して吸収）
+    match_results, unresolved = match_results_from_gemini(
+        profile.id, gemini_response, get_name_resolver(catalog)
+    )
+    if unresolved:
+        print(f"[{profile.id}] 警告: カタログに存在しない奨学金名を除外しました: {unresolved}")
+    if not match_results:
+        raise ValueError("Geminiの結果をカタログの奨学金に対応付けられませんでした")
+    return match_results
+
+# ----------------------------------------------------
+# DBを使う処理（イベントループを止めないよう asyncio.to_thread で別スレッドから呼び出す）
+# ----------------------------------------------------
+def _load_profile(session: Session, profile_id: int):
+    profile = session.get(Profile, profile_id)
+    if profile is not None:
+        # 別スレッドでコミットしても、ループ側で参照するプロフィールが再読み込みされないよう切り離す
+        session.expunge(profile)
+    return profile
+
+
+def _rank_candidates(session: Session, profile: Profile, context: ScoringContext):
+    """カタログを読み込み、プロンプトに含める奨学金の位置を選ぶ"""
+    # プロセス内のコンパイル済みカタログから、必須条件（学年・地域・年収）を満たす奨学金を
+    # ルールベースのスコア順に、プロンプトのトークン予算に収まる件数だけ選ぶ
+    with observe_stage("catalog_load"):
+        catalog = get_catalog(session)
+    with observe_stage("rule_scoring"):
+        # よく現れる区分は事前計算済みの順位を使う（無い場合は None で、その場で採点する）
+        segment = lookup_segment_ranking(session, catalog, profile, GEMINI_PROMPT_MAX_CANDIDATES, context)
+        ranked = [position for position, _ in segment] if segment is not None else None
+        positions = select_prompt_candidates(catalog, profile, ranked=ranked, context=context)
+    return catalog, positions
+
+
+def _save_results(session: Session, match_results: List[MatchResult]):
+    with observe_stage("db_write"):
+        write_match_results(session, match_results)
+        session.commit()
+
+
+def _save_fallback_results(session: Session, profile_id: int, context: ScoringContext):
+    session.rollback() # 途中まで書き込んだ結果があれば破棄する
+    with observe_stage("rule_scoring"):
+        rule_based_results = generate_rule_based_results(session, profile_id, context)
+    _save_results(session, rule_based_results)
+
+
+def _save_provisional_results(session: Session, profile_id: int, context: ScoringContext):
+    with observe_stage("rule_scoring"):
+        provisional = generate_rule_based_results(session, profile_id, context)
+    for result in provisional:
+        result.provisional = True
+    with observe_stage("db_write"):
+        replace_provisional_results(session, profile_id, provisional)
+        session.commit()
+
+
+def _replace_provisional(session: Session, profile_id: int, match_results: List[MatchResult]):
+    with observe_stage("db_write"):
+        replace_provisional_results(session, profile_id, match_results)
+        session.commit()
+
+
+def _finalize_provisional(session: Session, profile_id: int):
+    session.rollback()
+    with observe_stage("db_write"):
+        finalize_provisional_results(session, profile_id)
+        session.commit()
+
+# ----------------------------------------------------
+# マッチング処理 (ハイブリッド戦略)
+# ----------------------------------------------------
+async def run_matching_strategy(profile_id: int, session: Session):
+    """
+    ハイブリッド・マッチングを実行する関数（ジョブキューのワーカーから呼び出される）
+    session は呼び出し側（ワーカー）が自前で開いたものを渡す
+    DBの読み書きは別スレッドで行い、イベントループ上ではGeminiの応答だけを待つ
+    """
+    print(f"[{profile_id}] マッチング処理を開始...")
+    profile = await asyncio.to_thread(_load_profile, session, profile_id)
+    if not profile:
+        print(f"[{profile_id}] エラー: プロファイルが見つかりません。")
+        return
+
+    path = "speculative" if MATCH_SPECULATIVE_RESULTS else "single"
+    # 採点の基準日はジョブ全体で1つに固定する（同じ日のうちは同じ順位になる）
+    context = ScoringContext.now()
+    # 段階ごとの所要時間を計測し、終了時に profile_id ごとの内訳を1行のJSONで出力する
+    with match_timings(path, profile_id=profile_id) as timings:
+        catalog, positions = await asyncio.to_thread(_rank_candidates, session, profile, context)
+
+        if MATCH_SPECULATIVE_RESULTS:
+            await _run_speculative(profile, catalog, positions, session, timings, context)
+            return
+
+        try:
+            # 1. Gemini API (メイン戦略) を呼び出す (タイムアウト設定)
+            match_results = await _gemini_match_results(profile, catalog, positions)
+        except Exception as e:
+            # 2. フェイルセーフ戦略 (ルールベース) を実行
+            print(f"[{profile_id}] Gemini 失敗 ({e})。フェイルセーフ (ルールベース) を実行します。")
+            MATCH_FALLBACKS.labels(path).inc()
+            # サーキットブレーカーが開いている間はGeminiを待たずにここへ来る
+            timings.fields["outcome"] = "circuit_open" if isinstance(e, CircuitOpenError) else "fallback"
+            await asyncio.to_thread(_save_fallback_results, session, profile_id, context)
+        else:
+            print(f"[{profile_id}] Gemini 成功。結果をDBに保存します。")
+            try:
+                # 3. MatchResult を1回の INSERT でまとめて保存してコミット
+                await asyncio.to_thread(_save_results, session, match_results)
+                timings.fields["outcome"] = "gemini"
+            except Exception as e:
+                # 保存に失敗した場合もルールベースの結果を残す
+                print(f"[{profile_id}] 結果の保存に失敗 ({e})。フェイルセーフ (ルールベース) を実行します。")
+                MATCH_FALLBACKS.labels(path).inc()
+                timings.fields["outcome"] = "fallback"
+                await asyncio.to_thread(_save_fallback_results, session, profile_id, context)
+        print(f"[{profile_id}] マッチング処理完了。")
+
+# ----------------------------------------------------
+# マッチング処理 (先行回答モード: MATCH_SPECULATIVE_RESULTS=1)
+# ----------------------------------------------------
+async def _run_speculative(
+    profile: Profile,
+    catalog: ScholarshipCatalog,
+    positions: Sequence[int],
+    session: Session,
+    timings: MatchTimings,
+    context: ScoringContext,
+):
+    """
+    Geminiの呼び出しを開始したまま、ルールベースの結果を暫定結果 (provisional) として即座に保存する。
+    Geminiが成功したら暫定結果を1トランザクションで置き換え、失敗したら暫定結果をそのまま確定する。
+    """
+    profile_id = profile.id
+    gemini_task = asyncio.ensure_future(_gemini_match_results(profile, catalog, positions))
+
+    try:
+        # 1. ルールベースの暫定結果を保存（Gemini の応答を待たずにユーザーへ届く）
+        await asyncio.to_thread(_save_provisional_results, session, profile_id, context)
+        timings.fields["provisional_ms"] = round(timings.elapsed() * 1000, 1)
+        print(f"[{profile_id}] 暫定結果 (ルールベース) を保存しました ({timings.fields['provisional_ms']} ms)")
+    except BaseException:
+        gemini_task.cancel()
+        raise
+
+    try:
+        # 2. Gemini の結果が届いたら暫定結果と置き換える
+        match_results = await gemini_task
+        print(f"[{profile_id}] Gemini 成功。暫定結果を置き換えます。")
+        await asyncio.to_thread(_replace_provisional, session, profile_id, match_results)
+        timings.fields["outcome"] = "gemini"
+
+    except Exception as e:
+        # 3. Gemini が失敗した場合は、暫定結果をそのまま最終結果にする
+        print(f"[{profile_id}] Gemini 失敗 ({e})。暫定結果 (ルールベース) を確定します。")
+        MATCH_FALLBACKS.labels("speculative").inc()
+        timings.fields["outcome"] = "circuit_open" if isinstance(e, CircuitOpenError) else "fallback"
+        await asyncio.to_thread(_finalize_provisional, session, profile_id)
+
+    finally:
+        print(f"[{profile_id}] マッチング処理完了。")
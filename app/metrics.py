@@ -0,0 +1,196 @@
+import os
+import json
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Iterator, Optional
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest,
+)
+from sqlalchemy import event
+from sqlmodel import Session
+
+from .database import on_engine_created, pool_capacity
+
+# gunicorn などで複数プロセスを起動する場合は PROMETHEUS_MULTIPROC_DIR を設定する
+# (prometheus_client がプロセスごとの値をこのディレクトリに書き出し、/metrics で合算する)
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+# "1" の場合、プロフィールごとの処理時間を1行のJSONで出力する
+MATCH_TIMING_LOG = os.getenv("MATCH_TIMING_LOG", "1") == "1"
+
+# マッチング処理の段階（ラベル値）
+STAGES = ("catalog_load", "rule_scoring", "prompt_build", "gemini_call", "response_parse", "db_write")
+
+# ====================================================================
+# メトリクスの定義
+# ====================================================================
+STAGE_SECONDS = Histogram(
+    "hope_match_stage_seconds",
+    "マッチング処理の段階ごとの所要時間（秒）",
+    ["stage"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20),
+)
+MATCH_SECONDS = Histogram(
+    "hope_match_seconds",
+    "1件のマッチングジョブ全体の所要時間（秒）",
+    ["path"],
+    buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40),
+)
+GEMINI_CALLS = Counter(
+    "hope_gemini_calls_total",
+    "Gemini API の呼び出し回数（結果別: success / timeout / error / rejected）",
+    ["outcome"],
+)
+GEMINI_CIRCUIT_STATE = Gauge(
+    "hope_gemini_circuit_state",
+    "Gemini呼び出しのサーキットブレーカーの状態 (0: closed, 1: half_open, 2: open)",
+    multiprocess_mode="liveall",
+)
+GEMINI_CONCURRENCY_LIMIT = Gauge(
+    "hope_gemini_concurrency_limit",
+    "Gemini呼び出しの同時実行数の上限（応答状況に合わせて自動調整される）",
+    multiprocess_mode="liveall",
+)
+GEMINI_IN_FLIGHT = Gauge(
+    "hope_gemini_in_flight",
+    "実行中のGemini呼び出しの件数",
+    multiprocess_mode="livesum",
+)
+MATCH_FALLBACKS = Counter(
+    "hope_match_fallbacks_total",
+    "Geminiの代わりにルールベースの結果を保存した回数",
+    ["path"],
+)
+CACHE_EVENTS = Counter(
+    "hope_cache_events_total",
+    "キャッシュの参照結果（hits / misses など）",
+    ["cache", "event"],
+)
+QUEUE_DEPTH = Gauge(
+    "hope_match_queue_depth",
+    "実行待ち (queued) のマッチングジョブ件数（/metrics の取得時に更新）",
+    multiprocess_mode="mostrecent",
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "hope_db_pool_checked_out",
+    "接続プールから貸し出し中の接続数",
+    ["engine"],
+    multiprocess_mode="livesum",
+)
+DB_POOL_CAPACITY = Gauge(
+    "hope_db_pool_capacity",
+    "接続プールの最大接続数 (pool_size + max_overflow)",
+    ["engine"],
+    multiprocess_mode="livesum",
+)
+
+# 一度も発生していない系列も 0 として出力する
+for _stage in STAGES:
+    STAGE_SECONDS.labels(_stage)
+for _outcome in ("success", "timeout", "error", "rejected"):
+    GEMINI_CALLS.labels(_outcome)
+
+
+def _track_pool(target, name: str, capacity: int):
+    """プールの貸し出し・返却のたびに貸し出し中の接続数を更新する"""
+    DB_POOL_CAPACITY.labels(name).set(capacity)
+    gauge = DB_POOL_CHECKED_OUT.labels(name)
+    event.listen(target, "checkout", lambda *args: gauge.inc())
+    event.listen(target, "checkin", lambda *args: gauge.dec())
+
+
+# エンジンは最初に使うときに生成されるため、生成時にプールの監視を登録する
+on_engine_created(lambda name, target: _track_pool(target, name, pool_capacity(name)))
+
+
+# ====================================================================
+# 段階ごとの計測（プロフィール単位の計測中であれば、その内訳にも加算する）
+# ====================================================================
+class MatchTimings:
+    """1件のマッチング処理の段階ごとの所要時間（ミリ秒）"""
+
+    def __init__(self, profile_id: Optional[int] = None, batch_id: Optional[int] = None):
+        self.profile_id = profile_id
+        self.batch_id = batch_id
+        self.started = time.perf_counter()
+        self.stages_ms: Dict[str, float] = {}
+        self.fields: Dict[str, object] = {}
+
+    def add(self, stage: str, seconds: float):
+        self.stages_ms[stage] = self.stages_ms.get(stage, 0.0) + seconds * 1000
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def log_line(self) -> str:
+        record = {"event": "match_timing"}
+        if self.profile_id is not None:
+            record["profile_id"] = self.profile_id
+        if self.batch_id is not None:
+            record["batch_id"] = self.batch_id
+        record.update(self.fields)
+        record["total_ms"] = round(self.elapsed() * 1000, 1)
+        record["stages_ms"] = {stage: round(ms, 1) for stage, ms in self.stages_ms.items()}
+        return json.dumps(record, ensure_ascii=False)
+
+
+# asyncio のタスクはコンテキストを引き継ぐため、Gemini呼び出しの内側からも現在の計測に加算できる
+_current: ContextVar[Optional[MatchTimings]] = ContextVar("match_timings", default=None)
+
+
+@contextmanager
+def observe_stage(stage: str) -> Iterator[None]:
+    """with ブロックの所要時間をヒストグラムに記録する（例外で抜けた場合も記録する）"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.labels(stage).observe(elapsed)
+        timings = _current.get()
+        if timings is not None:
+            timings.add(stage, elapsed)
+
+
+@contextmanager
+def match_timings(path: str, profile_id: Optional[int] = None, batch_id: Optional[int] = None) -> Iterator[MatchTimings]:
+    """
+    マッチング1件（またはバッチ1件）の計測を開始する
+    終了時に全体の所要時間をヒストグラムに記録し、段階ごとの内訳を1行のJSONで出力する
+    path はマッチングの経路 (single / speculative / batch)、結果は timings.fields に入れる
+    """
+    timings = MatchTimings(profile_id=profile_id, batch_id=batch_id)
+    timings.fields["path"] = path
+    token = _current.set(timings)
+    try:
+        yield timings
+    finally:
+        _current.reset(token)
+        MATCH_SECONDS.labels(path).observe(timings.elapsed())
+        if MATCH_TIMING_LOG:
+            print(timings.log_line())
+
+
+# ====================================================================
+# /metrics の出力
+# ====================================================================
+def refresh_queue_depth(session: Session):
+    """取得時点のキューの長さを反映する（DBに接続できない場合は前回の値のまま）"""
+    from .job_queue import queue_depth # job_queue から (matching_service 経由で) 読み込まれるため、循環importを避ける
+    try:
+        QUEUE_DEPTH.set(queue_depth(session))
+    except Exception as e:
+        print(f"--- メトリクス: キューの長さを取得できませんでした: {e!r} ---")
+
+
+def render_metrics() -> bytes:
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
+
+
+METRICS_CONTENT_TYPE = CONTENT_TYPE_LATEST
@@ -2,11 +2,11 @@
 # 【修正点】: SQLAlchemyからARRAY型などをインポート
 # -------------------------------------------------------------
 from sqlmodel import Field, SQLModel, Relationship
-from sqlalchemy import Column, String, ARRAY 
+from sqlalchemy import Column, String, Integer, Float, ARRAY, Index, UniqueConstraint, text
 # -------------------------------------------------------------
 
 from typing import List, Optional
-from datetime import datetime
+from datetime import date, datetime
 import json
 
 # ====================================================================
@@ -17,6 +17,7 @@ INCOME_BANDS = ["~300万", "300~500万", "500~700万", "700~1000万", "1000万~"
 CATEGORIES = ["政府", "自治体", "大学", "企業", "財団", "NPO"]
 TYPES = ["給付", "貸与", "免除", "助成"]
 DIFFICULTIES = ["Easy", "Medium", "Hard"]
+JOB_STATUSES = ["queued", "running", "done", "failed"]
 
 # ====================================================================
 # Profile (診断入力)
@@ -35,7 +36,8 @@ class ProfileBase(SQLModel):
 
 class Profile(ProfileBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
-    created_at: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True) # 保持期間の判定に使用
+    batch_id: Optional[int] = Field(default=None, foreign_key="matchbatch.id", index=True) # 一括登録された場合のバッチ
     match_results: List["MatchResult"] = Relationship(back_populates="profile")
 
 # ====================================================================
@@ -58,6 +60,10 @@ class ScholarshipBase(SQLModel):
     # -------------------------------------------------------------
 
     income_requirement: str
+    # income_requirement を解析した年収範囲（円、下限を含み上限を含まない）
+    # income_min が None の場合は未解析、income_max が None の場合は上限なし
+    income_min: Optional[int] = Field(default=None, index=True)
+    income_max: Optional[int] = Field(default=None, index=True)
     other_requirements: Optional[str] = None
     
     deadline: datetime = Field(index=True)
@@ -78,6 +84,14 @@ class ScholarshipBase(SQLModel):
     source: Optional[str] = None
 
 class Scholarship(ScholarshipBase, table=True):
+    __table_args__ = (
+        # 名称と提供団体の組を自然キーとし、取り込み時のアップサートに使用する
+        UniqueConstraint("name", "provider", name="uq_scholarship_name_provider"),
+        # SQLでの採点 (sql_scoring) の配列の包含 (@>) 検索用
+        Index("ix_scholarship_eligible_grades", "eligible_grades", postgresql_using="gin"),
+        Index("ix_scholarship_eligible_prefs", "eligible_prefs", postgresql_using="gin"),
+        Index("ix_scholarship_fields", "fields", postgresql_using="gin"),
+    )
     id: Optional[int] = Field(default=None, primary_key=True)
     match_results: List["MatchResult"] = Relationship(back_populates="scholarship")
 
@@ -91,17 +105,109 @@ class MatchResultBase(SQLModel):
     score: float
     why_match: str
     difficulty: str
-    deadline: datetime
+    deadline: datetime = Field(index=True) # 保持期間の判定に使用
     amount_per_year: int
     url: str
     todo: List[str] = Field(default=[], sa_column=Column(ARRAY(String)))
     digest: str
     raw_json: Optional[str] = None
     saved: bool = Field(default=False)
+    # 先行回答モードでルールベースの結果を先に保存した場合 True（Geminiの結果が届くと置き換わる）
+    provisional: bool = Field(default=False)
 
 class MatchResult(MatchResultBase, table=True):
     id: Optional[int] = Field(default=None, primary_key=True)
     profile_id: int = Field(foreign_key="profile.id", index=True)
     scholarship_id: int = Field(foreign_key="scholarship.id", index=True)
     profile: Profile = Relationship(back_populates="match_results")
-    scholarship: Scholarship = Relationship(back_populates="match_results")
\ No newline at end of file
+    scholarship: Scholarship = Relationship(back_populates="match_results")
+# ====================================================================
+# CatalogVersion (奨学金カタログのバージョン管理)
+# ====================================================================
+class CatalogVersion(SQLModel, table=True):
+    """奨学金マスタ更新時にインクリメントされる単一行のバージョン番号"""
+    id: Optional[int] = Field(default=1, primary_key=True)
+    version: int = Field(default=0)
+    updated_at: datetime = Field(default_factory=datetime.utcnow)
+
+# ====================================================================
+# GeminiResponseCache (Gemini応答の永続キャッシュ)
+# ====================================================================
+class GeminiResponseCache(SQLModel, table=True):
+    """プロフィールの指紋とカタログバージョンをキーに、Geminiの応答JSONを保存する"""
+    key: str = Field(primary_key=True) # response_cache_key() のハッシュ値
+    catalog_version: int = Field(index=True)
+    response_json: str
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True)
+
+# ====================================================================
+# MatchJob (マッチング処理のジョブキュー)
+# ====================================================================
+class MatchJob(SQLModel, table=True):
+    """
+    マッチング処理の要求1件。ワーカーが SELECT ... FOR UPDATE SKIP LOCKED で取り出して実行する
+    status は JOB_STATUSES のいずれか
+    """
+    __table_args__ = (
+        # 未完了 (queued / running) のジョブはプロフィールごとに1件まで。同時に登録されても重複しない
+        Index(
+            "uq_matchjob_profile_active", "profile_id", unique=True,
+            postgresql_where=text("status IN ('queued', 'running')"),
+        ),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    # プロフィール1件のジョブは profile_id、一括マッチングのジョブは batch_id のどちらかを持つ
+    profile_id: Optional[int] = Field(default=None, foreign_key="profile.id", index=True)
+    batch_id: Optional[int] = Field(default=None, foreign_key="matchbatch.id", index=True)
+    status: str = Field(default="queued", index=True)
+    attempts: int = Field(default=0)
+    last_error: Optional[str] = None
+    run_after: datetime = Field(default_factory=datetime.utcnow, index=True) # リトライ時はこの時刻まで待機
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    # 登録時点のプロフィールの MatchResult.id の最大値。これより大きいIDの結果がこのジョブ以降に保存された結果
+    results_after_id: Optional[int] = None
+
+# ====================================================================
+# MatchBatch (複数プロフィールの一括マッチング)
+# ====================================================================
+class MatchBatch(SQLModel, table=True):
+    """
+    学校などから一括で登録されたプロフィール群。まとめて採点し、同じ内容のプロフィールはGemini呼び出しを共有する
+    status は JOB_STATUSES のいずれか
+    """
+    id: Optional[int] = Field(default=None, primary_key=True)
+    status: str = Field(default="queued", index=True)
+    total: int = Field(default=0) # プロフィール件数
+    completed: int = Field(default=0) # 結果を保存したプロフィール件数
+    gemini_calls: int = Field(default=0) # Geminiに問い合わせたプロフィールの種類数（同一内容のプロフィールは1回。キャッシュ命中を含む）
+    created_at: datetime = Field(default_factory=datetime.utcnow, index=True) # 保持期間の判定に使用
+    finished_at: Optional[datetime] = None
+
+# ====================================================================
+# SegmentRanking (よく現れるプロフィール区分ごとの事前計算済みの順位)
+# ====================================================================
+class SegmentRanking(SQLModel, table=True):
+    """
+    (学年, 都道府県, 年収, 専攻, 社会的養護) の区分ごとに、ルールベースのスコア順に並べた奨学金
+    calculate_score はこの5項目と基準日だけで決まるため、同じ区分のプロフィールは同じ順位になる
+    """
+    # 区分の5項目の一意制約をそのまま検索用のインデックスとして使う
+    __table_args__ = (
+        UniqueConstraint("grade", "prefecture", "income_band", "major", "has_social_care", name="uq_segmentranking_segment"),
+    )
+    id: Optional[int] = Field(default=None, primary_key=True)
+    grade: str
+    prefecture: str
+    income_band: str
+    major: str
+    has_social_care: bool
+    scholarship_ids: List[int] = Field(default=[], sa_column=Column(ARRAY(Integer))) # スコア降順・締切昇順
+    scores: List[float] = Field(default=[], sa_column=Column(ARRAY(Float)))
+    eligible_count: int = Field(default=0) # 必須条件を満たす奨学金の件数（scholarship_ids が全件かの判定に使う）
+    catalog_version: int = Field(index=True)
+    as_of: date # 採点の基準日 (UTC)
+    valid_until: Optional[date] = Field(default=None, index=True) # 締切ボーナスの対象が入れ替わる日（この日から再計算が必要）
+    profile_count: int = Field(default=0) # 区分を選んだ時点の直近のプロフィール件数
+    refreshed_at: datetime = Field(default_factory=datetime.utcnow)
@@ -0,0 +1,167 @@
+import os
+import json
+import asyncio
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Set
+from sqlalchemy import event, text
+from sqlalchemy.orm import Session as OrmSession
+from sqlmodel import Session
+
+from .database import DATABASE_URL
+
+# "postgres": pg_notify で全プロセスに通知（外部ワーカー構成でも届く）
+# "inprocess": コミット後に同じプロセス内の購読者にだけ通知（LISTEN が使えない接続プール経由の構成用）
+MATCH_NOTIFY_MODE = os.getenv("MATCH_NOTIFY_MODE", "postgres")
+NOTIFY_CHANNEL = "match_results"
+# pg_notify のペイロードは 8000 バイトまでのため、プロフィールIDを分割して送る
+NOTIFY_MAX_IDS = 500
+LISTENER_RETRY_SECONDS = float(os.getenv("MATCH_NOTIFY_RETRY_SECONDS", "5"))
+# SSE の接続を保つ最大時間と、keep-alive を送る間隔（秒）
+MATCH_SSE_MAX_WAIT_SECONDS = float(os.getenv("MATCH_SSE_MAX_WAIT_SECONDS", "120"))
+MATCH_SSE_HEARTBEAT_SECONDS = float(os.getenv("MATCH_SSE_HEARTBEAT_SECONDS", "15"))
+
+_PENDING_KEY = "pending_match_notifications"
+
+
+# ====================================================================
+# プロセス内ブローカー（SSE の接続ごとに待ち受けキューを持つ）
+# ====================================================================
+class ResultBroker:
+    def __init__(self):
+        self._waiters: Dict[int, Set[asyncio.Queue]] = {}
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        # 購読の有無に関係なく、全ての通知を受け取る関数（キャッシュの無効化など。スレッドセーフであること）
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+
+    def add_listener(self, listener: Callable[[Dict[str, Any]], None]):
+        self._listeners.append(listener)
+
+    def _notify_listeners(self, events: Iterable[Dict[str, Any]]):
+        for item in events:
+            for listener in self._listeners:
+                listener(item)
+
+    @contextmanager
+    def subscribe(self, profile_id: int) -> Iterator[asyncio.Queue]:
+        """profile_id の結果の通知を待つキューを返す（with を抜けると購読を解除する）"""
+        self._loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue()
+        self._waiters.setdefault(profile_id, set()).add(queue)
+        try:
+            yield queue
+        finally:
+            waiters = self._waiters.get(profile_id)
+            if waiters is not None:
+                waiters.discard(queue)
+                if not waiters:
+                    del self._waiters[profile_id]
+
+    def publish(self, events: List[Dict[str, Any]]):
+        """イベントループのスレッドから呼び出す"""
+        self._notify_listeners(events)
+        self._wake_waiters(events)
+
+    def _wake_waiters(self, events: Iterable[Dict[str, Any]]):
+        for item in events:
+            for queue in self._waiters.get(item["profile_id"], ()):
+                queue.put_nowait(item)
+
+    def publish_threadsafe(self, events: List[Dict[str, Any]]):
+        """任意のスレッドから呼び出せる publish"""
+        self._notify_listeners(events)
+        loop = self._loop
+        if loop is None or loop.is_closed() or not self._waiters:
+            return # 待っている接続が無い
+        loop.call_soon_threadsafe(self._wake_waiters, events)
+
+    def subscriber_count(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+
+broker = ResultBroker()
+
+
+# ====================================================================
+# 通知の送信（結果の保存と同じトランザクションで行う）
+# ====================================================================
+def notify_results_ready(session: Session, profile_ids: Iterable[int], status: str = "done"):
+    """
+    profile_id の結果が確定したことを通知する。通知はトランザクションのコミット時に届き、
+    ロールバックされた場合は届かない（コミットは呼び出し側で行う）
+    """
+    ids = sorted(set(profile_ids))
+    if not ids:
+        return
+    if MATCH_NOTIFY_MODE == "postgres":
+        for start in range(0, len(ids), NOTIFY_MAX_IDS):
+            payload = json.dumps({"profile_ids": ids[start:start + NOTIFY_MAX_IDS], "status": status})
+            session.execute(
+                text("SELECT pg_notify(:channel, :payload)"),
+                {"channel": NOTIFY_CHANNEL, "payload": payload}
+            )
+    else:
+        session.info.setdefault(_PENDING_KEY, []).extend(
+            {"profile_id": profile_id, "status": status} for profile_id in ids
+        )
+
+
+@event.listens_for(OrmSession, "after_commit")
+def _publish_after_commit(session):
+    events = session.info.pop(_PENDING_KEY, None)
+    if events:
+        broker.publish_threadsafe(events)
+
+
+@event.listens_for(OrmSession, "after_rollback")
+def _discard_after_rollback(session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+# ====================================================================
+# Postgres の LISTEN を受けてブローカーに流す（APIサーバー内で動作）
+# ====================================================================
+def _parse_payload(payload: str) -> List[Dict[str, Any]]:
+    data = json.loads(payload)
+    return [{"profile_id": profile_id, "status": data.get("status", "done")} for profile_id in data["profile_ids"]]
+
+
+class ResultListener:
+    def __init__(self, result_broker: ResultBroker, dsn: str = DATABASE_URL):
+        self.broker = result_broker
+        self.dsn = dsn
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run(), name="match-result-listener")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        import psycopg # ドライバはDBを使うまで読み込まない（エンジンと同じく起動を速くするため）
+
+        # 接続が切れた場合は待ってから再接続する（その間の通知は失われるため、SSE側は定期的にDBも確認する）
+        while True:
+            try:
+                async with await psycopg.AsyncConnection.connect(self.dsn, autocommit=True) as conn:
+                    await conn.execute(f"LISTEN {NOTIFY_CHANNEL}")
+                    print(f"--- 結果通知の受信を開始しました (LISTEN {NOTIFY_CHANNEL}) ---")
+                    async for notify in conn.notifies():
+                        try:
+                            self.broker.publish(_parse_payload(notify.payload))
+                        except (ValueError, KeyError) as e:
+                            print(f"結果通知の形式が不正です: {e}")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"--- 結果通知の受信エラー: {e!r} ({LISTENER_RETRY_SECONDS:.0f} 秒後に再接続) ---")
+                await asyncio.sleep(LISTENER_RETRY_SECONDS)
+
+
+result_listener = ResultListener(broker)
@@ -0,0 +1,274 @@
+import os
+import re
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from .models import Profile
+from .catalog import CompiledScholarship, ScholarshipCatalog
+from .schemas import MatchResponseSchema, MatchResultSchema, GeminiMatchResponseSchema
+from .batch_scoring import get_batch_scorer
+from .eligibility_index import get_eligibility_index
+from .retrieval import retrieve_candidates, RETRIEVAL_ENABLED, RETRIEVAL_EMBEDDER, RETRIEVAL_SIMILARITY_WEIGHT
+from .scoring_context import ScoringContext
+
+# プロンプト全体の推定トークン数の上限と、プロンプトに含める奨学金の最大件数
+GEMINI_PROMPT_TOKEN_BUDGET = int(os.getenv("GEMINI_PROMPT_TOKEN_BUDGET", "8000"))
+GEMINI_PROMPT_MAX_CANDIDATES = int(os.getenv("GEMINI_PROMPT_MAX_CANDIDATES", "200"))
+# 予算が小さくても、TOP5を選べるだけの候補は必ず含める
+MIN_PROMPT_CANDIDATES = 5
+
+# プロンプトの形式を変えたら上げる（Gemini応答キャッシュのキーに含まれる）
+PROMPT_FORMAT_VERSION = 2
+# 候補の選び方が変わるとプロンプトも変わるため、埋め込みでの絞り込みを使う場合はキャッシュのキーを分ける
+PROMPT_CANDIDATE_MODE = f"retrieval:{RETRIEVAL_EMBEDDER}" if RETRIEVAL_ENABLED else ""
+
+# プロンプトに含めないプロフィールのフィールド（応答キャッシュのキーにも使用）
+PROFILE_PROMPT_EXCLUDE = {'id', 'created_at', 'batch_id', 'match_results'}
+
+# 表の列（判断に必要な項目のみ。URL・問い合わせ先・申請方法などは結果の保存時にカタログから補完する）
+TABLE_HEADER = "id|名称|提供団体|種別|給付/貸与|年額(円)|期間|対象学年|対象地域|分野|年収条件|その他条件|締切|難易度"
+
+# 繰り返し現れる値は辞書に置き換える（記号 -> 辞書の名前）
+DICTIONARIES = {
+    "P": "提供団体",
+    "G": "対象学年",
+    "R": "対象地域",
+    "F": "分野",
+    "I": "年収条件",
+    "O": "その他条件",
+}
+
+_SHORT_ID = re.compile(r"^\s*S(\d+)\s*$")
+
+
+def short_id(position: int) -> str:
+    """カタログ上の位置からプロンプト用の短いIDを作る（カタログのバージョン内でのみ有効）"""
+    return f"S{position + 1}"
+
+
+def parse_short_id(ref: Optional[str]) -> Optional[int]:
+    """短いIDをカタログ上の位置に戻す。形式が違う場合は None"""
+    match = _SHORT_ID.match(ref or "")
+    if match is None:
+        return None
+    return int(match.group(1)) - 1
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    トークン数の概算（保守的に見積もる）
+    ASCII は4文字で1トークン、日本語などそれ以外は1文字1トークンとする
+    """
+    ascii_chars = sum(1 for ch in text if ch < "\x80")
+    return (ascii_chars + 3) // 4 + (len(text) - ascii_chars)
+
+
+# ====================================================================
+# カタログの表形式エンコード（カタログのバージョンごとに1回だけ構築）
+# ====================================================================
+class CatalogPromptEncoding:
+    """
+    各奨学金を1行の区切り文字形式に事前変換したもの
+    辞書のコード (P1, R3 など) はカタログ全体で共通で、プロンプトには使われたものだけを含める
+    """
+
+    def __init__(self, scholarships: Sequence[CompiledScholarship]):
+        self._codes: Dict[str, Dict[str, str]] = {prefix: {} for prefix in DICTIONARIES}
+        self.entries: Dict[str, str] = {} # コード -> "P1=HOPE財団"
+        self.entry_tokens: Dict[str, int] = {}
+        self.rows: List[str] = []
+        self.row_codes: List[Tuple[str, ...]] = []
+        self.row_tokens: List[int] = []
+        for position, sch in enumerate(scholarships):
+            row, codes = self._encode(position, sch)
+            self.rows.append(row)
+            self.row_codes.append(codes)
+            self.row_tokens.append(estimate_tokens(row) + 1) # 改行分
+
+    def _code(self, prefix: str, value: str) -> str:
+        codes = self._codes[prefix]
+        code = codes.get(value)
+        if code is None:
+            code = f"{prefix}{len(codes) + 1}"
+            codes[value] = code
+            self.entries[code] = f"{code}={value}"
+            self.entry_tokens[code] = estimate_tokens(self.entries[code]) + 1
+        return code
+
+    def _code_list(self, prefix: str, values) -> List[str]:
+        return [self._code(prefix, value) for value in sorted(values)]
+
+    def _encode(self, position: int, sch: CompiledScholarship) -> Tuple[str, Tuple[str, ...]]:
+        provider = [self._code("P", sch.provider)]
+        grades = self._code_list("G", sch.eligible_grades)
+        prefs = self._code_list("R", sch.eligible_prefs)
+        fields = self._code_list("F", sch.fields)
+        income = [self._code("I", sch.income_requirement)] if sch.income_requirement else []
+        other = [self._code("O", sch.other_requirements)] if sch.other_requirements else []
+        columns = [
+            short_id(position),
+            _cell(sch.name),
+            ",".join(provider),
+            _cell(sch.category),
+            _cell(sch.type),
+            str(sch.amount_per_year),
+            _cell(sch.period),
+            ",".join(grades),
+            ",".join(prefs),
+            ",".join(fields),
+            ",".join(income),
+            ",".join(other),
+            sch.deadline_date.isoformat(),
+            _cell(sch.difficulty_hint),
+        ]
+        codes = tuple(provider + grades + prefs + fields + income + other)
+        return "|".join(columns), codes
+
+    def encode(self, positions: Sequence[int]) -> str:
+        """指定した奨学金の表と、その表で使われている辞書を文字列にする"""
+        used: Set[str] = set()
+        for position in positions:
+            used.update(self.row_codes[position])
+
+        lines = ["[辞書]"]
+        for prefix, label in DICTIONARIES.items():
+            codes = [code for value, code in self._codes[prefix].items() if code in used]
+            if codes:
+                lines.append(f"# {label}")
+                lines.extend(self.entries[code] for code in codes)
+        lines.append("[奨学金]")
+        lines.append(TABLE_HEADER)
+        lines.extend(self.rows[position] for position in positions)
+        return "\n".join(lines)
+
+
+def _cell(value: Optional[str]) -> str:
+    # 区切り文字・改行を含む値が表を崩さないようにする
+    return (value or "").replace("|", "/").replace("\n", " ")
+
+
+def get_prompt_encoding(catalog: ScholarshipCatalog) -> CatalogPromptEncoding:
+    """カタログが更新されるまで同じエンコード結果を再利用する"""
+    return catalog.derived("prompt_encoding", lambda c: CatalogPromptEncoding(c.scholarships))
+
+
+# ====================================================================
+# プロンプトの組み立て
+# ====================================================================
+def _profile_section(profile: Profile) -> str:
+    return f"--- ユーザープロフィール ---\n{profile.model_dump_json(exclude=PROFILE_PROMPT_EXCLUDE)}"
+
+
+PROMPT_FOOTER = (
+    "上の表は奨学金データベース（検索対象）です。列は | 区切りで、P1 などのコードは [辞書] の値を表します。"
+    "対象学年・対象地域が空欄の場合は制限なしです。\n"
+    "このデータベース内から、ユーザーに最適な奨学金TOP5を選び出し、"
+    "scholarship_id には表の id 列の値 (例: S12) をそのまま入れて、指定されたJSONスキーマに従ってJSONを生成してください。"
+)
+
+
+def _retrieval_ranked(
+    catalog: ScholarshipCatalog,
+    profile: Profile,
+    max_candidates: int,
+    context: Optional[ScoringContext],
+) -> List[int]:
+    """
+    必須条件を満たす奨学金を埋め込みの類似度で RETRIEVAL_SHORTLIST_SIZE 件に絞り込み、
+    ルールベースのスコアに類似度 × RETRIEVAL_SIMILARITY_WEIGHT を加えた順に並べる
+    (専攻の完全一致だけでは拾えない「情報工学」と「工学」のような近い分野も上位に入る)
+    """
+    candidates = get_eligibility_index(catalog).candidates(profile)
+    if not candidates:
+        return []
+    shortlist, similarity = retrieve_candidates(catalog, profile, candidates)
+    scorer = get_batch_scorer(catalog)
+    scores = scorer.score(profile, context, indices=shortlist) + RETRIEVAL_SIMILARITY_WEIGHT * np.maximum(similarity, 0.0)
+    return scorer.top_k(scores, max_candidates, indices=shortlist).tolist()
+
+
+def select_prompt_candidates(
+    catalog: ScholarshipCatalog,
+    profile: Profile,
+    token_budget: int = GEMINI_PROMPT_TOKEN_BUDGET,
+    max_candidates: int = GEMINI_PROMPT_MAX_CANDIDATES,
+    ranked: Optional[Sequence[int]] = None,
+    context: Optional[ScoringContext] = None,
+) -> List[int]:
+    """
+    必須条件を満たす奨学金を、ルールベースのスコア順に、プロンプトが予算に収まるところまで選ぶ
+    戻り値はカタログ上の位置（スコア降順）
+    ranked に事前計算済みの順位（segments.lookup_segment_ranking）を渡した場合は採点を省略する
+    RETRIEVAL_ENABLED の場合は ranked を使わず、埋め込みの類似度で絞り込んだ候補から選ぶ
+    （索引が無い・埋め込みに失敗したなどの場合は、ranked またはルールベースのスコア順で選ぶ）
+    """
+    if RETRIEVAL_ENABLED:
+        try:
+            ranked = _retrieval_ranked(catalog, profile, max_candidates, context)
+        except Exception as e:
+            print(f"[{profile.id}] 警告: 類似度による絞り込みに失敗したため、ルールベースの順位で候補を選びます: {e}")
+    if ranked is None:
+        candidates = get_eligibility_index(catalog).candidates(profile)
+        if not candidates:
+            return []
+        scorer = get_batch_scorer(catalog)
+        scores = scorer.score(profile, context, indices=candidates)
+        ranked = scorer.top_k(scores, max_candidates, indices=candidates).tolist()
+    ranked = list(ranked)[:max_candidates]
+
+    encoding = get_prompt_encoding(catalog)
+    used_tokens = estimate_tokens(_profile_section(profile)) + estimate_tokens(PROMPT_FOOTER) + estimate_tokens(TABLE_HEADER) + 20
+    seen_codes: Set[str] = set()
+    selected: List[int] = []
+    for position in ranked:
+        new_codes = [code for code in encoding.row_codes[position] if code not in seen_codes]
+        cost = encoding.row_tokens[position] + sum(encoding.entry_tokens[code] for code in new_codes)
+        if len(selected) >= MIN_PROMPT_CANDIDATES and used_tokens + cost > token_budget:
+            break
+        selected.append(position)
+        seen_codes.update(new_codes)
+        used_tokens += cost
+    return selected
+
+
+def build_prompt(profile: Profile, catalog: ScholarshipCatalog, positions: Sequence[int]) -> str:
+    """ユーザープロフィールと、選んだ奨学金の表からプロンプト本文を組み立てる"""
+    table = get_prompt_encoding(catalog).encode(positions)
+    return f"{_profile_section(profile)}\n\n--- 奨学金データベース (検索対象) ---\n{table}\n\n{PROMPT_FOOTER}"
+
+
+def expand_response(
+    response: GeminiMatchResponseSchema,
+    catalog: ScholarshipCatalog,
+    positions: Sequence[int],
+) -> MatchResponseSchema:
+    """
+    IDのみで返されたGeminiの応答を、カタログの情報（名称・締切・URLなど）で補完する
+    プロンプトに含めていないIDは誤りとして除外する
+    """
+    allowed = set(positions)
+    results: List[MatchResultSchema] = []
+    for item in response.results:
+        position = parse_short_id(item.scholarship_id)
+        if position is None or position not in allowed:
+            print(f"Gemini応答の不明なIDを除外しました: {item.scholarship_id}")
+            continue
+        sch = catalog.scholarships[position]
+        results.append(MatchResultSchema(
+            rank=item.rank,
+            score=item.score,
+            name=sch.name,
+            provider=sch.provider,
+            why_match=item.why_match,
+            deadline=sch.deadline_date.isoformat(),
+            amount_per_year=sch.amount_per_year,
+            required_docs=list(sch.required_docs),
+            difficulty=sch.difficulty_hint,
+            url=sch.url,
+            todo=item.todo,
+            scholarship_id=sch.id,
+        ))
+    if not results:
+        raise ValueError("Geminiの応答にプロンプト内の奨学金IDが含まれていません")
+    return MatchResponseSchema(results=results, digest=response.digest)
@@ -0,0 +1,295 @@
+import os
+import gc
+import time
+import argparse
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Any, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple
+from sqlalchemy import delete, or_
+from sqlmodel import Session, select
+
+from .database import get_engine, check_connection_budget
+from .models import Profile, MatchResult
+from .catalog import ScholarshipCatalog, get_catalog, load_catalog
+from .batch_scoring import get_batch_scorer, rule_based_top_k
+from .matching_logic import rule_based_match_rows
+from .results_writer import write_match_rows
+from .notifications import notify_results_ready
+from .scoring_context import ScoringContext
+from .scheduler import RETENTION_DAYS
+
+# 並列に採点するプロセス数（0 または 1 の場合はプロセスを起動せず、このプロセスで処理する）
+RERANK_WORKERS = int(os.getenv("RERANK_WORKERS", str(os.cpu_count() or 1)))
+# 1つのタスクで採点・保存するプロフィール件数（1回のトランザクションの大きさ）
+RERANK_CHUNK_PROFILES = int(os.getenv("RERANK_CHUNK_PROFILES", "2000"))
+# サーバー側カーソルから一度に取り出す行数
+RERANK_FETCH_ROWS = int(os.getenv("RERANK_FETCH_ROWS", "10000"))
+# 進捗を表示する間隔（秒）
+RERANK_PROGRESS_SECONDS = float(os.getenv("RERANK_PROGRESS_SECONDS", "5"))
+
+
+class ProfileRow(NamedTuple):
+    """採点とテンプレート文に必要な項目だけを持つプロフィール（プロセス間で軽く受け渡すため）"""
+    id: int
+    grade: str
+    prefecture: str
+    income_band: str
+    major: str
+    has_social_care: bool
+
+
+_PROFILE_COLUMNS = [getattr(Profile, name) for name in ProfileRow._fields]
+
+
+@dataclass
+class RerankReport:
+    dry_run: bool
+    workers: int
+    catalog_version: int = 0
+    profiles: int = 0
+    rows: int = 0 # 保存した MatchResult の件数（ドライランでは保存する予定の件数）
+    elapsed_seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+    @property
+    def profiles_per_second(self) -> float:
+        return self.profiles / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+
+# ====================================================================
+# 採点プロセス側の処理
+# ====================================================================
+@dataclass
+class _WorkerState:
+    catalog: ScholarshipCatalog
+    context: ScoringContext
+    dry_run: bool
+
+
+# fork で起動した場合は親プロセスで設定した値（コンパイル済みカタログと NumPy 配列）をそのまま共有する
+_state: Optional[_WorkerState] = None
+
+
+def _init_worker(catalog_version: int, context: ScoringContext, dry_run: bool):
+    """採点プロセスの初期化（ProcessPoolExecutor の initializer）"""
+    global _state
+    # 親プロセスのプールの接続を引き継いで使わないよう、プロセスごとに接続し直す
+    get_engine().dispose(close=False)
+    if _state is not None:
+        return
+    # fork が使えない環境では、各プロセスでカタログを読み込む（親と同じバージョンであることを確認する）
+    with Session(get_engine()) as session:
+        catalog = load_catalog(session)
+    if catalog.version != catalog_version:
+        raise RuntimeError(f"再採点中にカタログが更新されました (version {catalog_version} -> {catalog.version})")
+    get_batch_scorer(catalog)
+    _state = _WorkerState(catalog=catalog, context=context, dry_run=dry_run)
+
+
+def _kept_results(session: Session, profile_ids: Sequence[int]) -> Dict[int, List[Any]]:
+    """再採点で置き換えない結果（ユーザーが保存した結果と、Geminiの結果）をプロフィールごとに返す"""
+    rows = session.execute(
+        select(MatchResult.profile_id, MatchResult.scholarship_id, MatchResult.rank, MatchResult.raw_json.is_not(None))
+        .where(MatchResult.profile_id.in_(profile_ids))
+        .where(or_(MatchResult.saved == True, MatchResult.raw_json.is_not(None)))
+    ).all()
+    kept: Dict[int, List[Any]] = {}
+    for row in rows:
+        kept.setdefault(row[0], []).append(row)
+    return kept
+
+
+def _rerank_chunk(profiles: Sequence[ProfileRow]) -> Tuple[int, int]:
+    """
+    プロフィールをまとめて採点し、各プロフィールのルールベースの結果（保存済みでないもの）を新しいTOP5に置き換える
+    - Geminiの結果 (raw_json がある行) を持つプロフィールは、結果を変更しない
+    - ユーザーが保存した結果 (saved) は残し、新しい結果はその奨学金を除いて、保存済みの結果の後ろの順位にする
+    削除と保存は同じトランザクションで行う（読み手には古い結果と新しい結果が一度に切り替わって見える）
+    戻り値: (プロフィール件数, 保存した MatchResult の件数)
+    """
+    state = _state
+    with Session(get_engine()) as session:
+        kept = _kept_results(session, [profile.id for profile in profiles])
+        targets = [
+            profile for profile in profiles
+            if not any(has_raw_json for *_, has_raw_json in kept.get(profile.id, ()))
+        ]
+        # 保存済みの奨学金を除いても5件残るよう、その件数だけ多めに選ぶ
+        extra = max((len(kept.get(profile.id, ())) for profile in targets), default=0)
+        rows: List[Dict[str, Any]] = []
+        for profile, ranked in zip(targets, rule_based_top_k(state.catalog, targets, state.context, k=5 + extra)):
+            saved = kept.get(profile.id, [])
+            saved_ids = {scholarship_id for _, scholarship_id, _, _ in saved}
+            ranked = [(sch, score) for sch, score in ranked if sch.id not in saved_ids][:5]
+            offset = max((rank for _, _, rank, _ in saved), default=0)
+            for row in rule_based_match_rows(profile, ranked):
+                row["rank"] += offset
+                rows.append(row)
+        if state.dry_run or not targets:
+            return len(profiles), len(rows)
+
+        session.execute(
+            delete(MatchResult)
+            .where(MatchResult.profile_id.in_([profile.id for profile in targets]))
+            .where(MatchResult.saved == False)
+            .where(MatchResult.raw_json.is_(None))
+        )
+        written = write_match_rows(session, rows)
+        # 新しい結果が1件も無いプロフィールも、削除したことを通知する（保存した行の通知は write_match_rows が行う）
+        notify_results_ready(session, {profile.id for profile in targets} - {row["profile_id"] for row in rows})
+        session.commit()
+    return len(profiles), written
+
+
+# ====================================================================
+# 親プロセス側の処理
+# ====================================================================
+def stream_profiles(session: Session, since: datetime, chunk_size: int = RERANK_CHUNK_PROFILES) -> Iterator[List[ProfileRow]]:
+    """
+    対象のプロフィールをサーバー側カーソルで少しずつ読み込み、chunk_size 件ずつ返す
+    （全件をメモリに載せない。モデルのオブジェクトも作らない）
+    """
+    result = session.execute(
+        select(*_PROFILE_COLUMNS)
+        .where(Profile.created_at >= since)
+        .order_by(Profile.id)
+        .execution_options(yield_per=RERANK_FETCH_ROWS)
+    )
+    chunk: List[ProfileRow] = []
+    for partition in result.partitions():
+        for row in partition:
+            chunk.append(ProfileRow(*row))
+            if len(chunk) >= chunk_size:
+                yield chunk
+                chunk = []
+    if chunk:
+        yield chunk
+
+
+class _Progress:
+    def __init__(self, report: RerankReport, started: float):
+        self.report = report
+        self.started = started
+        self.last_printed = started
+
+    def add(self, profiles: int, rows: int):
+        self.report.profiles += profiles
+        self.report.rows += rows
+        now = time.perf_counter()
+        if now - self.last_printed >= RERANK_PROGRESS_SECONDS:
+            self.last_printed = now
+            elapsed = now - self.started
+            print(
+                f"    再採点中: {self.report.profiles} 件 / 結果 {self.report.rows} 行 "
+                f"({elapsed:.1f} 秒, {self.report.rows / elapsed:.0f} 行/秒)"
+            )
+
+
+def _pool_context() -> multiprocessing.context.BaseContext:
+    # fork であれば、親で構築したカタログを各プロセスがコピーせずに共有できる
+    if "fork" in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context("fork")
+    return multiprocessing.get_context()
+
+
+def rerank_chunks(
+    chunks: Iterable[Sequence[ProfileRow]],
+    catalog: ScholarshipCatalog,
+    context: ScoringContext,
+    workers: int = RERANK_WORKERS,
+    dry_run: bool = False,
+) -> RerankReport:
+    """プロフィールのチャンクを採点プロセスに振り分け、結果を保存する"""
+    global _state
+    # 稼働中のAPIサーバー・ワーカーの接続と合わせて、DBの上限を超えないことを確認する
+    check_connection_budget(max(workers, 1))
+    report = RerankReport(dry_run=dry_run, workers=workers, catalog_version=catalog.version)
+    started = time.perf_counter()
+    progress = _Progress(report, started)
+
+    # fork 前に NumPy 配列まで構築しておき、子プロセスは読み取りのみで共有する
+    get_batch_scorer(catalog)
+    _state = _WorkerState(catalog=catalog, context=context, dry_run=dry_run)
+    try:
+        if workers <= 1:
+            for chunk in chunks:
+                progress.add(*_rerank_chunk(chunk))
+        else:
+            mp_context = _pool_context()
+            if mp_context.get_start_method() == "fork":
+                # 参照カウントの更新でカタログのページがコピーされないよう、既存のオブジェクトをGCの対象外にする
+                gc.freeze()
+            with ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=mp_context,
+                initializer=_init_worker,
+                initargs=(catalog.version, context, dry_run),
+            ) as pool:
+                # 読み込みが採点より速い場合にメモリを使い過ぎないよう、実行中のタスク数を制限する
+                pending: Set[Future] = set()
+                for chunk in chunks:
+                    if len(pending) >= workers * 2:
+                        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            progress.add(*future.result())
+                    pending.add(pool.submit(_rerank_chunk, chunk))
+                for future in wait(pending).done:
+                    progress.add(*future.result())
+    finally:
+        _state = None
+        gc.unfreeze()
+
+    report.elapsed_seconds = time.perf_counter() - started
+    return report
+
+
+def rerank_all_profiles(
+    session: Session,
+    since: Optional[datetime] = None,
+    workers: int = RERANK_WORKERS,
+    chunk_size: int = RERANK_CHUNK_PROFILES,
+    dry_run: bool = False,
+) -> RerankReport:
+    """
+    保持期間内の全プロフィールを現在のカタログでルールベースの採点をやり直し、結果を置き換える
+    奨学金マスタの更新後（締切のリマインドの前など）にオフラインで実行する
+    """
+    if since is None:
+        since = datetime.utcnow() - timedelta(days=RETENTION_DAYS)
+    catalog = get_catalog(session)
+    context = ScoringContext.now() # 全プロフィールを同じ基準日で採点する
+    mode = "（ドライラン）" if dry_run else ""
+    print(
+        f"--- [再採点開始]{mode} catalog version={catalog.version} ({len(catalog)} 件), "
+        f"{since:%Y-%m-%d} 以降のプロフィール, {max(workers, 1)} プロセス ---"
+    )
+    report = rerank_chunks(stream_profiles(session, since, chunk_size), catalog, context, workers, dry_run)
+    print(
+        f"--- [再採点完了]{mode} プロフィール {report.profiles} 件, 結果 {report.rows} 行 "
+        f"({report.elapsed_seconds:.2f} 秒, {report.rows_per_second:.0f} 行/秒, "
+        f"{report.profiles_per_second:.0f} 件/秒) ---"
+    )
+    return report
+
+
+if __name__ == "__main__":
+    # 例: python -m app.rerank --workers 8 / python -m app.rerank --dry-run
+    parser = argparse.ArgumentParser(description="保存済みの全プロフィールをルールベースで再採点する")
+    parser.add_argument("--workers", type=int, default=RERANK_WORKERS)
+    parser.add_argument("--chunk-size", type=int, default=RERANK_CHUNK_PROFILES)
+    parser.add_argument("--since-days", type=int, default=RETENTION_DAYS, help="この日数以内に作成されたプロフィールを対象にする")
+    parser.add_argument("--dry-run", action="store_true", help="採点のみ行い、結果を保存しない")
+    args = parser.parse_args()
+    with Session(get_engine()) as session:
+        rerank_all_profiles(
+            session,
+            since=datetime.utcnow() - timedelta(days=args.since_days),
+            workers=args.workers,
+            chunk_size=args.chunk_size,
+            dry_run=args.dry_run,
+        )
@@ -0,0 +1,292 @@
+import asyncio
+import threading
+import time
+import weakref
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Callable, Deque, Dict, Optional, Tuple
+
+CIRCUIT_STATES = ("closed", "half_open", "open")
+
+
+class CircuitOpenError(RuntimeError):
+    """サーキットブレーカーが開いているため、呼び出しを行わずに失敗させた"""
+
+
+# ====================================================================
+# サーキットブレーカー
+# ====================================================================
+class CircuitBreaker:
+    """
+    直近 window_seconds 秒の呼び出しの失敗率（タイムアウト・エラー）で外部APIへの呼び出しを止める
+    - closed: 通常どおり呼び出す。min_calls 件以上で失敗率が failure_rate 以上になったら open にする
+    - open: open_seconds 秒間は呼び出さずに CircuitOpenError にする（呼び出し側はすぐに代替処理へ進む）
+    - half_open: open_seconds 経過後、half_open_calls 件だけ試しに呼び出す。全て成功すれば closed、1件でも失敗すれば open に戻す
+    asyncio のタスクとスレッドのどちらから呼び出してもよい
+    """
+
+    def __init__(
+        self,
+        name: str,
+        window_seconds: float = 60.0,
+        min_calls: int = 10,
+        failure_rate: float = 0.5,
+        open_seconds: float = 30.0,
+        half_open_calls: int = 3,
+        on_state_change: Optional[Callable[[str], None]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.open_seconds = open_seconds
+        self.half_open_calls = half_open_calls
+        self._on_state_change = on_state_change
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._opened_at = 0.0
+        self._calls: Deque[Tuple[float, bool]] = deque() # (時刻, 失敗したか)
+        self._probes_started = 0 # half_open で許可した試行の件数
+        self._probes_succeeded = 0
+        self.stats = {"successes": 0, "timeouts": 0, "errors": 0, "rejected": 0, "opened": 0}
+
+    # ----------------------------------------------------------------
+    # 呼び出し側から使う
+    # ----------------------------------------------------------------
+    def before_call(self):
+        """呼び出しの直前に確認する。呼び出せない場合は CircuitOpenError を送出する"""
+        with self._lock:
+            self._advance()
+            if self._state == "closed":
+                return
+            if self._state == "half_open" and self._probes_started < self.half_open_calls:
+                self._probes_started += 1
+                return
+            self.stats["rejected"] += 1
+            retry_in = max(0.0, self._opened_at + self.open_seconds - self._clock())
+        raise CircuitOpenError(f"{self.name} のサーキットブレーカーが開いています (約 {retry_in:.0f} 秒後に再試行)")
+
+    def record_success(self):
+        with self._lock:
+            self.stats["successes"] += 1
+            if self._state == "half_open":
+                self._probes_succeeded += 1
+                if self._probes_succeeded >= self.half_open_calls:
+                    self._transition("closed")
+                return
+            self._record(failed=False)
+
+    def record_failure(self, kind: str = "error"):
+        """kind は "timeout" または "error" """
+        with self._lock:
+            self.stats["timeouts" if kind == "timeout" else "errors"] += 1
+            if self._state == "half_open":
+                self._transition("open")
+                return
+            if self._state == "closed":
+                self._record(failed=True)
+
+    def record_abandoned(self):
+        """before_call の後、呼び出す前に中断した場合（half_open の試行枠を返す）"""
+        with self._lock:
+            if self._state == "half_open" and self._probes_started > self._probes_succeeded:
+                self._probes_started -= 1
+
+    # ----------------------------------------------------------------
+    # 内部の状態遷移（ロックを取得した状態で呼び出す）
+    # ----------------------------------------------------------------
+    def _advance(self):
+        if self._state == "open" and self._clock() - self._opened_at >= self.open_seconds:
+            self._transition("half_open")
+
+    def _record(self, failed: bool):
+        now = self._clock()
+        self._calls.append((now, failed))
+        while self._calls and self._calls[0][0] < now - self.window_seconds:
+            self._calls.popleft()
+        if len(self._calls) >= self.min_calls:
+            failures = sum(1 for _, f in self._calls if f)
+            if failures / len(self._calls) >= self.failure_rate:
+                self._transition("open")
+
+    def _transition(self, state: str):
+        if state == self._state:
+            return
+        previous, self._state = self._state, state
+        self._calls.clear()
+        self._probes_started = 0
+        self._probes_succeeded = 0
+        if state == "open":
+            self._opened_at = self._clock()
+            self.stats["opened"] += 1
+        print(f"--- サーキットブレーカー [{self.name}]: {previous} -> {state} ---")
+        if self._on_state_change is not None:
+            self._on_state_change(state)
+
+    # ----------------------------------------------------------------
+    # 監視用
+    # ----------------------------------------------------------------
+    @property
+    def state(self) -> str:
+        with self._lock:
+            self._advance()
+            return self._state
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            self._advance()
+            now = self._clock()
+            recent = [failed for at, failed in self._calls if at >= now - self.window_seconds]
+            snapshot: Dict[str, object] = dict(self.stats)
+            snapshot.update({
+                "state": self._state,
+                "recent_calls": len(recent),
+                "recent_failure_rate": sum(recent) / len(recent) if recent else 0.0,
+            })
+            if self._state == "open":
+                snapshot["retry_in_seconds"] = round(max(0.0, self._opened_at + self.open_seconds - now), 1)
+            return snapshot
+
+
+# ====================================================================
+# 同時実行数の自動調整 (AIMD)
+# ====================================================================
+class AdaptiveLimiter:
+    """
+    同時実行数の上限を応答の状況に合わせて調整するリミッター
+    - 加算的増加: 遅くない成功1件ごとに上限を 1/上限 ずつ増やす（上限件数が成功するとおよそ +1）
+    - 乗算的減少: 429 などの過負荷・遅い応答・タイムアウトで上限を decrease_factor 倍にする
+      (同時に実行していた呼び出しがまとめて失敗しても1回だけ減らすよう、cooldown_seconds 秒に1回まで)
+    実行中の件数は全イベントループで共有し、待機用の Condition はイベントループごとに作る
+    """
+
+    def __init__(
+        self,
+        name: str,
+        min_limit: int = 1,
+        max_limit: int = 8,
+        initial_limit: Optional[int] = None,
+        decrease_factor: float = 0.5,
+        slow_seconds: float = 5.0,
+        cooldown_seconds: float = 2.0,
+        on_change: Optional[Callable[[float, int], None]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.decrease_factor = decrease_factor
+        self.slow_seconds = slow_seconds
+        self.cooldown_seconds = cooldown_seconds
+        self._on_change = on_change
+        self._clock = clock
+        self._limit = float(min(self.max_limit, max(self.min_limit, initial_limit or self.max_limit)))
+        self._in_flight = 0
+        self._last_decrease = float("-inf")
+        self._lock = threading.Lock()
+        self._conditions = weakref.WeakKeyDictionary() # イベントループ -> asyncio.Condition
+        self.stats = {"acquired": 0, "increases": 0, "decreases": 0, "overloads": 0, "slow": 0, "timeouts": 0}
+
+    @property
+    def limit(self) -> int:
+        return int(self._limit + 1e-9) # 1/上限 の加算の丸め誤差で1つ少なくならないようにする
+
+    @property
+    def in_flight(self) -> int:
+        return self._in_flight
+
+    def _get_condition(self) -> asyncio.Condition:
+        # asyncio.Condition は作成後に最初に使ったイベントループに結び付くため、実行中のループごとに作る
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            condition = self._conditions.get(loop)
+            if condition is None:
+                condition = self._conditions[loop] = asyncio.Condition()
+            return condition
+
+    def _try_acquire(self) -> bool:
+        with self._lock:
+            if self._in_flight >= self.limit:
+                return False
+            self._in_flight += 1
+            self.stats["acquired"] += 1
+            return True
+
+    @staticmethod
+    async def _notify(condition: asyncio.Condition):
+        async with condition:
+            condition.notify_all()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """上限に空きが出るまで待ち、with ブロックの間だけ1枠を使う"""
+        condition = self._get_condition()
+        async with condition:
+            await condition.wait_for(self._try_acquire)
+        self._changed()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+                others = [(loop, cond) for loop, cond in self._conditions.items() if cond is not condition]
+            async with condition:
+                condition.notify_all()
+            # 他のイベントループ（別スレッド）で待機中の呼び出しにも空きを知らせる
+            for loop, other in others:
+                if loop.is_running():
+                    asyncio.run_coroutine_threadsafe(self._notify(other), loop)
+            self._changed()
+
+    # ----------------------------------------------------------------
+    # 呼び出し結果のフィードバック
+    # ----------------------------------------------------------------
+    def record_success(self, latency_seconds: float):
+        if latency_seconds >= self.slow_seconds:
+            self.stats["slow"] += 1
+            self._decrease()
+            return
+        if self._limit < self.max_limit:
+            previous = self.limit
+            self._limit = min(float(self.max_limit), self._limit + 1.0 / self._limit)
+            if self.limit > previous:
+                self.stats["increases"] += 1 # 待機中の呼び出しは、この後の枠の解放時に新しい上限で再判定される
+            self._changed()
+
+    def record_overload(self):
+        """429 (Too Many Requests) などの過負荷の応答"""
+        self.stats["overloads"] += 1
+        self._decrease()
+
+    def record_timeout(self):
+        self.stats["timeouts"] += 1
+        self._decrease()
+
+    def _decrease(self):
+        now = self._clock()
+        if now - self._last_decrease < self.cooldown_seconds:
+            return
+        self._last_decrease = now
+        decreased = max(float(self.min_limit), self._limit * self.decrease_factor)
+        if decreased < self._limit:
+            self._limit = decreased
+            self.stats["decreases"] += 1
+            print(f"--- 同時実行数の上限 [{self.name}]: {self.limit} に縮小しました ---")
+        self._changed()
+
+    def _changed(self):
+        if self._on_change is not None:
+            self._on_change(self._limit, self._in_flight)
+
+    def snapshot(self) -> Dict[str, object]:
+        snapshot: Dict[str, object] = dict(self.stats)
+        snapshot.update({
+            "limit": self.limit,
+            "limit_exact": round(self._limit, 2),
+            "min_limit": self.min_limit,
+            "max_limit": self.max_limit,
+            "in_flight": self._in_flight,
+        })
+        return snapshot
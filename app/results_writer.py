@@ -0,0 +1,153 @@
+import re
+import unicodedata
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import insert, delete, update
+from sqlmodel import Session
+
+from .models import MatchResult
+from .catalog import CompiledScholarship, ScholarshipCatalog
+from .schemas import MatchResponseSchema
+from .notifications import notify_results_ready
+from .scoring_context import to_db_utc
+
+_SPACES = re.compile(r"\s+")
+
+# 1回の INSERT に含める行数の上限（Postgresのバインド変数は1文あたり65535個まで）
+WRITE_CHUNK_ROWS = 1000
+
+
+def normalize_name(name: Optional[str]) -> str:
+    """
+    名称の表記ゆれを吸収した照合用のキーを返す
+    (全角/半角の英数字・記号を NFKC で統一し、空白を除去、英字は大文字小文字を区別しない)
+    """
+    if not name:
+        return ""
+    return _SPACES.sub("", unicodedata.normalize("NFKC", name)).casefold()
+
+
+# ====================================================================
+# 奨学金名 -> 奨学金 の辞書引き
+# ====================================================================
+class ScholarshipNameResolver:
+    """
+    Geminiの結果をカタログの奨学金に対応付ける（辞書引きのため O(1)）
+    奨学金IDがあればIDで、無ければ名称で照合し、同名の奨学金が複数ある場合は提供団体名で絞り込む
+    """
+
+    def __init__(self, scholarships: Sequence[CompiledScholarship]):
+        self._by_id: Dict[int, CompiledScholarship] = {sch.id: sch for sch in scholarships}
+        self._by_name: Dict[str, List[CompiledScholarship]] = {}
+        self._by_name_provider: Dict[Tuple[str, str], CompiledScholarship] = {}
+        for sch in scholarships:
+            name_key = normalize_name(sch.name)
+            self._by_name.setdefault(name_key, []).append(sch)
+            self._by_name_provider[(name_key, normalize_name(sch.provider))] = sch
+
+    def resolve(
+        self,
+        name: str,
+        provider: Optional[str] = None,
+        scholarship_id: Optional[int] = None,
+    ) -> Optional[CompiledScholarship]:
+        if scholarship_id is not None:
+            sch = self._by_id.get(scholarship_id)
+            if sch is not None:
+                return sch
+        name_key = normalize_name(name)
+        if provider:
+            sch = self._by_name_provider.get((name_key, normalize_name(provider)))
+            if sch is not None:
+                return sch
+        matches = self._by_name.get(name_key)
+        if matches and len(matches) == 1:
+            return matches[0]
+        return None # 該当なし、または提供団体で区別できない同名の奨学金
+
+
+def get_name_resolver(catalog: ScholarshipCatalog) -> ScholarshipNameResolver:
+    """カタログが更新されるまで同じ辞書を再利用する"""
+    return catalog.derived("name_resolver", lambda c: ScholarshipNameResolver(c.scholarships))
+
+
+# ====================================================================
+# MatchResult の組み立てと一括保存
+# ====================================================================
+def match_results_from_gemini(
+    profile_id: int,
+    response: MatchResponseSchema,
+    resolver: ScholarshipNameResolver,
+) -> Tuple[List[MatchResult], List[str]]:
+    """
+    Geminiの応答を MatchResult に変換する
+    戻り値: (MatchResult のリスト, カタログに対応付けられなかった奨学金名のリスト)
+    """
+    results: List[MatchResult] = []
+    unresolved: List[str] = []
+    for item in response.results:
+        sch = resolver.resolve(item.name, item.provider, item.scholarship_id)
+        if sch is None:
+            unresolved.append(item.name)
+            continue
+
+        results.append(MatchResult(
+            rank=item.rank,
+            score=item.score,
+            why_match=item.why_match,
+            difficulty=item.difficulty,
+            deadline=to_db_utc(sch.deadline), # 応答の日付ではなく、カタログの締切（時刻を含む）を保存する
+            amount_per_year=item.amount_per_year,
+            url=item.url,
+            todo=item.todo,
+            digest=response.digest,
+            profile_id=profile_id,
+            scholarship_id=sch.id,
+            raw_json=item.model_dump_json()
+        ))
+    return results, unresolved
+
+
+def write_match_results(session: Session, results: Sequence[MatchResult]) -> int:
+    """
+    MatchResult を複数行 INSERT でまとめて保存する（コミットは呼び出し側で行う）
+    Gemini経由・ルールベース・一括マッチングのいずれの結果にも使用する
+    コミットされると、結果を待っているクライアント (SSE) に通知が届く
+    """
+    if not results:
+        return 0
+    return write_match_rows(session, [result.model_dump(exclude={"id"}) for result in results])
+
+
+def write_match_rows(session: Session, rows: Sequence[Dict[str, Any]]) -> int:
+    """write_match_results と同じ保存・通知を、MatchResult の列の値 (dict) から直接行う"""
+    if not rows:
+        return 0
+    for start in range(0, len(rows), WRITE_CHUNK_ROWS):
+        session.execute(insert(MatchResult.__table__).values(rows[start:start + WRITE_CHUNK_ROWS]))
+    notify_results_ready(session, (row["profile_id"] for row in rows))
+    return len(rows)
+
+
+def replace_provisional_results(session: Session, profile_id: int, results: Sequence[MatchResult]) -> int:
+    """
+    プロフィールの暫定結果を削除して results を保存する（コミットは呼び出し側で行う）
+    同じトランザクション内で行うため、読み手には古い結果と新しい結果が一度に切り替わって見える
+    """
+    session.execute(
+        delete(MatchResult)
+        .where(MatchResult.profile_id == profile_id)
+        .where(MatchResult.provisional == True)
+    )
+    return write_match_results(session, results)
+
+
+def finalize_provisional_results(session: Session, profile_id: int) -> int:
+    """暫定結果をそのまま最終結果にする（Geminiが失敗した場合。コミットは呼び出し側で行う）"""
+    result = session.execute(
+        update(MatchResult)
+        .where(MatchResult.profile_id == profile_id)
+        .where(MatchResult.provisional == True)
+        .values(provisional=False)
+    )
+    notify_results_ready(session, [profile_id])
+    return result.rowcount
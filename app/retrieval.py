@@ -0,0 +1,537 @@
+import os
+import re
+import json
+import time
+import zlib
+import hashlib
+import argparse
+import threading
+import unicodedata
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from cachetools import LRUCache
+from sqlmodel import Session
+
+from .database import get_engine
+from .models import ProfileBase
+from .catalog import CompiledScholarship, ScholarshipCatalog, get_catalog
+
+# "1" の場合、プロンプトの候補を選ぶ前に、埋め込みの類似度で候補を絞り込み、順位付けにも類似度を加える
+RETRIEVAL_ENABLED = os.getenv("RETRIEVAL_ENABLED", "0") == "1"
+# 埋め込みモデル（EMBEDDERS の名前）: "hashing" (ローカル・決定的) / "gemini" (Gemini の埋め込みAPI)
+RETRIEVAL_EMBEDDER = os.getenv("RETRIEVAL_EMBEDDER", "hashing")
+RETRIEVAL_HASHING_DIM = int(os.getenv("RETRIEVAL_HASHING_DIM", "512"))
+RETRIEVAL_GEMINI_MODEL = os.getenv("RETRIEVAL_GEMINI_MODEL", "text-embedding-004")
+RETRIEVAL_GEMINI_DIM = int(os.getenv("RETRIEVAL_GEMINI_DIM", "768"))
+RETRIEVAL_EMBED_BATCH = int(os.getenv("RETRIEVAL_EMBED_BATCH", "100")) # 埋め込みAPIの1回の呼び出しに含める件数
+RETRIEVAL_QUERY_CACHE_SIZE = int(os.getenv("RETRIEVAL_QUERY_CACHE_SIZE", "10000"))
+# ベクトル索引の保存先（サーバーレス環境では /tmp など書き込めるディレクトリを指定する）
+RETRIEVAL_INDEX_DIR = os.getenv(
+    "RETRIEVAL_INDEX_DIR", os.path.join(os.path.dirname(__file__), "..", "data", "vector_index")
+)
+# 類似度の上位何件をスコアリング・プロンプトの段階に渡すか
+RETRIEVAL_SHORTLIST_SIZE = int(os.getenv("RETRIEVAL_SHORTLIST_SIZE", "1000"))
+# プロンプトの候補の順位付けで、ルールベースのスコアに加える類似度の重み（専攻の完全一致のボーナスと同じ大きさ）
+RETRIEVAL_SIMILARITY_WEIGHT = float(os.getenv("RETRIEVAL_SIMILARITY_WEIGHT", "0.2"))
+# この件数以上の索引では IVF（クラスタ単位の近似検索）を使う
+RETRIEVAL_IVF_MIN_ROWS = int(os.getenv("RETRIEVAL_IVF_MIN_ROWS", "50000"))
+RETRIEVAL_IVF_LISTS = int(os.getenv("RETRIEVAL_IVF_LISTS", "0")) # 0 の場合は sqrt(件数)
+# 検索時に調べるクラスタの数（0 の場合はクラスタ数の 1/8。benchmarks.run --retrieval で全件検索との一致率を確認して調整する）
+RETRIEVAL_IVF_PROBES = int(os.getenv("RETRIEVAL_IVF_PROBES", "0"))
+# 差分更新で埋め込み直した行の割合がこれを超えたら、IVF のクラスタを学習し直す
+RETRIEVAL_IVF_RETRAIN_RATIO = float(os.getenv("RETRIEVAL_IVF_RETRAIN_RATIO", "0.2"))
+# 索引が無い・カタログと一致しない場合に、ディスクを読み直すまでの間隔（その間はルールベースの順位で候補を選ぶ）
+RETRIEVAL_INDEX_RETRY_SECONDS = float(os.getenv("RETRIEVAL_INDEX_RETRY_SECONDS", "30"))
+
+# 索引のファイル形式を変えたら上げる（古い形式の索引は使わずに作り直す）
+INDEX_FORMAT_VERSION = 1
+META_FILE = "meta.json"
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """各行を L2 正規化する（内積がそのままコサイン類似度になる。ゼロベクトルはそのまま）"""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.where(norms == 0, 1.0, norms)).astype(np.float32, copy=False)
+
+
+# ====================================================================
+# 埋め込みモデル
+# ====================================================================
+class Embedder(ABC):
+    """
+    テキストを L2 正規化済みのベクトル (件数 × dim, float32) に変換する
+    name は索引に記録され、モデル・次元数・前処理が変わった場合は全件を埋め込み直す
+    """
+    name: str = ""
+    dim: int = 0
+
+    @abstractmethod
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        ...
+
+
+_TOKEN_SPLIT = re.compile(r"[\s/・、，,。．.()（）「」\[\]|]+")
+
+
+class HashingEmbedder(Embedder):
+    """
+    文字 n-gram を特徴量ハッシュで固定長のベクトルにする（モデル・通信が不要で、同じ入力には常に同じベクトルを返す）
+    "情報工学" と "工学" のように文字列を共有する表記の揺れ・上位の分野にも類似度が付く
+    """
+
+    def __init__(self, dim: int = RETRIEVAL_HASHING_DIM, ngram_sizes: Sequence[int] = (2, 3)):
+        self.dim = dim
+        self.ngram_sizes = tuple(ngram_sizes)
+        self.name = f"hashing-v1-d{dim}-n{''.join(str(n) for n in self.ngram_sizes)}"
+
+    def _features(self, token: str) -> Tuple[np.ndarray, np.ndarray]:
+        """語の n-gram の (次元, 符号) の配列"""
+        buckets, signs = [], []
+        for n in self.ngram_sizes:
+            for start in range(len(token) - n + 1):
+                # hash() はプロセスごとに値が変わるため、決定的な crc32 を使う
+                h = zlib.crc32(token[start:start + n].encode("utf-8"))
+                buckets.append(h % self.dim)
+                # 符号付きハッシュ（衝突した特徴量どうしが打ち消し合い、内積の偏りが小さくなる）
+                signs.append(1.0 if (h >> 31) & 1 else -1.0)
+        return np.asarray(buckets, dtype=np.int64), np.asarray(signs, dtype=np.float32)
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        features: Dict[str, Tuple[np.ndarray, np.ndarray]] = {} # 提供団体・分野など同じ語が繰り返し現れるため使い回す
+        for row, text in enumerate(texts):
+            for token in _TOKEN_SPLIT.split(unicodedata.normalize("NFKC", text).lower()):
+                feature = features.get(token)
+                if feature is None:
+                    feature = features[token] = self._features(token)
+                np.add.at(vectors[row], feature[0], feature[1])
+        return _normalize(vectors)
+
+
+class GeminiEmbedder(Embedder):
+    """Gemini の埋め込みAPIを使う（索引の構築時は変更された行だけを RETRIEVAL_EMBED_BATCH 件ずつ送る）"""
+
+    def __init__(self, model: str = RETRIEVAL_GEMINI_MODEL, dim: int = RETRIEVAL_GEMINI_DIM):
+        self.model = model
+        self.dim = dim
+        self.name = f"gemini-{model}-d{dim}"
+
+    def embed(self, texts: Sequence[str]) -> np.ndarray:
+        from .gemini_client import get_client # SDK は使うときまで読み込まない
+        from google.genai import types
+
+        client = get_client()
+        config = types.EmbedContentConfig(output_dimensionality=self.dim)
+        vectors: List[Sequence[float]] = []
+        for start in range(0, len(texts), RETRIEVAL_EMBED_BATCH):
+            response = client.models.embed_content(
+                model=self.model,
+                contents=list(texts[start:start + RETRIEVAL_EMBED_BATCH]),
+                config=config,
+            )
+            vectors.extend(embedding.values for embedding in response.embeddings)
+        return _normalize(np.asarray(vectors, dtype=np.float32).reshape(len(texts), self.dim))
+
+
+# 名前 -> 埋め込みモデルを生成する関数（RETRIEVAL_EMBEDDER で選ぶ。別のモデルはここに登録する）
+EMBEDDERS: Dict[str, Callable[[], Embedder]] = {
+    "hashing": HashingEmbedder,
+    "gemini": GeminiEmbedder,
+}
+_embedder: Optional[Embedder] = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder() -> Embedder:
+    """RETRIEVAL_EMBEDDER の埋め込みモデルを返す（プロセス内で1つだけ生成）"""
+    global _embedder
+    if _embedder is None:
+        with _embedder_lock:
+            if _embedder is None:
+                if RETRIEVAL_EMBEDDER not in EMBEDDERS:
+                    raise ValueError(f"不明な埋め込みモデルです: {RETRIEVAL_EMBEDDER} (選択肢: {', '.join(EMBEDDERS)})")
+                _embedder = EMBEDDERS[RETRIEVAL_EMBEDDER]()
+    return _embedder
+
+
+# ====================================================================
+# 埋め込む文字列
+# ====================================================================
+def scholarship_text(sch: CompiledScholarship) -> str:
+    """奨学金の埋め込みに使う文字列（内容が変わった行だけを埋め込み直せるよう、この文字列のハッシュを索引に記録する）"""
+    return " ".join([
+        sch.name,
+        sch.provider,
+        sch.category,
+        sch.type,
+        " ".join(sorted(sch.fields)),
+        sch.other_requirements,
+        sch.period,
+    ])
+
+
+def profile_text(profile: ProfileBase) -> str:
+    """プロフィールの検索文字列（学年・地域・年収は必須条件で絞り込むため含めない）"""
+    parts = [profile.major]
+    if profile.has_social_care:
+        parts.append("社会的養護経験者")
+    if profile.has_volunteer:
+        parts.append("ボランティア経験")
+    return " ".join(parts)
+
+
+def _content_hash(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()[:16]
+
+
+# ====================================================================
+# ベクトル索引（ディスク上のファイルを memmap で開く）
+# ====================================================================
+class VectorIndex:
+    """
+    カタログの1バージョン分の埋め込み。行の順序はカタログ上の位置と同じ
+    ベクトルは memmap で開くため、複数のプロセスで同じページを共有し、検索で触れた行だけが読み込まれる
+    """
+
+    def __init__(
+        self,
+        meta: Dict,
+        vectors: np.ndarray,
+        centroids: Optional[np.ndarray] = None,
+        assign: Optional[np.ndarray] = None,
+    ):
+        self.meta = meta
+        self.catalog_version: int = meta["catalog_version"]
+        self.embedder_name: str = meta["embedder"]
+        self.ids: List[int] = meta["ids"]
+        self.vectors = vectors
+        self.centroids = centroids
+        self.assign = assign
+        if assign is not None:
+            # クラスタごとの行の一覧（転置リスト）: rows[bounds[c]:bounds[c + 1]] がクラスタ c の行
+            self._list_rows = np.argsort(assign, kind="stable")
+            self._list_bounds = np.searchsorted(assign[self._list_rows], np.arange(len(centroids) + 1))
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    @property
+    def uses_ivf(self) -> bool:
+        return self.centroids is not None
+
+    def _probe(self, query: np.ndarray, probes: int) -> np.ndarray:
+        """query に近いクラスタを probes 個選ぶ"""
+        probes = min(probes or max(1, len(self.centroids) // 8), len(self.centroids))
+        return np.argpartition(-(self.centroids @ query), probes - 1)[:probes]
+
+    def search(
+        self,
+        query: np.ndarray,
+        k: int,
+        candidates: Optional[Sequence[int]] = None,
+        probes: int = RETRIEVAL_IVF_PROBES,
+        exact: bool = False,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        コサイン類似度の上位k件を (カタログ上の位置, 類似度) で返す（類似度降順、同点はカタログ順）
+        candidates を渡した場合はその中から選ぶ。IVF では近いクラスタの行だけを調べ、k件に満たない場合は全件を調べる
+        """
+        rows = np.arange(len(self), dtype=np.int64) if candidates is None else np.asarray(candidates, dtype=np.int64)
+        if self.uses_ivf and not exact and len(rows) > k:
+            probed = self._probe(query, probes)
+            if candidates is None:
+                narrowed = np.concatenate([self._list_rows[self._list_bounds[c]:self._list_bounds[c + 1]] for c in probed])
+            else:
+                narrowed = rows[np.isin(self.assign[rows], probed)]
+            if len(narrowed) >= k:
+                rows = narrowed
+        similarity = np.asarray(self.vectors[rows]) @ query
+        if len(rows) > k:
+            part = np.argpartition(-similarity, k - 1)[:k]
+            rows, similarity = rows[part], similarity[part]
+        order = np.lexsort((rows, -similarity))
+        return rows[order], similarity[order]
+
+
+def _read_meta(directory: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(directory, META_FILE), "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    return meta if meta.get("format") == INDEX_FORMAT_VERSION else None
+
+
+def load_vector_index(directory: str = RETRIEVAL_INDEX_DIR) -> Optional[VectorIndex]:
+    """保存済みの索引を開く（無い場合は None）"""
+    meta = _read_meta(directory)
+    if meta is None:
+        return None
+    vectors = np.load(os.path.join(directory, meta["vectors_file"]), mmap_mode="r")
+    centroids = assign = None
+    if meta.get("ivf"):
+        centroids = np.load(os.path.join(directory, meta["ivf"]["centroids_file"]))
+        assign = np.load(os.path.join(directory, meta["ivf"]["assign_file"]))
+    return VectorIndex(meta, vectors, centroids, assign)
+
+
+# ====================================================================
+# 索引の構築（差分更新）
+# ====================================================================
+@dataclass
+class IndexBuildReport:
+    rows: int = 0
+    embedded: int = 0 # 埋め込みを計算した行数（内容が変わった・追加された行）
+    reused: int = 0 # 前回の索引から再利用した行数
+    ivf_lists: int = 0 # IVF のクラスタ数（使わない場合は 0）
+    ivf_trained: bool = False # クラスタを学習し直したか（False の場合は前回のクラスタに追加・変更分だけ割り当てた）
+    unchanged: bool = False # 索引が既に最新で、何も書き込まなかった
+    elapsed_seconds: float = 0.0
+
+
+def _assign_to_centroids(vectors: np.ndarray, centroids: np.ndarray, chunk_rows: int = 8192) -> np.ndarray:
+    """各行を最も近いクラスタに割り当てる（大きな行列を作らないよう分割して計算する）"""
+    assign = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk_rows):
+        assign[start:start + chunk_rows] = np.argmax(np.asarray(vectors[start:start + chunk_rows]) @ centroids.T, axis=1)
+    return assign
+
+
+def _train_ivf(vectors: np.ndarray, n_lists: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """球面 k-means でクラスタの中心を求める（最大 n_lists × 64 行の標本で学習。同じ入力には同じ結果を返す）"""
+    rng = np.random.default_rng(seed)
+    sample_size = min(len(vectors), n_lists * 64)
+    sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))])
+    centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+    for _ in range(iterations):
+        assign = _assign_to_centroids(sample, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        counts = np.bincount(assign, minlength=n_lists)
+        # 空になったクラスタは前回の中心のまま残す
+        centroids = np.where(counts[:, None] > 0, _normalize(sums), centroids)
+    return centroids
+
+
+def _save_array(directory: str, name: str, array: np.ndarray) -> str:
+    """一時ファイルに書き込んでから置き換える（読み込み中の他のプロセスに途中のファイルを見せない）"""
+    temp = os.path.join(directory, f".{name}.{os.getpid()}.tmp")
+    with open(temp, "wb") as f:
+        np.save(f, array)
+    os.replace(temp, os.path.join(directory, name))
+    return name
+
+
+def _remove_unused_files(directory: str, keep: Sequence[str]):
+    """この索引と直前の索引で使うファイル以外を削除する（memmap で開いたままのプロセスは削除後も読める）"""
+    for name in os.listdir(directory):
+        if name.endswith(".npy") and name not in keep:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def build_vector_index(
+    catalog: ScholarshipCatalog,
+    embedder: Optional[Embedder] = None,
+    directory: str = RETRIEVAL_INDEX_DIR,
+) -> IndexBuildReport:
+    """
+    カタログの索引をディスクに作成・更新する
+    前回の索引と埋め込みモデルが同じであれば、ID と内容のハッシュが一致する行のベクトルを再利用し、変更された行だけを埋め込む
+    IVF のクラスタも、変更が RETRIEVAL_IVF_RETRAIN_RATIO 以下であれば学習し直さずに変更分だけ割り当てる
+    """
+    started = time.perf_counter()
+    embedder = embedder or get_embedder()
+    os.makedirs(directory, exist_ok=True)
+    texts = [scholarship_text(sch) for sch in catalog.scholarships]
+    ids = [sch.id for sch in catalog.scholarships]
+    hashes = [_content_hash(text) for text in texts]
+    report = IndexBuildReport(rows=len(ids))
+
+    previous = _read_meta(directory)
+    if previous is not None and (previous["embedder"] != embedder.name or previous["dim"] != embedder.dim):
+        previous = None # 埋め込みモデルが変わった場合は全件を埋め込み直す
+    if previous is not None and previous["ids"] == ids and previous["hashes"] == hashes:
+        if previous["catalog_version"] != catalog.version:
+            # 内容が同じであればベクトルはそのまま使い、バージョンだけを更新する
+            previous["catalog_version"] = catalog.version
+            _write_meta(directory, previous)
+        report.reused = len(ids)
+        report.ivf_lists = previous["ivf"]["lists"] if previous.get("ivf") else 0
+        report.unchanged = True
+        report.elapsed_seconds = time.perf_counter() - started
+        return report
+
+    # 前回の索引から、ID と内容が同じ行のベクトル（とクラスタの割り当て）を引き継ぐ
+    vectors = np.zeros((len(ids), embedder.dim), dtype=np.float32)
+    reused_rows: List[int] = []
+    previous_rows: List[int] = []
+    old = None
+    if previous is not None:
+        old = load_vector_index(directory)
+        old_row = {key: row for row, key in enumerate(zip(previous["ids"], previous["hashes"]))}
+        for row, key in enumerate(zip(ids, hashes)):
+            source = old_row.get(key)
+            if source is not None:
+                reused_rows.append(row)
+                previous_rows.append(source)
+        if reused_rows:
+            vectors[reused_rows] = old.vectors[previous_rows]
+    reused = set(reused_rows)
+    changed_rows = [row for row in range(len(ids)) if row not in reused]
+    if changed_rows:
+        vectors[changed_rows] = embedder.embed([texts[row] for row in changed_rows])
+    report.reused = len(reused_rows)
+    report.embedded = len(changed_rows)
+
+    # ファイル名に内容のハッシュを含め、読み込み中の他のプロセスが使うファイルを上書きしない
+    generation = hashlib.sha1("".join(hashes).encode("utf-8") + embedder.name.encode("utf-8")).hexdigest()[:12]
+    meta = {
+        "format": INDEX_FORMAT_VERSION,
+        "embedder": embedder.name,
+        "dim": embedder.dim,
+        "catalog_version": catalog.version,
+        "built_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "ids": ids,
+        "hashes": hashes,
+        "vectors_file": _save_array(directory, f"vectors-{generation}.npy", vectors),
+        "ivf": None,
+    }
+
+    if len(ids) >= RETRIEVAL_IVF_MIN_ROWS:
+        n_lists = RETRIEVAL_IVF_LISTS or max(1, int(np.sqrt(len(ids))))
+        if old is not None and old.uses_ivf and len(old.centroids) == n_lists and len(changed_rows) <= RETRIEVAL_IVF_RETRAIN_RATIO * len(ids):
+            centroids = old.centroids
+            assign = np.empty(len(ids), dtype=np.int32)
+            assign[reused_rows] = old.assign[previous_rows]
+            if changed_rows:
+                assign[changed_rows] = _assign_to_centroids(vectors[changed_rows], centroids)
+        else:
+            centroids = _train_ivf(vectors, n_lists)
+            assign = _assign_to_centroids(vectors, centroids)
+            report.ivf_trained = True
+        meta["ivf"] = {
+            "lists": n_lists,
+            "centroids_file": _save_array(directory, f"centroids-{generation}.npy", centroids),
+            "assign_file": _save_array(directory, f"assign-{generation}.npy", assign),
+        }
+        report.ivf_lists = n_lists
+
+    _write_meta(directory, meta)
+    keep = [meta["vectors_file"]] + ([meta["ivf"]["centroids_file"], meta["ivf"]["assign_file"]] if meta["ivf"] else [])
+    if previous is not None:
+        keep += [previous["vectors_file"]] + ([previous["ivf"]["centroids_file"], previous["ivf"]["assign_file"]] if previous.get("ivf") else [])
+    _remove_unused_files(directory, keep)
+
+    report.elapsed_seconds = time.perf_counter() - started
+    print(
+        f"--- ベクトル索引を更新しました: catalog version={catalog.version}, {report.rows} 件 "
+        f"(埋め込み {report.embedded} 件, 再利用 {report.reused} 件, IVF {report.ivf_lists or 'なし'}, "
+        f"{report.elapsed_seconds:.2f} 秒) ---"
+    )
+    return report
+
+
+def _write_meta(directory: str, meta: Dict):
+    # meta.json の置き換えで新しい索引に切り替わる（参照するファイルは先に書き込んでおく）
+    temp = os.path.join(directory, f".{META_FILE}.{os.getpid()}.tmp")
+    with open(temp, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(temp, os.path.join(directory, META_FILE))
+
+
+def refresh_vector_index(catalog: ScholarshipCatalog, directory: str = RETRIEVAL_INDEX_DIR) -> IndexBuildReport:
+    """
+    カタログの更新後に索引を差分更新する（seed・定期ジョブから、リクエストの処理とは別に呼び出す）
+    索引が既にこのバージョンのカタログで作られている場合は、内容のハッシュも計算せずに終える
+    """
+    embedder = get_embedder()
+    meta = _read_meta(directory)
+    if (
+        meta is not None and meta["catalog_version"] == catalog.version
+        and meta["embedder"] == embedder.name and meta["dim"] == embedder.dim
+    ):
+        return IndexBuildReport(rows=len(meta["ids"]), reused=len(meta["ids"]), unchanged=True)
+    return build_vector_index(catalog, embedder, directory)
+
+
+def _open_for_catalog(catalog: ScholarshipCatalog) -> VectorIndex:
+    index = load_vector_index()
+    if index is None or index.ids != [sch.id for sch in catalog.scholarships]:
+        # 索引がまだ作られていない、またはカタログの更新後に作り直される前
+        raise RuntimeError(
+            f"ベクトル索引がカタログ (version {catalog.version}) と一致しません "
+            "(python -m app.retrieval または定期ジョブ vector-index で更新してください)"
+        )
+    return index
+
+
+# 索引を開けなかったカタログのバージョンと、次にディスクを読み直す時刻
+_unavailable: Tuple[int, float] = (-1, 0.0)
+
+
+def get_vector_index(catalog: ScholarshipCatalog) -> VectorIndex:
+    """
+    カタログが更新されるまで同じ索引を使う。リクエストの処理中に索引は作らず、ディスク上の索引を開くだけにする
+    開けない場合は RuntimeError を送出し、RETRIEVAL_INDEX_RETRY_SECONDS の間は読み直さない
+    """
+    global _unavailable
+    version, retry_at = _unavailable
+    if version == catalog.version and time.monotonic() < retry_at:
+        raise RuntimeError(f"ベクトル索引がカタログ (version {catalog.version}) に対してまだ作られていません")
+    try:
+        return catalog.derived("vector_index", _open_for_catalog)
+    except RuntimeError:
+        _unavailable = (catalog.version, time.monotonic() + RETRIEVAL_INDEX_RETRY_SECONDS)
+        raise
+
+
+# ====================================================================
+# 候補の絞り込み
+# ====================================================================
+_query_cache: LRUCache = LRUCache(maxsize=RETRIEVAL_QUERY_CACHE_SIZE)
+_query_lock = threading.Lock()
+
+
+def embed_profile(profile: ProfileBase) -> np.ndarray:
+    """プロフィールの検索ベクトル（同じ検索文字列は使い回す。専攻などの組み合わせは少ないため、ほぼキャッシュから返る）"""
+    embedder = get_embedder()
+    key = (embedder.name, profile_text(profile))
+    with _query_lock:
+        vector = _query_cache.get(key)
+    if vector is None:
+        vector = embedder.embed([key[1]])[0]
+        with _query_lock:
+            _query_cache[key] = vector
+    return vector
+
+
+def retrieve_candidates(
+    catalog: ScholarshipCatalog,
+    profile: ProfileBase,
+    candidates: Sequence[int],
+    k: int = RETRIEVAL_SHORTLIST_SIZE,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    必須条件を満たす候補（カタログ上の位置）のうち、プロフィールとの類似度が高い上位k件を (位置, 類似度) で返す
+    候補がk件以下の場合は全件の類似度を返す
+    """
+    index = get_vector_index(catalog)
+    return index.search(embed_profile(profile), min(k, len(candidates)), candidates=candidates)
+
+
+if __name__ == "__main__":
+    # 例: python -m app.retrieval （seed と定期ジョブ vector-index でも更新される。索引が無い間はルールベースの順位で候補を選ぶ）
+    parser = argparse.ArgumentParser(description="奨学金のベクトル索引を作成・差分更新する")
+    parser.add_argument("--dir", default=RETRIEVAL_INDEX_DIR, help="索引の保存先")
+    parser.add_argument("--rebuild", action="store_true", help="保存済みの索引を使わずに全件を埋め込み直す")
+    args = parser.parse_args()
+    if args.rebuild and os.path.exists(os.path.join(args.dir, META_FILE)):
+        os.remove(os.path.join(args.dir, META_FILE))
+    with Session(get_engine()) as session:
+        build_vector_index(get_catalog(session), directory=args.dir)
@@ -1,39 +1,254 @@
-from sqlmodel import Session, select
-from .models import Profile, MatchResult
+import argparse
+import os
+import time
+from dataclasses import dataclass, field
+from sqlmodel import Session, select, delete, func, and_
+from .database import get_engine
+from .models import Profile, MatchResult, MatchJob, MatchBatch, GeminiResponseCache
+from .segments import SegmentRefreshReport, refresh_segment_rankings, SEGMENT_REFRESH_MINUTES
+from .catalog import get_catalog
+from .notifications import notify_results_ready
+from .retrieval import IndexBuildReport, refresh_vector_index, RETRIEVAL_ENABLED
 from datetime import datetime, timedelta
+from typing import TYPE_CHECKING, Any, Callable, Dict, List, Optional
 
-def delete_old_data_job(session: Session):
+if TYPE_CHECKING:
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", "90"))
+RETENTION_BATCH_SIZE = int(os.getenv("RETENTION_BATCH_SIZE", "5000"))
+
+
+@dataclass
+class RetentionStep:
+    """削除対象1種類。steps の順序が外部キー制約を満たす削除順になる"""
+    name: str
+    model: Any
+    condition: Callable[[datetime], Any] # 基準日時を受け取り WHERE 条件を返す
+    notify_profiles: bool = False # 削除した MatchResult のプロフィールに結果の更新を通知する（レスポンスキャッシュの破棄）
+
+
+@dataclass
+class RetentionReport:
+    dry_run: bool
+    deleted: Dict[str, int] = field(default_factory=dict)
+    elapsed_seconds: float = 0.0
+
+    @property
+    def total(self) -> int:
+        return sum(self.deleted.values())
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.total / self.elapsed_seconds if self.elapsed_seconds else 0.0
+
+
+def _old_profile_ids(cutoff: datetime):
+    return select(Profile.id).where(Profile.created_at < cutoff)
+
+
+def _profile_is_unreferenced():
+    # 削除中に新しい結果・ジョブが作られたプロフィールは、外部キー違反を避けるため残す
+    has_results = select(MatchResult.id).where(MatchResult.profile_id == Profile.id).exists()
+    has_jobs = select(MatchJob.id).where(MatchJob.profile_id == Profile.id).exists()
+    return and_(~has_results, ~has_jobs)
+
+
+def _batch_is_unreferenced():
+    has_profiles = select(Profile.id).where(Profile.batch_id == MatchBatch.id).exists()
+    has_jobs = select(MatchJob.id).where(MatchJob.batch_id == MatchBatch.id).exists()
+    return and_(~has_profiles, ~has_jobs)
+
+
+def _gemini_cache_expired():
+    # 有効期限はキャッシュ本体と同じ設定値を使う
+    # (gemini_cache は GEMINI_API_KEY を必須とする gemini_client を読み込むため、削除の実行時に読み込む)
+    from .gemini_cache import GEMINI_CACHE_TTL_SECONDS
+    return GeminiResponseCache.created_at < datetime.utcnow() - timedelta(seconds=GEMINI_CACHE_TTL_SECONDS)
+
+
+# 子テーブル -> 親テーブルの順に削除する
+RETENTION_STEPS: List[RetentionStep] = [
+    # 1. 締切から90日以上経過したMatchResult
+    RetentionStep("matchresult (締切経過)", MatchResult, lambda cutoff: MatchResult.deadline < cutoff, notify_profiles=True),
+    # 2. 削除対象のProfileに紐づくMatchResultとMatchJob
+    RetentionStep(
+        "matchresult (古いProfile)",
+        MatchResult,
+        lambda cutoff: MatchResult.profile_id.in_(_old_profile_ids(cutoff)),
+        notify_profiles=True,
+    ),
+    RetentionStep("matchjob", MatchJob, lambda cutoff: MatchJob.profile_id.in_(_old_profile_ids(cutoff))),
+    RetentionStep(
+        "matchjob (一括)",
+        MatchJob,
+        lambda cutoff: MatchJob.batch_id.in_(select(MatchBatch.id).where(MatchBatch.created_at < cutoff)),
+    ),
+    # 3. 90日以上経過したProfile と、プロフィールが無くなった一括マッチングのバッチ
+    RetentionStep("profile", Profile, lambda cutoff: and_(Profile.created_at < cutoff, _profile_is_unreferenced())),
+    RetentionStep("matchbatch", MatchBatch, lambda cutoff: and_(MatchBatch.created_at < cutoff, _batch_is_unreferenced())),
+    # 4. 有効期限切れのGemini応答キャッシュ
+    RetentionStep(
+        "geminiresponsecache",
+        GeminiResponseCache,
+        lambda cutoff: _gemini_cache_expired(),
+    ),
+]
+
+
+def _delete_in_batches(session: Session, step: RetentionStep, cutoff: datetime, batch_size: int, dry_run: bool) -> int:
+    """
+    DELETE ... WHERE pk IN (SELECT pk ... LIMIT n) をバッチごとにコミットしながら繰り返す
+    （行をPythonに読み込まず、ロックを長時間保持しない）
+    """
+    model = step.model
+    pk = list(model.__table__.primary_key.columns)[0]
+    condition = step.condition(cutoff)
+
+    if dry_run:
+        return session.exec(select(func.count()).select_from(model).where(condition)).one()
+
+    total = 0
+    while True:
+        batch_ids = select(pk).where(condition).limit(batch_size).scalar_subquery()
+        statement = delete(model).where(pk.in_(batch_ids))
+        if step.notify_profiles:
+            # 削除と同じトランザクションで通知する（コミット時に届く）
+            profile_ids = session.execute(statement.returning(MatchResult.profile_id)).scalars().all()
+            notify_results_ready(session, profile_ids)
+            deleted = len(profile_ids)
+        else:
+            deleted = session.execute(statement).rowcount
+        session.commit()
+        total += deleted
+        if deleted < batch_size:
+            return total
+
+
+def delete_old_data_job(session: Session, dry_run: bool = False, batch_size: int = RETENTION_BATCH_SIZE) -> RetentionReport:
     """
     90日以上経過したProfileとMatchResultを削除するジョブ
+    dry_run=True の場合は削除せず、対象件数のみを集計する（重複して数える場合があるため概算）
     """
-    print("--- [ジョブ実行] 90日経過したデータのクリーンアップを開始 ---")
-    
+    mode = "（ドライラン）" if dry_run else ""
+    print(f"--- [ジョブ実行] {RETENTION_DAYS}日経過したデータのクリーンアップを開始{mode} ---")
+
+    report = RetentionReport(dry_run=dry_run)
+    started = time.perf_counter()
+
     try:
         # 90日前の日付を計算
-        cutoff_date = datetime.utcnow() - timedelta(days=90)
-        
-        # 1. 古いMatchResultを削除
-        # (Profileを削除する前に、関連するMatchResultを削除する必要があります)
-        statement_matches = select(MatchResult).where(MatchResult.deadline < cutoff_date) # 締切日で判定 (例)
-        # または created_at を MatchResult に追加して判定
-        
-        old_matches = session.exec(statement_matches).all()
-        match_count = len(old_matches)
-        for match in old_matches:
-            session.delete(match)
-        
-        # 2. 古いProfileを削除
-        statement_profiles = select(Profile).where(Profile.created_at < cutoff_date)
-        old_profiles = session.exec(statement_profiles).all()
-        profile_count = len(old_profiles)
-        for profile in old_profiles:
-            session.delete(profile)
-            
-        # 変更をコミット
-        session.commit()
-        
-        print(f"--- [ジョブ完了] {profile_count} 件のProfile、{match_count} 件のMatchResultを削除しました ---")
+        cutoff_date = datetime.utcnow() - timedelta(days=RETENTION_DAYS)
+
+        for step in RETENTION_STEPS:
+            step_started = time.perf_counter()
+            count = _delete_in_batches(session, step, cutoff_date, batch_size, dry_run)
+            report.deleted[step.name] = report.deleted.get(step.name, 0) + count
+            step_elapsed = time.perf_counter() - step_started
+            rate = count / step_elapsed if step_elapsed else 0.0
+            print(f"    {step.name}: {count} 件 ({step_elapsed:.2f} 秒, {rate:.0f} 件/秒)")
+
+        report.elapsed_seconds = time.perf_counter() - started
+        print(
+            f"--- [ジョブ完了]{mode} 合計 {report.total} 件を{'削除対象として集計' if dry_run else '削除'}しました "
+            f"({report.elapsed_seconds:.2f} 秒, {report.rows_per_second:.0f} 件/秒) ---"
+        )
 
     except Exception as e:
         print(f"--- [ジョブエラー] データ削除中にエラーが発生しました: {e} ---")
-        session.rollback()
\ No newline at end of file
+        session.rollback()
+        report.elapsed_seconds = time.perf_counter() - started
+
+    return report
+
+
+def refresh_segments_job(session: Session, full: bool = False) -> Optional[SegmentRefreshReport]:
+    """
+    区分ごとの事前計算済みの順位を更新するジョブ
+    差分更新 (full=False) は数分おき、対象の区分の選び直しを含む全件更新 (full=True) は夜間に実行する
+    """
+    mode = "全件" if full else "差分"
+    try:
+        report = refresh_segment_rankings(session, full=full)
+        print(
+            f"--- [ジョブ完了] 区分別の順位を{mode}更新しました: 再計算 {report.targets} 件 "
+            f"(変化 {report.changed} 件, 削除 {report.deleted} 件, {report.elapsed_seconds:.2f} 秒) ---"
+        )
+        return report
+    except Exception as e:
+        print(f"--- [ジョブエラー] 区分別の順位の{mode}更新中にエラーが発生しました: {e} ---")
+        session.rollback()
+        return None
+
+
+def refresh_vector_index_job(session: Session) -> Optional[IndexBuildReport]:
+    """
+    カタログの更新をベクトル索引に反映するジョブ (RETRIEVAL_ENABLED の場合のみ)
+    索引の作成はリクエストの処理では行わないため、カタログのバージョンが上がった後にここで差分更新する
+    """
+    if not RETRIEVAL_ENABLED:
+        return None
+    try:
+        report = refresh_vector_index(get_catalog(session))
+        if not report.unchanged:
+            print(
+                f"--- [ジョブ完了] ベクトル索引を更新しました: {report.rows} 件 "
+                f"(埋め込み {report.embedded} 件, {report.elapsed_seconds:.2f} 秒) ---"
+            )
+        return report
+    except Exception as e:
+        print(f"--- [ジョブエラー] ベクトル索引の更新中にエラーが発生しました: {e} ---")
+        session.rollback()
+        return None
+
+
+# ====================================================================
+# 定期実行ジョブの登録
+# ====================================================================
+# 常駐するサーバーでは APScheduler から、サーバーレス環境では cron から /api/cron/{名前} で呼び出す
+SCHEDULED_JOBS: Dict[str, Callable[[Session], Any]] = {
+    "retention": delete_old_data_job,
+    "segments": lambda session: refresh_segments_job(session, full=False),
+    "segments-full": lambda session: refresh_segments_job(session, full=True),
+    "vector-index": refresh_vector_index_job,
+}
+
+
+def run_scheduled_job(name: str):
+    """
+    SCHEDULED_JOBS のジョブを実行し、ジョブの結果（レポート）を返す
+    (APSchedulerは別スレッドで動くため、ジョブごとに新しいセッションを開く)
+    """
+    with Session(get_engine()) as session:
+        return SCHEDULED_JOBS[name](session)
+
+
+def start_background_scheduler() -> "BackgroundScheduler":
+    """APScheduler にジョブを登録して開始する（サーバーレス環境では使わないため、APScheduler はここで読み込む）"""
+    from apscheduler.schedulers.background import BackgroundScheduler
+
+    scheduler = BackgroundScheduler()
+    # ジョブを登録（例: 毎日午前3時に実行）
+    scheduler.add_job(run_scheduled_job, 'cron', hour=3, minute=0, args=["retention"])
+    # 区分別の順位: 削除後に対象の区分を選び直して全件更新し、日中はカタログ更新・締切の期間の変化を差分で反映する
+    scheduler.add_job(run_scheduled_job, 'cron', hour=3, minute=30, args=["segments-full"])
+    scheduler.add_job(run_scheduled_job, 'interval', minutes=SEGMENT_REFRESH_MINUTES, args=["segments"])
+    if RETRIEVAL_ENABLED:
+        # 他のプロセス（seed など）によるカタログの更新を、区分別の順位と同じ間隔でベクトル索引に反映する
+        scheduler.add_job(run_scheduled_job, 'interval', minutes=SEGMENT_REFRESH_MINUTES, args=["vector-index"])
+    scheduler.start()
+    return scheduler
+
+
+if __name__ == "__main__":
+    # 例: python -m app.scheduler --dry-run / python -m app.scheduler --segments full
+    parser = argparse.ArgumentParser(description="古いデータの削除ジョブ")
+    parser.add_argument("--dry-run", action="store_true", help="削除せず対象件数のみを表示する")
+    parser.add_argument("--batch-size", type=int, default=RETENTION_BATCH_SIZE)
+    parser.add_argument("--segments", choices=["diff", "full"], help="削除の代わりに区分別の順位を更新する")
+    args = parser.parse_args()
+    with Session(get_engine()) as session:
+        if args.segments:
+            refresh_segments_job(session, full=args.segments == "full")
+        else:
+            delete_old_data_job(session, dry_run=args.dry_run, batch_size=args.batch_size)
@@ -1,11 +1,12 @@
 from pydantic import BaseModel, Field
 from typing import List, Optional
 from datetime import datetime
+from .models import ProfileBase
 
 # Gemini APIに「この形式で出力して」と指示するためのPydanticモデル
 
 class MatchResultSchema(BaseModel):
-    """Gemini APIが出力すべき単一の奨学金マッチング結果"""
+    """単一の奨学金マッチング結果（Geminiの応答をカタログの情報で補完したもの）"""
     rank: int = Field(..., description="1から5のランキング順位")
     score: float = Field(..., description="適合度スコア (0.0〜1.0)")
     name: str = Field(..., description="奨学金の正式名称")
@@ -17,8 +18,32 @@ class MatchResultSchema(BaseModel):
     difficulty: str = Field(..., description="Easy, Medium, Hardのいずれか")
     url: str = Field(..., description="奨学金の公式URL")
     todo: List[str] = Field(..., description="申請実行の第一歩となる具体的なアクションリスト（3つ程度）")
+    scholarship_id: Optional[int] = Field(None, description="カタログと照合済みの奨学金ID")
 
 class MatchResponseSchema(BaseModel):
     """APIの最終的なレスポンス構造"""
     results: List[MatchResultSchema] = Field(..., description="最適な奨学金TOP5のリスト")
-    digest: str = Field(..., description="TOP5全体を要約した、ユーザーへの励ましのメッセージ（50字以内）")
\ No newline at end of file
+    digest: str = Field(..., description="TOP5全体を要約した、ユーザーへの励ましのメッセージ（50字以内）")
+
+# --------------------------------------------------------------------
+# Gemini APIの出力形式（奨学金はプロンプト内のIDで指定し、名称・締切・URLなどはカタログから補完する）
+# --------------------------------------------------------------------
+class GeminiMatchItemSchema(BaseModel):
+    """Gemini APIが出力すべき単一の奨学金マッチング結果"""
+    scholarship_id: str = Field(..., description="奨学金データベースの id 列の値 (例: S12)")
+    rank: int = Field(..., description="1から5のランキング順位")
+    score: float = Field(..., description="適合度スコア (0.0〜1.0)")
+    why_match: str = Field(..., description="この奨学金がユーザーに最適な理由を優しく具体的に説明（100字程度）")
+    todo: List[str] = Field(..., description="申請実行の第一歩となる具体的なアクションリスト（3つ程度）")
+
+class GeminiMatchResponseSchema(BaseModel):
+    """Gemini APIの応答構造"""
+    results: List[GeminiMatchItemSchema] = Field(..., description="最適な奨学金TOP5のリスト")
+    digest: str = Field(..., description="TOP5全体を要約した、ユーザーへの励ましのメッセージ（50字以内）")
+
+# --------------------------------------------------------------------
+# 一括マッチングAPIの入力
+# --------------------------------------------------------------------
+class MatchBatchRequest(BaseModel):
+    """学校などが複数の生徒のプロフィールをまとめて送るためのリクエスト"""
+    profiles: List[ProfileBase] = Field(..., min_length=1, description="マッチング対象のプロフィールのリスト")
@@ -0,0 +1,46 @@
+from dataclasses import dataclass
+from datetime import date, datetime, time, timezone
+
+
+def to_utc(value: datetime) -> datetime:
+    """タイムゾーン無しの日時はUTCとみなし、タイムゾーン付きのUTCに揃える"""
+    if value.tzinfo is None:
+        return value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc)
+
+
+def to_db_utc(value: datetime) -> datetime:
+    """DBの timestamp 列（タイムゾーン無し、UTCで保存）に書き込む形にする"""
+    return to_utc(value).replace(tzinfo=None)
+
+
+# ====================================================================
+# 採点の基準時刻
+# ====================================================================
+@dataclass(frozen=True)
+class ScoringContext:
+    """
+    1回のマッチング（またはバッチ・事前計算）で共有する採点の基準時刻
+    as_of は UTC の日の始まりに丸めるため、同じ日のうちは同じプロフィールに同じスコア・順位を返す
+    """
+    as_of: datetime
+
+    def __post_init__(self):
+        day = to_utc(self.as_of).date()
+        object.__setattr__(self, "as_of", datetime.combine(day, time.min, tzinfo=timezone.utc))
+
+    @classmethod
+    def now(cls) -> "ScoringContext":
+        return cls(as_of=datetime.now(timezone.utc))
+
+    @classmethod
+    def for_day(cls, day: date) -> "ScoringContext":
+        return cls(as_of=datetime.combine(day, time.min, tzinfo=timezone.utc))
+
+    @property
+    def today(self) -> date:
+        """採点に使う日付 (UTC)"""
+        return self.as_of.date()
+
+    def days_until(self, deadline: date) -> int:
+        return (deadline - self.today).days
@@ -1,46 +1,219 @@
+import argparse
 import json
 import os
+import time
 from datetime import datetime
-from sqlmodel import Session, SQLModel, create_engine
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from pydantic import ValidationError
+from sqlalchemy import literal_column, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlmodel import Session, SQLModel
 from .models import Scholarship
-from .database import DATABASE_URL # DB接続情報を流用
+from .income import parse_income_requirement
+from .scoring_context import to_db_utc
+from .catalog import bump_catalog_version
+from .scheduler import refresh_segments_job, refresh_vector_index_job
+from .database import get_engine # 接続プールの設定を共有する
 
-# DBエンジンを初期化
-engine = create_engine(DATABASE_URL, echo=False)
+DEFAULT_DATA_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "scholarships.json")
+DEFAULT_BATCH_SIZE = 1000
+
+# 奨学金の自然キー（同じ名称・提供団体の奨学金は同一とみなす）
+NATURAL_KEY = ("name", "provider")
 
 def create_db_and_tables():
     """SQLModelの定義に基づきテーブルを作成（Alembicが既に行っているが、念のため）"""
-    SQLModel.metadata.create_all(engine)
+    SQLModel.metadata.create_all(get_engine())
+
+# ====================================================================
+# カタログファイルの逐次読み込み
+# ====================================================================
+def iter_catalog_records(path: str, read_size: int = 1 << 20) -> Iterator[Dict[str, Any]]:
+    """
+    カタログファイルを1件ずつ読み込む（ファイル全体をメモリに載せない）
+    対応形式: JSON配列 (.json) / 1行1件のJSON Lines (.jsonl)
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            for line in f:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+            return
+
+        decoder = json.JSONDecoder()
+        buffer = ""
+        pos = 0
+        started = False
+        eof = False
+        while True:
+            # 空白を読み飛ばし、バッファを使い切ったら続きを読み込む
+            while pos < len(buffer) and buffer[pos] in " \t\r\n":
+                pos += 1
+            if pos >= len(buffer):
+                if eof:
+                    raise ValueError(f"{path} のJSON配列が途中で終わっています。")
+                chunk = f.read(read_size)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+
+            if not started:
+                if buffer[pos] != "[":
+                    raise ValueError(f"{path} はJSON配列ではありません。")
+                pos += 1
+                started = True
+                continue
+            if buffer[pos] == ",":
+                pos += 1
+                continue
+            if buffer[pos] == "]":
+                return
+
+            try:
+                record, end = decoder.raw_decode(buffer, pos)
+            except json.JSONDecodeError:
+                # 要素の途中でバッファが切れている場合は続きを読み込む
+                if eof:
+                    raise
+                chunk = f.read(read_size)
+                eof = not chunk
+                buffer, pos = buffer[pos:] + chunk, 0
+                continue
+            yield record
+            pos = end
+
+
+def _batched(records: Iterator[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    batch: List[Dict[str, Any]] = []
+    for record in records:
+        batch.append(record)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def prepare_record(item: Dict[str, Any], loaded_at: datetime) -> Dict[str, Any]:
+    """1件の入力データを検証し、scholarship テーブルの列の辞書に変換する"""
+    item = dict(item)
+    # deadlineを文字列からdatetimeオブジェクトに変換
+    # ZはUTCを示すため、Pythonのdatetime.fromisoformatで処理できるように変換
+    if isinstance(item.get('deadline'), str):
+        item['deadline'] = datetime.fromisoformat(item['deadline'].replace('Z', '+00:00'))
+    # DBの timestamp 列にはUTCのタイムゾーン無しで保存する（接続のタイムゾーン設定による変換を避ける）
+    if isinstance(item.get('deadline'), datetime):
+        item['deadline'] = to_db_utc(item['deadline'])
+
+    # 年収条件を数値範囲に解析して保存（リクエスト毎の文字列解析を不要にする）
+    income_range = parse_income_requirement(item.get('income_requirement'))
+    if income_range is not None:
+        item['income_min'], item['income_max'] = income_range
+
+    # 今回の取り込みで確認済みであることを記録（取り込み対象外になった奨学金の判定に使う）
+    item['last_checked'] = loaded_at
+
+    scholarship = Scholarship.model_validate(item)
+    return scholarship.model_dump(exclude={'id'})
+
 
-def seed_data():
-    """scholarships.jsonからデータを読み込み、DBに投入する"""
+# ====================================================================
+# 一括アップサート
+# ====================================================================
+def upsert_scholarships(session: Session, rows: List[Dict[str, Any]]) -> Tuple[int, int]:
+    """
+    INSERT ... ON CONFLICT (name, provider) DO UPDATE で複数行をまとめて登録する
+    戻り値: (新規登録件数, 更新件数)
+    """
+    # 同じ文で同じキーを2回更新できないため、バッチ内の重複は後勝ちで除く
+    deduped = {tuple(row[key] for key in NATURAL_KEY): row for row in rows}
+    table = Scholarship.__table__
+    stmt = pg_insert(table).values(list(deduped.values()))
+    update_columns = {
+        column.name: stmt.excluded[column.name]
+        for column in table.columns
+        if column.name not in ("id", *NATURAL_KEY)
+    }
+    stmt = stmt.on_conflict_do_update(
+        index_elements=list(NATURAL_KEY),
+        set_=update_columns,
+    ).returning(literal_column("(xmax = 0)").label("inserted"))
+
+    flags = session.execute(stmt).scalars().all()
+    inserted = sum(1 for flag in flags if flag)
+    return inserted, len(flags) - inserted
+
+
+def unpublish_missing(session: Session, loaded_at: datetime) -> int:
+    """今回の取り込みに含まれなかった公開中の奨学金を非公開にする"""
+    result = session.execute(
+        update(Scholarship)
+        .where(Scholarship.is_published == True)
+        .where(Scholarship.last_checked < loaded_at)
+        .values(is_published=False)
+    )
+    return result.rowcount
+
+
+def seed_data(
+    data_path: Optional[str] = None,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    partial: bool = False,
+):
+    """
+    カタログファイルからデータを読み込み、DBにアップサートする（何度実行しても重複しない）
+    partial=False の場合、ファイルに含まれない奨学金は is_published = False にする
+    全件を1トランザクションで反映するため、稼働中のAPIには完了時点で一度に切り替わって見える
+    """
     print("--- データの投入を開始します ---")
-    
+
     # data/scholarships.json へのパスを構築
-    data_path = os.path.join(os.path.dirname(__file__), "..", "data", "scholarships.json")
-    
-    try:
-        with open(data_path, "r", encoding="utf-8") as f:
-            scholarship_data = json.load(f)
-    except FileNotFoundError:
+    data_path = data_path or DEFAULT_DATA_PATH
+    if not os.path.exists(data_path):
         print(f"エラー: {data_path} が見つかりません。先にダミーデータを作成してください。")
         return
-    
-    with Session(engine) as session:
-        count = 0
-        for item in scholarship_data:
-            # deadlineを文字列からdatetimeオブジェクトに変換
-            # ZはUTCを示すため、Pythonのdatetime.fromisoformatで処理できるように変換
-            item['deadline'] = datetime.fromisoformat(item['deadline'].replace('Z', '+00:00'))
-            
-            # Scholarshipオブジェクトを作成し、DBに追加
-            scholarship = Scholarship.model_validate(item)
-            session.add(scholarship)
-            count += 1
-        
-        session.commit()
-        print(f"成功: {count} 件の奨学金データをデータベースに投入しました。")
+
+    started = time.perf_counter()
+    loaded_at = datetime.utcnow()
+    inserted = updated = invalid = 0
+
+    with Session(get_engine()) as session:
+        for batch in _batched(iter_catalog_records(data_path), batch_size):
+            rows = []
+            for item in batch:
+                try:
+                    rows.append(prepare_record(item, loaded_at))
+                except (ValidationError, ValueError, TypeError, KeyError) as e:
+                    invalid += 1
+                    print(f"警告: 不正なデータをスキップしました ({item.get('name')}): {e}")
+            if rows:
+                batch_inserted, batch_updated = upsert_scholarships(session, rows)
+                inserted += batch_inserted
+                updated += batch_updated
+
+        unpublished = 0 if partial else unpublish_missing(session, loaded_at)
+
+        # バージョンを上げてコミットし、稼働中のプロセスにカタログの再読み込みを促す
+        version = bump_catalog_version(session)
+
+        # 新しいカタログでベクトル索引を差分更新する（リクエストの処理中には作らないため、ここで作っておく）
+        refresh_vector_index_job(session)
+
+        # 区分別の事前計算済みの順位を、新しいカタログで差分更新する
+        refresh_segments_job(session)
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"成功: 新規 {inserted} 件、更新 {updated} 件、非公開化 {unpublished} 件、"
+        f"スキップ {invalid} 件 ({elapsed:.2f} 秒, カタログバージョン {version})"
+    )
 
 if __name__ == "__main__":
     # create_db_and_tables() # Alembicを使ったのでコメントアウト
-    seed_data()
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="奨学金カタログの取り込み")
+    parser.add_argument("path", nargs="?", default=DEFAULT_DATA_PATH, help="JSON配列 または JSON Lines のファイル")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--partial", action="store_true", help="ファイルに無い奨学金を非公開にしない（差分取り込み）")
+    args = parser.parse_args()
+    seed_data(args.path, args.batch_size, args.partial)
@@ -0,0 +1,260 @@
+import os
+import time
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlmodel import Session, select, delete
+
+from .models import Profile, ProfileBase, SegmentRanking
+from .catalog import CompiledScholarship, ScholarshipCatalog, get_catalog
+from .batch_scoring import get_batch_scorer, DEADLINE_WINDOW_DAYS
+from .eligibility_index import get_eligibility_index
+from .prompt_builder import GEMINI_PROMPT_MAX_CANDIDATES
+from .scoring_context import ScoringContext
+
+# "1" の場合、フェイルセーフとプロンプト候補の選定で事前計算済みの順位を使う
+SEGMENT_RANKINGS_ENABLED = os.getenv("SEGMENT_RANKINGS_ENABLED", "1") == "1"
+# 区分ごとに保存する順位の件数（プロンプトの候補数の上限と同じにしておくと、候補の選定にもそのまま使える）
+SEGMENT_RANKING_SIZE = int(os.getenv("SEGMENT_RANKING_SIZE", str(GEMINI_PROMPT_MAX_CANDIDATES)))
+# 直近 SEGMENT_LOOKBACK_DAYS 日に SEGMENT_MIN_PROFILES 件以上現れた区分を、多い順に最大 SEGMENT_MAX_COUNT 件まで事前計算する
+SEGMENT_LOOKBACK_DAYS = int(os.getenv("SEGMENT_LOOKBACK_DAYS", "30"))
+SEGMENT_MIN_PROFILES = int(os.getenv("SEGMENT_MIN_PROFILES", "5"))
+SEGMENT_MAX_COUNT = int(os.getenv("SEGMENT_MAX_COUNT", "1000"))
+# 差分更新の実行間隔（分）
+SEGMENT_REFRESH_MINUTES = int(os.getenv("SEGMENT_REFRESH_MINUTES", "10"))
+# 1回の INSERT に含める区分の件数
+SEGMENT_WRITE_CHUNK_ROWS = 500
+
+# スコアを決めるプロフィールの項目（区分のキー）
+SEGMENT_COLUMNS = ("grade", "prefecture", "income_band", "major", "has_social_care")
+SegmentKey = Tuple[str, str, str, str, bool]
+
+
+def segment_key(profile: ProfileBase) -> SegmentKey:
+    return (profile.grade, profile.prefecture, profile.income_band, profile.major, bool(profile.has_social_care))
+
+
+def _segment_profile(key: SegmentKey) -> ProfileBase:
+    """区分の代表として採点に使うプロフィール（スコアに関係しない項目は空）"""
+    return ProfileBase(**dict(zip(SEGMENT_COLUMNS, key)), target_period="")
+
+
+def _positions_by_id(catalog: ScholarshipCatalog) -> Dict[int, int]:
+    return catalog.derived("positions_by_id", lambda c: {sch.id: pos for pos, sch in enumerate(c.scholarships)})
+
+
+# ====================================================================
+# 区分1件の採点
+# ====================================================================
+@dataclass
+class RankedSegment:
+    positions: List[int] # カタログ上の位置（スコア降順・締切昇順）
+    scores: List[float]
+    eligible_count: int
+    valid_until: Optional[date]
+
+
+def _next_deadline_boundary(catalog: ScholarshipCatalog, candidates: Sequence[int], today: date) -> Optional[date]:
+    """
+    候補のいずれかが締切ボーナスの対象に入る日（締切の30日前）または外れる日（締切日）のうち、
+    today より後で最も早い日を返す。その日までは同じ順位のまま使える
+    """
+    if not len(candidates):
+        return None
+    deadline_day = get_batch_scorer(catalog).deadline_day[np.asarray(candidates, dtype=np.int64)]
+    boundaries = np.concatenate([deadline_day - DEADLINE_WINDOW_DAYS, deadline_day])
+    upcoming = boundaries[boundaries > today.toordinal()]
+    if upcoming.size == 0:
+        return None
+    return date.fromordinal(int(upcoming.min()))
+
+
+def rank_segment(
+    catalog: ScholarshipCatalog,
+    key: SegmentKey,
+    context: ScoringContext,
+    k: int = SEGMENT_RANKING_SIZE,
+) -> RankedSegment:
+    """区分の上位k件を rank_scholarships と同じ規則（calculate_score と同じスコア、同点は締切順）で求める"""
+    profile = _segment_profile(key)
+    scorer = get_batch_scorer(catalog)
+    candidates = get_eligibility_index(catalog).candidates(profile)
+    scores = scorer.score(profile, context, indices=candidates)
+    top = scorer.top_k(scores, k, indices=candidates).tolist()
+    score_by_row = dict(zip(candidates, scores.tolist()))
+    return RankedSegment(
+        positions=top,
+        scores=[score_by_row[pos] for pos in top],
+        eligible_count=int(np.count_nonzero(scores > 0)),
+        valid_until=_next_deadline_boundary(catalog, candidates, context.today),
+    )
+
+
+# ====================================================================
+# 事前計算済みの順位の参照（1回のインデックス検索）
+# ====================================================================
+def _is_stale(row: SegmentRanking, catalog: ScholarshipCatalog, today: date) -> bool:
+    """カタログのバージョンが違う、または締切ボーナスの対象が入れ替わる日を過ぎた順位は使えない"""
+    return (
+        row.catalog_version != catalog.version
+        or row.as_of > today
+        or (row.valid_until is not None and today >= row.valid_until)
+    )
+
+
+def lookup_segment_ranking(
+    session: Session,
+    catalog: ScholarshipCatalog,
+    profile: ProfileBase,
+    k: int,
+    context: Optional[ScoringContext] = None,
+) -> Optional[List[Tuple[int, float]]]:
+    """
+    プロフィールの区分の上位k件を (カタログ上の位置, スコア) で返す
+    事前計算が無い・古い（カタログのバージョン違い、締切ボーナスの期間切れ）・件数が足りない場合は None
+    """
+    if not SEGMENT_RANKINGS_ENABLED:
+        return None
+    today = (context or ScoringContext.now()).today
+    key = segment_key(profile)
+    row = session.exec(
+        select(SegmentRanking).where(*(getattr(SegmentRanking, column) == value for column, value in zip(SEGMENT_COLUMNS, key)))
+    ).first()
+    if row is None or _is_stale(row, catalog, today):
+        return None
+    ids = row.scholarship_ids or []
+    # 保存件数より多く必要な場合は、必須条件を満たす全件が保存されているときだけ使える
+    if len(ids) < k and len(ids) < row.eligible_count:
+        return None
+
+    positions_by_id = _positions_by_id(catalog)
+    ranked = []
+    for scholarship_id, score in zip(ids[:k], row.scores[:k]):
+        position = positions_by_id.get(scholarship_id)
+        if position is None:
+            return None # 同じバージョンであれば起こらないが、念のため通常の採点に戻す
+        ranked.append((position, score))
+    return ranked
+
+
+def ranked_scholarships_for(
+    session: Session,
+    catalog: ScholarshipCatalog,
+    profile: ProfileBase,
+    k: int = 5,
+    context: Optional[ScoringContext] = None,
+) -> Optional[List[Tuple[CompiledScholarship, float]]]:
+    """lookup_segment_ranking の結果を rank_scholarships と同じ (奨学金, スコア) の形で返す"""
+    ranked = lookup_segment_ranking(session, catalog, profile, k, context)
+    if ranked is None:
+        return None
+    return [(catalog.scholarships[position], score) for position, score in ranked]
+
+
+# ====================================================================
+# 事前計算（スケジューラーのジョブから呼び出される）
+# ====================================================================
+@dataclass
+class SegmentRefreshReport:
+    full: bool
+    targets: int = 0 # 再計算した区分の件数
+    changed: int = 0 # 順位が変わった区分の件数
+    deleted: int = 0 # 対象外になって削除した区分の件数
+    elapsed_seconds: float = 0.0
+
+
+def hot_segments(
+    session: Session,
+    since: datetime,
+    min_profiles: int = SEGMENT_MIN_PROFILES,
+    limit: int = SEGMENT_MAX_COUNT,
+) -> Dict[SegmentKey, int]:
+    """直近のプロフィールに多く現れる区分と、その件数を返す"""
+    columns = [getattr(Profile, column) for column in SEGMENT_COLUMNS]
+    count = func.count().label("profiles")
+    rows = session.exec(
+        select(*columns, count)
+        .where(Profile.created_at >= since)
+        .group_by(*columns)
+        .having(func.count() >= min_profiles)
+        .order_by(count.desc())
+        .limit(limit)
+    ).all()
+    return {tuple(row[:-1]): row[-1] for row in rows}
+
+
+def _write_rankings(session: Session, rows: List[Dict]):
+    """区分ごとの順位を複数行の INSERT ... ON CONFLICT DO UPDATE でまとめて保存する"""
+    table = SegmentRanking.__table__
+    for start in range(0, len(rows), SEGMENT_WRITE_CHUNK_ROWS):
+        stmt = pg_insert(table).values(rows[start:start + SEGMENT_WRITE_CHUNK_ROWS])
+        stmt = stmt.on_conflict_do_update(
+            constraint="uq_segmentranking_segment",
+            set_={
+                column.name: stmt.excluded[column.name]
+                for column in table.columns
+                if column.name not in ("id", *SEGMENT_COLUMNS)
+            },
+        )
+        session.execute(stmt)
+
+
+def refresh_segment_rankings(
+    session: Session,
+    full: bool = False,
+    context: Optional[ScoringContext] = None,
+) -> SegmentRefreshReport:
+    """
+    区分ごとの順位を更新する
+    - full=False (差分): カタログのバージョンが変わった区分と、締切ボーナスの対象が入れ替わる日を迎えた区分のみ再計算する
+    - full=True (夜間): 直近のプロフィールから対象の区分を選び直し、全て再計算する
+    """
+    started = time.perf_counter()
+    report = SegmentRefreshReport(full=full)
+    if context is None:
+        context = ScoringContext.now()
+    today = context.today
+    catalog = get_catalog(session)
+
+    existing: Dict[SegmentKey, SegmentRanking] = {
+        tuple(getattr(row, column) for column in SEGMENT_COLUMNS): row
+        for row in session.exec(select(SegmentRanking)).all()
+    }
+    if full:
+        targets = hot_segments(session, datetime.utcnow() - timedelta(days=SEGMENT_LOOKBACK_DAYS))
+        dropped = [row.id for key, row in existing.items() if key not in targets]
+        for start in range(0, len(dropped), SEGMENT_WRITE_CHUNK_ROWS):
+            session.execute(delete(SegmentRanking).where(SegmentRanking.id.in_(dropped[start:start + SEGMENT_WRITE_CHUNK_ROWS])))
+        report.deleted = len(dropped)
+    else:
+        targets = {key: row.profile_count for key, row in existing.items() if _is_stale(row, catalog, today)}
+
+    refreshed_at = datetime.utcnow()
+    rows = []
+    for key, profile_count in targets.items():
+        ranked = rank_segment(catalog, key, context)
+        scholarship_ids = [catalog.scholarships[pos].id for pos in ranked.positions]
+        previous = existing.get(key)
+        if previous is None or previous.scholarship_ids != scholarship_ids or previous.scores != ranked.scores:
+            report.changed += 1
+        rows.append({
+            **dict(zip(SEGMENT_COLUMNS, key)),
+            "scholarship_ids": scholarship_ids,
+            "scores": ranked.scores,
+            "eligible_count": ranked.eligible_count,
+            "catalog_version": catalog.version,
+            "as_of": today,
+            "valid_until": ranked.valid_until,
+            "profile_count": profile_count,
+            "refreshed_at": refreshed_at,
+        })
+    _write_rankings(session, rows)
+    session.commit()
+
+    report.targets = len(rows)
+    report.elapsed_seconds = time.perf_counter() - started
+    return report
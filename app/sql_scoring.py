@@ -0,0 +1,103 @@
+from typing import List, Optional, Tuple
+from sqlalchemy import Date, String, and_, case, cast, func, literal, or_
+from sqlalchemy.dialects.postgresql import ARRAY, DOUBLE_PRECISION, array
+from sqlalchemy.sql.elements import ColumnElement
+from sqlmodel import Session, select
+
+from .models import Profile, Scholarship
+from .catalog import CompiledScholarship
+from .income import parse_income_requirement
+from .matching_logic import WEIGHTS
+from .batch_scoring import BASE_SCORE, HIGH_AMOUNT_THRESHOLD, DEADLINE_WINDOW_DAYS
+from .scoring_context import ScoringContext
+
+# ====================================================================
+# calculate_score と同じルールをSQLの式で表す
+# (必須条件は WHERE、ボーナスは CASE の加算。GIN インデックスが使えるよう配列は @> と = で比較する)
+# ====================================================================
+
+
+def _float8(value: float) -> ColumnElement:
+    # numeric のまま加算すると丸めが Python の float と変わるため、double precision で計算する
+    return cast(literal(value), DOUBLE_PRECISION)
+
+
+def _contains(column, value: str) -> ColumnElement:
+    """配列の列が value を含む (column @> ARRAY[value])"""
+    return column.op("@>")(array([literal(value, String)]))
+
+
+def _empty_or_contains(column, value: str) -> ColumnElement:
+    """空の配列（または NULL）は全対象とみなす"""
+    return or_(_contains(column, value), column == literal([], ARRAY(String)), column.is_(None))
+
+
+def _income_condition(income_band: str) -> ColumnElement:
+    """
+    年収条件の必須チェック（get_income_score と同じ判定）
+    - 「条件なし」は文字列のまま（前後の空白も除かずに）比較する
+    - 年収バンドを解析できる場合は、取り込み時に解析済みの income_min / income_max で区間比較し、
+      解析できなかった条件 (income_min が NULL) のみ部分一致で判定する
+    - 年収バンドを解析できない場合は、「条件なし」以外は部分一致のみで判定する（上限なしの区間でも適合とはしない）
+    """
+    requirement = func.coalesce(Scholarship.income_requirement, "")
+    unrestricted = requirement == "条件なし"
+    substring = func.strpos(requirement, income_band) > 0
+    band = parse_income_requirement(income_band)
+    if band is None:
+        return or_(unrestricted, substring)
+
+    overlaps = and_(
+        Scholarship.income_min.is_not(None),
+        or_(Scholarship.income_max.is_(None), Scholarship.income_max > band.min),
+        Scholarship.income_min < band.max if band.max is not None else True,
+    )
+    return or_(unrestricted, overlaps, and_(Scholarship.income_min.is_(None), substring))
+
+
+def eligibility_conditions(profile: Profile) -> List[ColumnElement]:
+    """必須条件（学年・地域・年収）と公開中であること"""
+    return [
+        Scholarship.is_published == True,
+        _empty_or_contains(Scholarship.eligible_grades, profile.grade),
+        _empty_or_contains(Scholarship.eligible_prefs, profile.prefecture),
+        _income_condition(profile.income_band),
+    ]
+
+
+def score_expression(profile: Profile, context: ScoringContext) -> ColumnElement:
+    """必須条件を満たす行のスコア（calculate_score と同じ順序で double precision のまま加算する）"""
+    zero = _float8(0.0)
+    social_care = (
+        case((func.strpos(func.coalesce(Scholarship.other_requirements, ""), "経験者") > 0, _float8(WEIGHTS["SOCIAL_CARE"])), else_=zero)
+        if profile.has_social_care else zero
+    )
+    # fields が NULL の行は一致なしとして扱う（カタログの読み込み時と同じ）
+    major = case((_contains(func.coalesce(Scholarship.fields, literal([], ARRAY(String))), profile.major), _float8(WEIGHTS["MAJOR_MATCH"])), else_=zero)
+    # 締切は UTC のタイムゾーン無しで保存されているため、日付に変換すれば UTC の日付になる
+    days_to_deadline = cast(Scholarship.deadline, Date) - literal(context.today, Date)
+    deadline = case((days_to_deadline.between(1, DEADLINE_WINDOW_DAYS), _float8(WEIGHTS["DEADLINE_BONUS"])), else_=zero)
+    high_amount = case((Scholarship.amount_per_year >= HIGH_AMOUNT_THRESHOLD, _float8(WEIGHTS["HIGH_AMOUNT"])), else_=zero)
+    return func.least(_float8(BASE_SCORE) + social_care + major + deadline + high_amount, _float8(1.0))
+
+
+def rank_scholarships_sql(
+    session: Session,
+    profile: Profile,
+    k: int = 5,
+    context: Optional[ScoringContext] = None,
+) -> List[Tuple[CompiledScholarship, float]]:
+    """
+    rank_scholarships と同じ上位k件 (奨学金, スコア) を1回のクエリで求める
+    カタログをプロセスに読み込まず、DBからは上位k件の行だけを受け取る
+    """
+    context = context or ScoringContext.now()
+    score = score_expression(profile, context).label("score")
+    rows = session.exec(
+        select(Scholarship, score)
+        .where(*eligibility_conditions(profile))
+        # スコア降順・締切昇順（同点はカタログと同じID順）
+        .order_by(score.desc(), Scholarship.deadline, Scholarship.id)
+        .limit(k)
+    ).all()
+    return [(CompiledScholarship.from_model(sch), float(value)) for sch, value in rows]
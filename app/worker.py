@@ -0,0 +1,30 @@
+import argparse
+import asyncio
+import signal
+
+from .job_queue import MatchWorkerPool, MATCH_WORKER_CONCURRENCY
+from .gemini_client import close_client
+
+
+async def run_worker(concurrency: int):
+    """SIGINT/SIGTERM を受け取るまでマッチングジョブを処理し続ける"""
+    pool = MatchWorkerPool(concurrency=concurrency)
+    await pool.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    await stop.wait()
+    await pool.stop()
+    await close_client()
+
+
+if __name__ == "__main__":
+    # 例: python -m app.worker --concurrency 8
+    # (APIサーバー側は MATCH_WORKER_MODE=external を設定し、ワーカーを起動しないようにする)
+    parser = argparse.ArgumentParser(description="HOPE マッチングジョブのワーカー")
+    parser.add_argument("--concurrency", type=int, default=MATCH_WORKER_CONCURRENCY)
+    args = parser.parse_args()
+    asyncio.run(run_worker(args.concurrency))
@@ -0,0 +1,2 @@
+# マッチング・パイプラインのベンチマーク
+# 使い方: python -m benchmarks.run --help
@@ -0,0 +1,123 @@
+"""
+サーバーレスのエントリーポイント (api/index.py) のコールドスタートのベンチマーク
+
+    python -m benchmarks.cold_start --runs 5
+    python -m benchmarks.cold_start --importtime 15   # -X importtime で読み込みに時間がかかるモジュールの上位を表示する
+
+毎回新しいプロセスで api.index を読み込み、最初のリクエスト (/api/healthz) までの時間を計測する。
+- lazy: 現在の構成（Gemini SDK・DBエンジン・APScheduler は最初に使うときまで読み込まない）
+- eager: 読み込み直後に遅延している処理をすべて行った場合（最初のリクエストでGemini・DBを使う場合、または遅延させる前の構成に相当）
+"""
+import os
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# 読み込みに時間がかかり、遅延の対象にしているモジュール
+DEFERRED_MODULES = ("google.genai", "psycopg", "apscheduler")
+
+# 子プロセスで実行する計測用のスクリプト
+CHILD_SCRIPT = r"""
+import asyncio, json, sys, time
+started = time.perf_counter()
+import api.index
+imported = time.perf_counter()
+loaded = {name: name in sys.modules for name in MODULES}
+if EAGER:
+    from app.gemini_client import get_client
+    from app.database import get_engine, get_async_engine
+    import apscheduler.schedulers.background
+    get_client(); get_engine(); get_async_engine()
+ready = time.perf_counter()
+
+import httpx
+async def first_request():
+    transport = httpx.ASGITransport(app=api.index.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://cold-start") as client:
+        response = await client.get("/api/healthz")
+        response.raise_for_status()
+asyncio.run(first_request())
+finished = time.perf_counter()
+print(json.dumps({
+    "import_ms": (imported - started) * 1000,
+    "ready_ms": (ready - started) * 1000,
+    "first_request_ms": (finished - started) * 1000,
+    "loaded": loaded,
+}))
+"""
+
+
+def _child_env() -> Dict[str, str]:
+    env = dict(os.environ)
+    env.setdefault("GEMINI_API_KEY", "benchmark-dummy-key") # app.gemini_client のインポートに必要（通信はしない）
+    env["HOPE_SERVERLESS"] = "1"
+    env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    return env
+
+
+def measure_once(eager: bool) -> Dict:
+    script = f"MODULES = {DEFERRED_MODULES!r}\nEAGER = {eager!r}\n" + CHILD_SCRIPT
+    output = subprocess.run(
+        [sys.executable, "-c", script], cwd=ROOT, env=_child_env(),
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def import_profile(top: int) -> List[tuple]:
+    """-X importtime の累積時間（マイクロ秒）が大きいトップレベルのパッケージを返す"""
+    stderr = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import api.index"], cwd=ROOT, env=_child_env(),
+        capture_output=True, text=True, check=True,
+    ).stderr
+    totals: Dict[str, int] = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = (part.strip() for part in line[len("import time:"):].split("|"))
+        if not cumulative.isdigit():
+            continue
+        package = name.split(".")[0]
+        # 同じパッケージ内の入れ子の読み込みを重ねて数えないよう、最も大きい値（トップレベルの読み込み）を使う
+        totals[package] = max(totals.get(package, 0), int(cumulative))
+    return sorted(totals.items(), key=lambda item: item[1], reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="api/index.py のコールドスタートを計測する")
+    parser.add_argument("--runs", type=int, default=5, help="各構成で起動するプロセス数")
+    parser.add_argument("--importtime", type=int, default=0, help="読み込み時間の上位 N パッケージを表示する")
+    args = parser.parse_args()
+
+    measure_once(False) # .pyc を作成しておき、1回目だけバイトコードのコンパイル時間を含めないようにする
+    print(f"=== コールドスタート (各 {args.runs} 回の中央値, Python {sys.version.split()[0]}) ===")
+    medians = {}
+    for mode, eager in (("lazy", False), ("eager", True)):
+        runs = [measure_once(eager) for _ in range(args.runs)]
+        medians[mode] = {
+            key: statistics.median(run[key] for run in runs)
+            for key in ("import_ms", "ready_ms", "first_request_ms")
+        }
+        loaded = ", ".join(name for name, is_loaded in runs[0]["loaded"].items() if is_loaded) or "なし"
+        print(
+            f"  {mode:<5}  import {medians[mode]['import_ms']:7.1f} ms  "
+            f"初期化完了 {medians[mode]['ready_ms']:7.1f} ms  "
+            f"最初の応答 {medians[mode]['first_request_ms']:7.1f} ms  "
+            f"(import 時点で読み込み済み: {loaded})"
+        )
+    saved = medians["eager"]["first_request_ms"] - medians["lazy"]["first_request_ms"]
+    print(f"  最初の応答までの短縮: {saved:.1f} ms ({saved / medians['eager']['first_request_ms']:.0%})")
+
+    if args.importtime:
+        print(f"=== 読み込み時間の上位 {args.importtime} パッケージ (lazy) ===")
+        for package, micros in import_profile(args.importtime):
+            print(f"  {package:<24} {micros / 1000:7.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+import asyncio
+import random
+from contextlib import contextmanager
+from typing import Optional, Sequence
+
+from app.models import Profile
+from app.catalog import ScholarshipCatalog
+from app.schemas import MatchResponseSchema, GeminiMatchResponseSchema, GeminiMatchItemSchema
+from app.prompt_builder import build_prompt, expand_response, short_id
+
+
+class GeminiStub:
+    """
+    generate_match_results_gemini の代わりに使うローカルのスタブ
+    latency_ms ± jitter_ms の遅延の後、failure_rate の確率で例外、timeout_rate の確率で応答を返さない
+    プロンプトの組み立てと応答の補完は本物と同じ処理を通す（プロンプト先頭5件をTOP5として返す）
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 800.0,
+        jitter_ms: float = 200.0,
+        failure_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        seed: Optional[int] = None,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.failure_rate = failure_rate
+        self.timeout_rate = timeout_rate
+        self._rng = random.Random(seed)
+        self.calls = 0
+        self.prompt_chars = 0
+
+    async def __call__(
+        self,
+        profile: Profile,
+        catalog: ScholarshipCatalog,
+        positions: Sequence[int],
+    ) -> MatchResponseSchema:
+        self.calls += 1
+        self.prompt_chars += len(build_prompt(profile, catalog, positions))
+        roll = self._rng.random()
+        if roll < self.timeout_rate:
+            await asyncio.sleep(3600) # 呼び出し側のタイムアウトでキャンセルされる
+        delay = max(0.0, self.latency_ms + self._rng.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+        await asyncio.sleep(delay)
+        if roll < self.timeout_rate + self.failure_rate:
+            raise RuntimeError("GeminiStub: 擬似的なAPIエラー")
+
+        results = [
+            GeminiMatchItemSchema(
+                scholarship_id=short_id(position),
+                rank=rank,
+                score=0.9 - rank * 0.1,
+                why_match="ベンチマーク用のスタブ応答です。",
+                todo=["必要書類を確認する"],
+            )
+            for rank, position in enumerate(positions[:5], 1)
+        ]
+        return expand_response(GeminiMatchResponseSchema(results=results, digest="スタブ応答"), catalog, positions)
+
+
+@contextmanager
+def installed(stub: GeminiStub):
+    """アプリ内の Gemini 呼び出しを一時的にスタブへ差し替える"""
+    from app import gemini_cache
+    original = gemini_cache.generate_match_results_gemini
+    gemini_cache.generate_match_results_gemini = stub
+    try:
+        yield stub
+    finally:
+        gemini_cache.generate_match_results_gemini = original
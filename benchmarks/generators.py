@@ -0,0 +1,111 @@
+import random
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, List, Optional
+
+from app.models import Profile, GRADES, INCOME_BANDS, CATEGORIES, TYPES, DIFFICULTIES
+from app.catalog import CompiledScholarship, ScholarshipCatalog
+from app.income import parse_income_requirement
+
+PREFECTURES = [
+    "北海道", "青森県", "岩手県", "宮城県", "秋田県", "山形県", "福島県",
+    "茨城県", "栃木県", "群馬県", "埼玉県", "千葉県", "東京都", "神奈川県",
+    "新潟県", "富山県", "石川県", "福井県", "山梨県", "長野県", "岐阜県",
+    "静岡県", "愛知県", "三重県", "滋賀県", "京都府", "大阪府", "兵庫県",
+    "奈良県", "和歌山県", "鳥取県", "島根県", "岡山県", "広島県", "山口県",
+    "徳島県", "香川県", "愛媛県", "高知県", "福岡県", "佐賀県", "長崎県",
+    "熊本県", "大分県", "宮崎県", "鹿児島県", "沖縄県",
+]
+MAJORS = ["工学", "情報工学", "人文学", "社会科学", "理学", "医学", "看護", "教育", "芸術", "農学", "全分野"]
+INCOME_REQUIREMENTS = [
+    "条件なし", "世帯年収300万円未満", "世帯年収400万円未満", "世帯年収500万円以下",
+    "世帯年収800万円未満", "住民税非課税世帯",
+]
+OTHER_REQUIREMENTS = ["", "地方出身者", "社会的養護経験者", "成績優秀者"]
+DOCUMENTS = ["住民票", "所得証明書", "推薦書", "在学証明書", "成績証明書", "作文"]
+
+
+def generate_scholarships(n: int, seed: int = 0, now: Optional[datetime] = None) -> List[CompiledScholarship]:
+    """n件の合成奨学金データ（コンパイル済み）を生成する。同じ seed なら同じデータになる"""
+    rng = random.Random(seed)
+    now = now or datetime.now(timezone.utc)
+    scholarships = []
+    for i in range(1, n + 1):
+        record = {
+            "name": f"合成奨学金{i:07d}",
+            "provider": f"合成財団{rng.randrange(max(1, n // 20)):05d}",
+            "category": rng.choice(CATEGORIES),
+            "type": rng.choice(TYPES),
+            "amount_per_year": rng.choice([120000, 240000, 360000, 500000, 600000, 800000, 1200000]),
+            "period": rng.choice(["1年間", "4年間", "大学卒業まで"]),
+            "eligible_grades": rng.sample(GRADES, rng.choice([0, 1, 2, 2, 3])),
+            "eligible_prefs": rng.sample(PREFECTURES, rng.choice([0, 0, 0, 1, 3, 8])),
+            "fields": rng.sample(MAJORS, rng.choice([1, 1, 2, 3])),
+            "income_requirement": rng.choice(INCOME_REQUIREMENTS),
+            "other_requirements": rng.choice(OTHER_REQUIREMENTS),
+            "deadline": (now + timedelta(days=rng.randint(-30, 365))).replace(hour=0, minute=0, second=0, microsecond=0),
+            "required_docs": rng.sample(DOCUMENTS, rng.randint(1, 4)),
+            "application_method": rng.choice(["Web", "郵送"]),
+            "difficulty_hint": rng.choice(DIFFICULTIES),
+            "url": f"https://example.org/scholarships/{i}",
+        }
+        income_range = parse_income_requirement(record["income_requirement"])
+        scholarships.append(CompiledScholarship(
+            id=i,
+            name=record["name"],
+            provider=record["provider"],
+            category=record["category"],
+            type=record["type"],
+            amount_per_year=record["amount_per_year"],
+            period=record["period"],
+            eligible_grades=frozenset(record["eligible_grades"]),
+            eligible_prefs=frozenset(record["eligible_prefs"]),
+            fields=frozenset(record["fields"]),
+            income_requirement=record["income_requirement"],
+            income_range=income_range,
+            income_unrestricted=(record["income_requirement"] == "条件なし"),
+            other_requirements=record["other_requirements"],
+            deadline=record["deadline"],
+            deadline_date=record["deadline"].date(),
+            required_docs=tuple(record["required_docs"]),
+            difficulty_hint=record["difficulty_hint"],
+            url=record["url"],
+        ))
+    return scholarships
+
+
+def generate_catalog(n: int, seed: int = 0, version: int = 1) -> ScholarshipCatalog:
+    """合成データからプロセス内カタログを構築する"""
+    scholarships = tuple(generate_scholarships(n, seed))
+    return ScholarshipCatalog(
+        version=version,
+        loaded_at=0.0,
+        scholarships=scholarships,
+        by_id={sch.id: sch for sch in scholarships},
+    )
+
+
+def generate_profiles(n: int, seed: int = 1, duplicate_ratio: float = 0.0) -> Iterator[Profile]:
+    """
+    n件の合成プロフィールを生成する
+    duplicate_ratio の割合で、直前までに生成したプロフィールと同じ内容を再送する（キャッシュ評価用）
+    """
+    rng = random.Random(seed)
+    produced: List[Profile] = []
+    for i in range(1, n + 1):
+        if produced and rng.random() < duplicate_ratio:
+            base = rng.choice(produced)
+            profile = Profile.model_validate(base.model_dump(exclude={"id", "created_at"}))
+        else:
+            profile = Profile(
+                grade=rng.choice(GRADES),
+                prefecture=rng.choice(PREFECTURES),
+                income_band=rng.choice(INCOME_BANDS),
+                major=rng.choice(MAJORS),
+                has_social_care=rng.random() < 0.1,
+                target_period=rng.choice(["1年", "4年"]),
+                has_volunteer=rng.random() < 0.3,
+                has_cram=rng.random() < 0.4,
+            )
+            produced.append(profile)
+        profile.id = i
+        yield profile
@@ -0,0 +1,88 @@
+from dataclasses import dataclass, field
+from typing import List, Sequence
+
+from sqlmodel import Session, select, func
+
+from app.models import Profile, Scholarship
+from app.catalog import ScholarshipCatalog, load_catalog
+from app.matching_logic import calculate_score, rank_scholarships
+from app.sql_scoring import eligibility_conditions, rank_scholarships_sql
+from app.scoring_context import ScoringContext
+from app.batch_scoring import get_batch_scorer
+from app.eligibility_index import get_eligibility_index
+
+
+@dataclass
+class ParityReport:
+    checked: int = 0
+    mismatches: List[str] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.mismatches
+
+
+def check_parity(catalog: ScholarshipCatalog, profiles: Sequence[Profile], k: int = 5) -> ParityReport:
+    """
+    最適化した採点経路 (BatchScorer / EligibilityIndex) が calculate_score と同じ結果を返すか確認する
+    - スコアが全件で完全一致すること
+    - TOPk の順序（スコア降順・締切昇順・カタログ順）が一致すること
+    - 転置インデックスの候補が「スコア > 0」の奨学金と一致すること
+    """
+    scorer = get_batch_scorer(catalog)
+    index = get_eligibility_index(catalog)
+    scholarships = catalog.scholarships
+    context = ScoringContext.now() # 参照実装と同じ基準日で採点する
+    report = ParityReport()
+
+    matrix = scorer.score_matrix(profiles, context)
+    for profile, row in zip(profiles, matrix):
+        report.checked += 1
+        expected = [calculate_score(profile, sch, context) for sch in scholarships]
+        if expected != row.tolist():
+            diff = sum(1 for a, b in zip(expected, row.tolist()) if a != b)
+            report.mismatches.append(f"profile {profile.id}: スコア不一致 {diff} 件")
+            continue
+
+        ranked = sorted(
+            (i for i, score in enumerate(expected) if score > 0),
+            key=lambda i: (-expected[i], scholarships[i].deadline, i),
+        )[:k]
+        got = scorer.top_k(row, k).tolist()
+        if ranked != got:
+            report.mismatches.append(f"profile {profile.id}: TOP{k} 不一致 {ranked} != {got}")
+            continue
+
+        candidates = index.candidates(profile)
+        if candidates != [i for i, score in enumerate(expected) if score > 0]:
+            report.mismatches.append(f"profile {profile.id}: 候補集合の不一致")
+    return report
+
+
+def check_sql_parity(session: Session, profiles: Sequence[Profile], k: int = 5) -> ParityReport:
+    """
+    SQLでの採点 (sql_scoring) が、同じDBから読み込んだカタログでの rank_scholarships と一致するか確認する
+    - 必須条件を満たす奨学金の件数が転置インデックスの候補数と一致すること
+    - 上位k件の奨学金ID・順序・スコアが完全一致すること
+    (DATABASE_URL のDBに接続する。読み取りのみ)
+    """
+    catalog = load_catalog(session)
+    index = get_eligibility_index(catalog)
+    context = ScoringContext.now()
+    report = ParityReport()
+
+    for profile in profiles:
+        report.checked += 1
+        eligible = session.exec(
+            select(func.count()).select_from(Scholarship).where(*eligibility_conditions(profile))
+        ).one()
+        expected_eligible = len(index.candidates(profile))
+        if eligible != expected_eligible:
+            report.mismatches.append(f"profile {profile.id}: 必須条件の件数不一致 {expected_eligible} != {eligible}")
+            continue
+
+        expected = [(sch.id, score) for sch, score in rank_scholarships(catalog, profile, k, context)]
+        got = [(sch.id, score) for sch, score in rank_scholarships_sql(session, profile, k, context)]
+        if expected != got:
+            report.mismatches.append(f"profile {profile.id}: TOP{k} 不一致 {expected} != {got}")
+    return report
@@ -0,0 +1,406 @@
+"""
+マッチング・パイプラインのベンチマーク
+
+    python -m benchmarks.run --sizes 1000,10000,100000 --profiles 200
+    python -m benchmarks.run --save-baseline main      # 結果を benchmarks/baselines/main.json に保存
+    python -m benchmarks.run --compare main             # 保存した結果と比較し、劣化があれば終了コード1
+    python -m benchmarks.run --sizes 1000 --skip-pipeline --sql-parity  # DBでSQLでの採点との一致を確認する
+    python -m benchmarks.run --sizes 100000 --skip-pipeline --retrieval  # ベクトル索引の構築・検索を計測する
+"""
+import os
+os.environ.setdefault("GEMINI_API_KEY", "benchmark-dummy-key") # app.gemini_client のインポートに必要（通信はしない）
+
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, asdict, replace
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+from app.catalog import ScholarshipCatalog
+from app.matching_logic import calculate_score, rank_scholarships
+from app.batch_scoring import get_batch_scorer
+from app.eligibility_index import get_eligibility_index, eligible_scholarships
+from app.prompt_builder import build_prompt, select_prompt_candidates, estimate_tokens
+from app import gemini_cache
+from app.retrieval import HashingEmbedder, build_vector_index, load_vector_index, profile_text, RETRIEVAL_SHORTLIST_SIZE
+
+from .generators import generate_catalog, generate_profiles
+from .gemini_stub import GeminiStub, installed
+from .parity import check_parity, check_sql_parity
+
+BASELINE_DIR = os.path.join(os.path.dirname(__file__), "baselines")
+# calculate_score の単純ループは遅いため、このカタログ件数を超えたら省略する
+NAIVE_SCORE_MAX_SIZE = 100_000
+
+
+@dataclass
+class StageResult:
+    stage: str
+    size: int
+    calls: int
+    p50_ms: float
+    p99_ms: float
+    throughput: float # 1秒あたりの処理件数
+    peak_memory_mb: float
+
+    @property
+    def key(self) -> str:
+        return f"{self.stage}@{self.size}"
+
+
+def _percentile(samples: List[float], q: float) -> float:
+    if len(samples) == 1:
+        return samples[0]
+    return statistics.quantiles(samples, n=100, method="inclusive")[q - 1]
+
+
+def _peak_memory_mb(fn: Callable[[Any], Any], items: Sequence[Any]) -> float:
+    tracemalloc.start()
+    try:
+        for item in items:
+            fn(item)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / (1024 * 1024)
+
+
+def measure(stage: str, size: int, fn: Callable[[Any], Any], items: Sequence[Any], units: int = 1) -> StageResult:
+    """items の各要素で fn を呼び、1回ごとの所要時間とピークメモリを計測する"""
+    samples = []
+    started = time.perf_counter()
+    for item in items:
+        t0 = time.perf_counter()
+        fn(item)
+        samples.append((time.perf_counter() - t0) * 1000)
+    elapsed = time.perf_counter() - started
+    # tracemalloc は計測対象を遅くするため、時間計測とは別に数件だけ実行する
+    peak = _peak_memory_mb(fn, items[:3])
+    return StageResult(
+        stage=stage,
+        size=size,
+        calls=len(samples),
+        p50_ms=_percentile(samples, 50),
+        p99_ms=_percentile(samples, 99),
+        throughput=len(samples) * units / elapsed if elapsed else 0.0,
+        peak_memory_mb=peak,
+    )
+
+
+# ====================================================================
+# 各ステージ
+# ====================================================================
+def bench_catalog(catalog: ScholarshipCatalog, profiles: list) -> List[StageResult]:
+    size = len(catalog)
+    results = []
+
+    # 派生構造の構築（カタログ再読み込み時に1回だけ発生するコスト）
+    def build(_):
+        catalog._derived.clear()
+        get_batch_scorer(catalog)
+        get_eligibility_index(catalog)
+    results.append(measure("build_index", size, build, [None]))
+
+    if size <= NAIVE_SCORE_MAX_SIZE:
+        sample = profiles[: max(1, min(len(profiles), 2_000_000 // size))]
+        results.append(measure(
+            "calculate_score_loop", size,
+            lambda p: [calculate_score(p, sch) for sch in catalog.scholarships],
+            sample,
+        ))
+
+    results.append(measure("rank_scholarships", size, lambda p: rank_scholarships(catalog, p, 5), profiles))
+    results.append(measure("eligible_scholarships", size, lambda p: eligible_scholarships(catalog, p), profiles))
+
+    scorer = get_batch_scorer(catalog)
+    batch = max(1, min(len(profiles), 5_000_000 // size))
+    chunks = [profiles[i:i + batch] for i in range(0, len(profiles), batch)]
+    results.append(measure("score_matrix", size, lambda chunk: scorer.score_matrix(chunk), chunks, units=batch))
+
+    results.append(measure(
+        "build_prompt", size,
+        lambda p: build_prompt(p, catalog, select_prompt_candidates(catalog, p)),
+        profiles,
+    ))
+    prompt_tokens = [
+        estimate_tokens(build_prompt(p, catalog, select_prompt_candidates(catalog, p)))
+        for p in profiles[:20]
+    ]
+    print(f"    プロンプトの推定トークン数: 平均 {statistics.mean(prompt_tokens):.0f} / 最大 {max(prompt_tokens)}")
+    return results
+
+
+def bench_pipeline(
+    catalog: ScholarshipCatalog,
+    profiles: list,
+    stub: GeminiStub,
+    concurrency: int,
+    timeout: float,
+) -> StageResult:
+    """
+    Geminiをスタブに置き換え、キャッシュ・タイムアウト・フェイルセーフを含むマッチング1件の流れを並行実行する
+    (DBへの書き込みは含まない)
+    """
+    gemini_cache.response_cache.clear()
+    samples: List[float] = []
+
+    async def one(profile):
+        t0 = time.perf_counter()
+        positions = select_prompt_candidates(catalog, profile)
+        try:
+            if not positions:
+                raise ValueError("候補なし")
+            await asyncio.wait_for(
+                gemini_cache.cached_generate_match_results(profile, catalog, positions),
+                timeout=timeout,
+            )
+        except Exception:
+            rank_scholarships(catalog, profile, 5)
+        samples.append((time.perf_counter() - t0) * 1000)
+
+    async def main():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def limited(profile):
+            async with semaphore:
+                await one(profile)
+
+        await asyncio.gather(*(limited(p) for p in profiles))
+
+    tracemalloc.start()
+    started = time.perf_counter()
+    with installed(stub):
+        asyncio.run(main())
+    elapsed = time.perf_counter() - started
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return StageResult(
+        stage="pipeline_stub",
+        size=len(catalog),
+        calls=len(samples),
+        p50_ms=_percentile(samples, 50),
+        p99_ms=_percentile(samples, 99),
+        throughput=len(samples) / elapsed if elapsed else 0.0,
+        peak_memory_mb=peak / (1024 * 1024),
+    )
+
+
+def bench_endpoints(profiles: list, requests: int) -> List[StageResult]:
+    """
+    実際のDBに接続してAPIエンドポイントを計測する（DATABASE_URL が必要。データを書き込むため本番DBでは実行しないこと）
+    """
+    from fastapi.testclient import TestClient
+    from app.main import app
+
+    results = []
+    with TestClient(app) as client:
+        results.append(measure("GET /api/scholarships", 0, lambda _: client.get("/api/scholarships"), [None] * requests))
+        payloads = [p.model_dump(exclude={"id", "created_at"}) for p in profiles[:requests]]
+        results.append(measure("POST /api/profiles", 0, lambda body: client.post("/api/profiles", json=body), payloads))
+    return results
+
+
+def bench_retrieval(catalog: ScholarshipCatalog, profiles: list) -> List[StageResult]:
+    """
+    ベクトル索引の全件構築・差分更新（1%の奨学金を変更）と、全件検索・IVF の検索を計測する
+    IVF の結果のうち、全件検索の上位と同じ類似度以上のものの割合（一致率）も表示する。索引は一時ディレクトリに作成する
+    """
+    size = len(catalog)
+    embedder = HashingEmbedder()
+    changed = list(catalog.scholarships)
+    for i in range(0, size, 100):
+        changed[i] = replace(changed[i], name=changed[i].name + "（改定）")
+    updated = ScholarshipCatalog(
+        version=catalog.version + 1,
+        loaded_at=catalog.loaded_at,
+        scholarships=tuple(changed),
+        by_id={sch.id: sch for sch in changed},
+    )
+    queries = embedder.embed([profile_text(p) for p in profiles])
+    k = min(RETRIEVAL_SHORTLIST_SIZE, size)
+
+    with tempfile.TemporaryDirectory() as root:
+        results = [measure(
+            "vector_index_build", size,
+            lambda _: build_vector_index(catalog, embedder, tempfile.mkdtemp(dir=root)), [None],
+        )]
+        directory = tempfile.mkdtemp(dir=root)
+        build_vector_index(catalog, embedder, directory)
+        # 呼び出すたびに2つのカタログを交互に反映し、毎回1%の行が変わった状態で差分更新する
+        flips = iter(range(10))
+        results.append(measure(
+            "vector_index_update_1pct", size,
+            lambda _: build_vector_index((updated, catalog)[next(flips) % 2], embedder, directory), [None],
+        ))
+        index = load_vector_index(directory)
+        results.append(measure("vector_search_exact", size, lambda q: index.search(q, k, exact=True), queries))
+        if index.uses_ivf:
+            results.append(measure("vector_search_ivf", size, lambda q: index.search(q, k), queries))
+            agreement = []
+            for q in queries:
+                _, approx = index.search(q, k)
+                _, exact = index.search(q, k, exact=True)
+                agreement.append(float((approx >= exact[-1] - 1e-6).mean()))
+            print(f"    IVF と全件検索の一致率 (上位 {k} 件): {statistics.mean(agreement):.1%}")
+        del index # memmap を閉じてから一時ディレクトリを削除する
+    return results
+
+
+def bench_sql_scoring(profiles: list):
+    """
+    実際のDBで、SQLでの採点 (RULE_SCORING_BACKEND=sql) とカタログでの採点の一致を確認し、1件あたりの時間を計測する
+    (DATABASE_URL が必要。読み取りのみ)
+    """
+    from sqlmodel import Session
+    from app.database import get_engine
+    from app.catalog import load_catalog
+    from app.sql_scoring import rank_scholarships_sql
+
+    with Session(get_engine()) as session:
+        report = check_sql_parity(session, profiles)
+        catalog = load_catalog(session)
+        size = len(catalog)
+        results = [
+            measure("rank_scholarships_sql", size, lambda p: rank_scholarships_sql(session, p, 5), profiles),
+            # カタログの読み込みを含めた従来の経路（キャッシュが無効になった直後の1件と同じコスト）
+            measure("load_catalog+rank", size, lambda p: rank_scholarships(load_catalog(session), p, 5), profiles[:20]),
+        ]
+    return report, results
+
+
+# ====================================================================
+# ベースラインの保存・比較
+# ====================================================================
+def save_baseline(name: str, results: List[StageResult]):
+    os.makedirs(BASELINE_DIR, exist_ok=True)
+    path = os.path.join(BASELINE_DIR, f"{name}.json")
+    data = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": [asdict(r) for r in results],
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    print(f"ベースラインを保存しました: {path}")
+
+
+def compare_baseline(name: str, results: List[StageResult], tolerance: float) -> bool:
+    """p50 / p99 / ピークメモリが (1 + tolerance) 倍を超えて悪化したステージがあれば False を返す"""
+    path = os.path.join(BASELINE_DIR, f"{name}.json")
+    with open(path, "r", encoding="utf-8") as f:
+        baseline = {
+            f"{r['stage']}@{r['size']}": r for r in json.load(f)["results"]
+        }
+
+    ok = True
+    print(f"\n--- ベースライン {name} との比較 (許容 +{tolerance:.0%}) ---")
+    for r in results:
+        base = baseline.get(r.key)
+        if base is None:
+            print(f"  {r.key:40s} (ベースラインなし)")
+            continue
+        for metric in ("p50_ms", "p99_ms", "peak_memory_mb"):
+            before, after = base[metric], getattr(r, metric)
+            ratio = after / before if before else 1.0
+            regressed = ratio > 1 + tolerance
+            ok &= not regressed
+            mark = "劣化" if regressed else "OK"
+            print(f"  {r.key:40s} {metric:15s} {before:10.3f} -> {after:10.3f} ({ratio:5.2f}x) {mark}")
+    return ok
+
+
+def print_results(results: List[StageResult]):
+    print(f"\n{'stage':28s} {'size':>9s} {'calls':>6s} {'p50 ms':>10s} {'p99 ms':>10s} {'/sec':>12s} {'peak MB':>9s}")
+    for r in results:
+        print(
+            f"{r.stage:28s} {r.size:9d} {r.calls:6d} {r.p50_ms:10.3f} {r.p99_ms:10.3f} "
+            f"{r.throughput:12.1f} {r.peak_memory_mb:9.2f}"
+        )
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="マッチング・パイプラインのベンチマーク")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="カタログ件数 (カンマ区切り、最大 1000000)")
+    parser.add_argument("--profiles", type=int, default=200, help="1カタログあたりのプロフィール件数")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.3, help="同一内容のプロフィールの割合（キャッシュ評価用）")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--parity", action="store_true", help="最適化した採点経路と calculate_score の一致を確認する")
+    # Geminiスタブの設定
+    parser.add_argument("--stub-latency-ms", type=float, default=800.0)
+    parser.add_argument("--stub-jitter-ms", type=float, default=200.0)
+    parser.add_argument("--stub-failure-rate", type=float, default=0.05)
+    parser.add_argument("--stub-timeout-rate", type=float, default=0.02)
+    parser.add_argument("--stub-timeout-seconds", type=float, default=2.0)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--skip-pipeline", action="store_true", help="Geminiスタブを使ったパイプライン計測を省略する")
+    parser.add_argument("--with-db", action="store_true", help="DATABASE_URL のDBに接続してAPIエンドポイントも計測する")
+    parser.add_argument("--sql-parity", action="store_true", help="DATABASE_URL のDBで、SQLでの採点と rank_scholarships の一致を確認する")
+    parser.add_argument("--retrieval", action="store_true", help="ベクトル索引の構築・差分更新・検索を計測する")
+    # ベースライン
+    parser.add_argument("--save-baseline", metavar="NAME")
+    parser.add_argument("--compare", metavar="NAME")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="比較時に許容する悪化率 (0.2 = 20%%)")
+    args = parser.parse_args(argv)
+
+    sizes = [int(s) for s in args.sizes.split(",") if s]
+    results: List[StageResult] = []
+    parity_ok = True
+
+    for size in sizes:
+        print(f"--- カタログ {size} 件を生成中 ---")
+        catalog = generate_catalog(size, seed=args.seed)
+        profiles = list(generate_profiles(args.profiles, seed=args.seed + 1, duplicate_ratio=args.duplicate_ratio))
+
+        if args.parity:
+            report = check_parity(catalog, profiles[:50])
+            parity_ok &= report.ok
+            print(f"    一致確認: {report.checked} 件中 不一致 {len(report.mismatches)} 件")
+            for line in report.mismatches[:10]:
+                print(f"      {line}")
+
+        results.extend(bench_catalog(catalog, profiles))
+        if args.retrieval:
+            results.extend(bench_retrieval(catalog, profiles))
+        if not args.skip_pipeline:
+            stub = GeminiStub(
+                latency_ms=args.stub_latency_ms,
+                jitter_ms=args.stub_jitter_ms,
+                failure_rate=args.stub_failure_rate,
+                timeout_rate=args.stub_timeout_rate,
+                seed=args.seed,
+            )
+            results.append(bench_pipeline(catalog, profiles, stub, args.concurrency, args.stub_timeout_seconds))
+            print(f"    Geminiスタブ呼び出し {stub.calls} 回 / プロフィール {len(profiles)} 件")
+
+    if args.with_db:
+        profiles = list(generate_profiles(args.profiles, seed=args.seed + 1))
+        results.extend(bench_endpoints(profiles, min(args.profiles, 100)))
+
+    if args.sql_parity:
+        profiles = list(generate_profiles(args.profiles, seed=args.seed + 1))
+        report, sql_results = bench_sql_scoring(profiles)
+        parity_ok &= report.ok
+        results.extend(sql_results)
+        print(f"    SQL採点の一致確認: {report.checked} 件中 不一致 {len(report.mismatches)} 件")
+        for line in report.mismatches[:10]:
+            print(f"      {line}")
+
+    print_results(results)
+
+    if args.save_baseline:
+        save_baseline(args.save_baseline, results)
+    ok = parity_ok
+    if args.compare:
+        ok &= compare_baseline(args.compare, results, args.tolerance)
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
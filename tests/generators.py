@@ -0,0 +1,79 @@
+"""
+テスト用の合成データ（奨学金・プロフィール）を生成する
+同じ seed なら同じデータになる
+"""
+import random
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from app.catalog import CompiledScholarship, ScholarshipCatalog
+from app.models import Profile, Scholarship, GRADES, INCOME_BANDS, CATEGORIES, TYPES, DIFFICULTIES
+
+PREFECTURES = ["北海道", "宮城県", "東京都", "神奈川県", "新潟県", "愛知県", "京都府", "大阪府", "広島県", "福岡県", "沖縄県"]
+MAJORS = ["工学", "情報工学", "人文学", "社会科学", "理学", "医学", "看護", "教育", "芸術", "農学", "全分野"]
+INCOME_REQUIREMENTS = [
+    "条件なし", "世帯年収300万円未満", "世帯年収400万円未満", "世帯年収500万円以下",
+    "世帯年収800万円未満", "住民税非課税世帯",
+]
+OTHER_REQUIREMENTS = ["", "地方出身者", "社会的養護経験者", "成績優秀者"]
+DOCUMENTS = ["住民票", "所得証明書", "推薦書", "在学証明書", "成績証明書", "作文"]
+
+
+def generate_scholarship_rows(n: int, seed: int = 0, now: Optional[datetime] = None) -> List[Scholarship]:
+    """n件の合成奨学金を、DBの行と同じ Scholarship として生成する（締切は UTC のタイムゾーン無し）"""
+    rng = random.Random(seed)
+    now = now or datetime.utcnow()
+    rows = []
+    for i in range(1, n + 1):
+        rows.append(Scholarship(
+            id=i,
+            name=f"合成奨学金{i:07d}",
+            provider=f"合成財団{rng.randrange(max(1, n // 20)):05d}",
+            category=rng.choice(CATEGORIES),
+            type=rng.choice(TYPES),
+            amount_per_year=rng.choice([120000, 240000, 360000, 500000, 600000, 800000, 1200000]),
+            period=rng.choice(["1年間", "4年間", "大学卒業まで"]),
+            eligible_grades=rng.sample(GRADES, rng.choice([0, 1, 2, 2, 3])),
+            eligible_prefs=rng.sample(PREFECTURES, rng.choice([0, 0, 0, 1, 3, 8])),
+            fields=rng.sample(MAJORS, rng.choice([1, 1, 2, 3])),
+            income_requirement=rng.choice(INCOME_REQUIREMENTS),
+            other_requirements=rng.choice(OTHER_REQUIREMENTS),
+            deadline=(now + timedelta(days=rng.randint(-30, 365))).replace(hour=0, minute=0, second=0, microsecond=0),
+            required_docs=rng.sample(DOCUMENTS, rng.randint(1, 4)),
+            application_method=rng.choice(["Web", "郵送"]),
+            difficulty_hint=rng.choice(DIFFICULTIES),
+            url=f"https://example.org/scholarships/{i}",
+        ))
+    return rows
+
+
+def catalog_of(scholarships) -> ScholarshipCatalog:
+    """コンパイル済みの奨学金からプロセス内カタログを構築する"""
+    scholarships = tuple(scholarships)
+    return ScholarshipCatalog(
+        version=1, loaded_at=0.0, scholarships=scholarships, by_id={sch.id: sch for sch in scholarships},
+    )
+
+
+def generate_catalog(n: int, seed: int = 0, now: Optional[datetime] = None) -> ScholarshipCatalog:
+    """合成した奨学金を読み込み時と同じ手順でコンパイルし、カタログにする"""
+    return catalog_of(CompiledScholarship.from_model(row) for row in generate_scholarship_rows(n, seed, now))
+
+
+def generate_profiles(n: int, seed: int = 1) -> List[Profile]:
+    """n件の合成プロフィールを生成する"""
+    rng = random.Random(seed)
+    return [
+        Profile(
+            id=i,
+            grade=rng.choice(GRADES),
+            prefecture=rng.choice(PREFECTURES),
+            income_band=rng.choice(INCOME_BANDS),
+            major=rng.choice(MAJORS),
+            has_social_care=rng.random() < 0.1,
+            target_period=rng.choice(["1年", "4年"]),
+            has_volunteer=rng.random() < 0.3,
+            has_cram=rng.random() < 0.4,
+        )
+        for i in range(1, n + 1)
+    ]
@@ -0,0 +1,167 @@
+"""
+BatchScorer（NumPy による一括採点）が calculate_score と同じ結果を返すことを確認する
+    python -m pytest tests/test_batch_scoring.py
+"""
+import dataclasses
+from datetime import date, datetime, time, timedelta, timezone
+
+import numpy as np
+import pytest
+
+from app.batch_scoring import BatchScorer, get_batch_scorer, DEADLINE_WINDOW_DAYS, HIGH_AMOUNT_THRESHOLD
+from app.catalog import ScholarshipCatalog
+from app.eligibility_index import get_eligibility_index
+from app.matching_logic import calculate_score, rank_scholarships
+from app.models import Profile
+from app.scoring_context import ScoringContext
+from tests.generators import catalog_of, generate_catalog, generate_profiles
+
+TODAY = date(2026, 4, 1)
+
+
+def _context() -> ScoringContext:
+    return ScoringContext.for_day(TODAY)
+
+
+def _with_deadline(sch, days: int, **changes):
+    """基準日から days 日後を締切にした奨学金（その他の列は changes で上書きする）"""
+    deadline = datetime.combine(TODAY + timedelta(days=days), time.min, tzinfo=timezone.utc)
+    return dataclasses.replace(sch, deadline=deadline, deadline_date=deadline.date(), **changes)
+
+
+def _unrestricted(sch, **changes):
+    """必須条件・ボーナス条件を外した奨学金（締切と支給額以外は同点になる）"""
+    values = dict(
+        eligible_grades=frozenset(), eligible_prefs=frozenset(), fields=frozenset(),
+        income_requirement="条件なし", income_range=None, income_unrestricted=True,
+        other_requirements="", amount_per_year=100000,
+    )
+    values.update(changes)
+    return dataclasses.replace(sch, **values)
+
+
+def _reference_top_k(catalog: ScholarshipCatalog, profile: Profile, context: ScoringContext, k: int):
+    """calculate_score の単純ループで、スコア降順・締切昇順・カタログ順に上位k件を選ぶ"""
+    scores = [calculate_score(profile, sch, context) for sch in catalog.scholarships]
+    ranked = sorted(
+        (i for i, score in enumerate(scores) if score > 0),
+        key=lambda i: (-scores[i], catalog.scholarships[i].deadline, i),
+    )
+    return [(i, scores[i]) for i in ranked[:k]]
+
+
+@pytest.fixture(scope="module")
+def catalog() -> ScholarshipCatalog:
+    # 締切は基準日の前後に散らばる（締切ボーナスの有無が混ざる）
+    return generate_catalog(2000, seed=7, now=datetime.combine(TODAY, time.min))
+
+
+@pytest.fixture(scope="module")
+def profiles():
+    return generate_profiles(40, seed=11)
+
+
+@pytest.fixture
+def profile() -> Profile:
+    return Profile(
+        id=1, grade="University_1st", prefecture="東京都", income_band="300~500万", major="工学",
+        has_social_care=True, target_period="4年", has_volunteer=False, has_cram=False,
+    )
+
+
+# ====================================================================
+# 生成したカタログでの一致
+# ====================================================================
+def test_score_matches_calculate_score(catalog, profiles):
+    scorer = get_batch_scorer(catalog)
+    context = _context()
+    for profile in profiles:
+        expected = [calculate_score(profile, sch, context) for sch in catalog.scholarships]
+        assert scorer.score(profile, context).tolist() == expected
+
+
+def test_score_matrix_matches_single_profile_scores(catalog, profiles):
+    scorer = get_batch_scorer(catalog)
+    context = _context()
+    matrix = scorer.score_matrix(profiles, context)
+    for row, profile in zip(matrix, profiles):
+        assert row.tolist() == scorer.score(profile, context).tolist()
+
+
+def test_score_with_indices_matches_full_score(catalog, profiles):
+    scorer = get_batch_scorer(catalog)
+    context = _context()
+    indices = np.arange(0, len(catalog), 7)
+    for profile in profiles:
+        assert scorer.score(profile, context, indices=indices).tolist() == scorer.score(profile, context)[indices].tolist()
+
+
+def test_eligibility_index_matches_positive_scores(catalog, profiles):
+    scorer = get_batch_scorer(catalog)
+    index = get_eligibility_index(catalog)
+    context = _context()
+    for profile in profiles:
+        assert index.candidates(profile) == np.flatnonzero(scorer.score(profile, context) > 0).tolist()
+
+
+@pytest.mark.parametrize("k", [1, 5, 50])
+def test_top_k_matches_reference(catalog, profiles, k):
+    scorer = get_batch_scorer(catalog)
+    context = _context()
+    for profile in profiles:
+        expected = [i for i, _ in _reference_top_k(catalog, profile, context, k)]
+        assert scorer.top_k(scorer.score(profile, context), k).tolist() == expected
+
+
+def test_rank_scholarships_matches_reference(catalog, profiles):
+    context = _context()
+    for profile in profiles:
+        expected = [(catalog.scholarships[i].id, score) for i, score in _reference_top_k(catalog, profile, context, 5)]
+        got = [(sch.id, score) for sch, score in rank_scholarships(catalog, profile, 5, context)]
+        assert got == expected
+
+
+# ====================================================================
+# 同点・上限・締切の境界
+# ====================================================================
+def test_ties_break_by_deadline_then_catalog_order(catalog, profile):
+    base = _unrestricted(catalog.scholarships[0])
+    # 全件同点。締切は 3件ずつ同じ日にし（カタログの後ろほど早い）、k 番目の境界に同点が並ぶようにする
+    tied = catalog_of(
+        _with_deadline(base, 60 + (11 - i) // 3, id=i + 1) for i in range(12)
+    )
+    scorer = BatchScorer(tied.scholarships)
+    context = _context()
+    scores = scorer.score(profile, context)
+    assert len(set(scores.tolist())) == 1
+    for k in (1, 4, 5, 12):
+        expected = [i for i, _ in _reference_top_k(tied, profile, context, k)]
+        assert scorer.top_k(scores, k).tolist() == expected == [9, 10, 11, 6, 7, 8, 3, 4, 5, 0, 1, 2][:k]
+    # indices を指定した場合も、カタログ上の位置を締切昇順で返す
+    indices = np.array([2, 5, 11, 8])
+    assert scorer.top_k(scorer.score(profile, context, indices=indices), 3, indices=indices).tolist() == [11, 8, 5]
+
+
+def test_score_is_capped_at_one(catalog, profile):
+    # 基本点 0.1 + 社会的養護 0.5 + 専攻 0.2 + 締切 0.1 + 支給額 0.3 = 1.2 は 1.0 になる
+    sch = _with_deadline(
+        _unrestricted(
+            catalog.scholarships[0],
+            eligible_grades=frozenset({profile.grade}), eligible_prefs=frozenset({profile.prefecture}),
+            fields=frozenset({profile.major}), other_requirements="社会的養護経験者", amount_per_year=HIGH_AMOUNT_THRESHOLD,
+        ),
+        10, id=1,
+    )
+    context = _context()
+    assert calculate_score(profile, sch, context) == 1.0
+    assert BatchScorer([sch]).score(profile, context).tolist() == [1.0]
+
+
+@pytest.mark.parametrize("days", [-1, 0, 1, DEADLINE_WINDOW_DAYS - 1, DEADLINE_WINDOW_DAYS, DEADLINE_WINDOW_DAYS + 1])
+def test_deadline_window_edges(catalog, profile, days):
+    sch = _with_deadline(_unrestricted(catalog.scholarships[0]), days, id=1)
+    context = _context()
+    expected = calculate_score(profile, sch, context)
+    assert BatchScorer([sch]).score(profile, context).tolist() == [expected]
+    # 締切ボーナスは基準日の 1〜30日後のみ（当日・締切後・31日後は付かない）
+    assert (expected > 0.1) == (0 < days <= DEADLINE_WINDOW_DAYS)
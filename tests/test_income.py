@@ -0,0 +1,68 @@
+"""
+年収条件の解析 (parse_income_requirement) と年収範囲での判定を確認する
+    python -m pytest tests/test_income.py
+"""
+import pytest
+
+from app.income import IncomeRange, parse_income_requirement, ranges_overlap, stored_income_range
+from app.matching_logic import get_income_score, income_range_matches
+from app.models import INCOME_BANDS
+
+
+@pytest.mark.parametrize("text, expected", [
+    ("世帯年収400万円未満", IncomeRange(0, 4_000_000)),
+    ("世帯年収４００万円未満", IncomeRange(0, 4_000_000)), # 全角数字
+    ("300~500万", IncomeRange(3_000_000, 5_000_000)),
+    ("300〜500万円", IncomeRange(3_000_000, 5_000_000)),
+    ("~300万", IncomeRange(0, 3_000_000)),
+    ("1000万~", IncomeRange(10_000_000, None)),
+    ("世帯年収1,200万円以上", IncomeRange(12_000_000, None)),
+    ("年収800万円を超える", IncomeRange(8_000_001, None)),
+    ("条件なし", IncomeRange(0, None)),
+    ("不問", IncomeRange(0, None)),
+    ("", IncomeRange(0, None)),
+])
+def test_parse_income_requirement(text, expected):
+    assert parse_income_requirement(text) == expected
+
+
+def test_inclusive_upper_bound_becomes_half_open():
+    # [min, max) で表すため、「以下」「まで」は上限の1円上を max にする
+    assert parse_income_requirement("世帯年収500万円以下") == IncomeRange(0, 5_000_001)
+    assert parse_income_requirement("年収500万円まで") == IncomeRange(0, 5_000_001)
+    # 500万円ちょうどから始まる年収バンドは「以下」には重なり、「未満」には重ならない
+    band = parse_income_requirement("500~700万")
+    assert ranges_overlap(band, parse_income_requirement("世帯年収500万円以下"))
+    assert not ranges_overlap(band, parse_income_requirement("世帯年収500万円未満"))
+
+
+@pytest.mark.parametrize("text", ["住民税非課税世帯", "生活保護受給世帯", "家計急変世帯"])
+def test_unparsable_requirement_returns_none(text):
+    assert parse_income_requirement(text) is None
+
+
+def test_all_income_bands_are_parsable():
+    assert all(parse_income_requirement(band) is not None for band in INCOME_BANDS)
+
+
+def test_stored_columns_take_precedence_over_text():
+    assert stored_income_range(0, 3_000_000, "世帯年収400万円未満") == IncomeRange(0, 3_000_000)
+    assert stored_income_range(None, None, "世帯年収400万円未満") == IncomeRange(0, 4_000_000)
+    assert stored_income_range(None, None, "住民税非課税世帯") is None
+
+
+@pytest.mark.parametrize("band, requirement, expected", [
+    ("300~500万", "条件なし", True),
+    ("300~500万", "世帯年収400万円未満", True),
+    ("300~500万", "世帯年収300万円未満", False),
+    ("300~500万", "1000万~", False),
+    ("300~500万", "住民税非課税世帯", False),
+    # 解析できない年収バンドは「条件なし」と部分一致のみで判定する（上限なしの区間でも適合としない）
+    ("非課税", "住民税非課税世帯", True),
+    ("非課税", "条件なし", True),
+    ("非課税", "不問", False),
+])
+def test_income_range_matches(band, requirement, expected):
+    band_range = parse_income_requirement(band)
+    assert income_range_matches(band, band_range, requirement, parse_income_requirement(requirement)) is expected
+    assert get_income_score(band, requirement) == (1.0 if expected else 0.0)
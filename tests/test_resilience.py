@@ -0,0 +1,43 @@
+"""
+AdaptiveLimiter を複数のイベントループから使えることを確認する
+    python -m pytest tests/test_resilience.py
+"""
+import asyncio
+import threading
+
+from app.resilience import AdaptiveLimiter
+
+
+async def _contend(limiter: AdaptiveLimiter, tasks: int = 4):
+    """上限を超える数のタスクで枠を取り合い、同時実行数の最大値を返す"""
+    peak = 0
+
+    async def call():
+        nonlocal peak
+        async with limiter.slot():
+            peak = max(peak, limiter.in_flight)
+            await asyncio.sleep(0.01)
+
+    await asyncio.gather(*(call() for _ in range(tasks)))
+    return peak
+
+
+def test_limiter_can_be_reused_by_another_event_loop():
+    limiter = AdaptiveLimiter("test", min_limit=1, max_limit=2, initial_limit=2)
+    # asyncio.run ごとに新しいイベントループになる（CLI のバッチ処理やテストと同じ使い方）
+    assert asyncio.run(_contend(limiter)) == 2
+    assert asyncio.run(_contend(limiter)) == 2
+    assert limiter.in_flight == 0
+
+
+def test_limiter_is_shared_by_loops_in_different_threads():
+    limiter = AdaptiveLimiter("test", min_limit=1, max_limit=2, initial_limit=2)
+    peaks = []
+    threads = [threading.Thread(target=lambda: peaks.append(asyncio.run(_contend(limiter)))) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    assert len(peaks) == 3
+    assert max(peaks) <= 2 # 実行中の件数はスレッドをまたいで上限以内
+    assert limiter.in_flight == 0